@@ -0,0 +1,315 @@
+from time import ticks_ms, ticks_add, ticks_diff, sleep_ms
+from stopwatch import Stopwatch
+
+def lcm(a:int, b:int) -> int:
+    x, y = a, b
+    while y:
+        x, y = y, x % y
+    return a * b // x
+
+
+class Effect:
+    """
+    An LED effect as a state machine. The engine calls frame() when the next frame is due, frame() draws it into
+    the strip's framebuffer without writing and returns the milliseconds until the next frame, or -1 when done.
+    finish() is called once when the effect ends, by itself or through Animation_Engine.stop().
+    """
+
+    def __init__(self) -> None:
+        self.led = None
+        self.next_ms = 0
+        self.finished = False
+
+    def start(self, led, now_ms:int) -> None:
+        self.led = led
+        self.next_ms = now_ms
+        self.finished = False
+
+    def frame(self, now_ms:int) -> int:
+        return -1
+
+    def finish(self) -> None:
+        pass
+
+
+class Solid(Effect):
+    # One color on the whole strip for a while, (0,0,0) is a pause with the LEDs off
+
+    def __init__(self, color:tuple, duration_ms:int) -> None:
+        super().__init__()
+        self.color = color
+        self.duration_ms = duration_ms
+        self.shown = False
+
+    def start(self, led, now_ms:int) -> None:
+        super().start(led, now_ms)
+        self.shown = False
+
+    def frame(self, now_ms:int) -> int:
+        if self.shown:
+            return -1
+        self.shown = True
+        self.led.led_on(self.color, False)
+        return self.duration_ms
+
+
+class Flash_Double(Effect):
+    # Same timing as LED_Strip.led_flash_double, on - off - on - off and a pause between each double flash
+
+    def __init__(self, color:tuple, flashes:int = 1, on_time_ms:int = 60, delay_time_ms:int = 75, off_time_ms:int = 1500) -> None:
+        super().__init__()
+        self.phases = []
+        for i in range(flashes):
+            pause = 0 if i + 1 == flashes else off_time_ms
+            self.phases += [(color, on_time_ms), (None, delay_time_ms), (color, on_time_ms), (None, pause)]
+        self.phase = 0
+
+    def start(self, led, now_ms:int) -> None:
+        super().start(led, now_ms)
+        self.phase = 0
+
+    def frame(self, now_ms:int) -> int:
+        if self.phase >= len(self.phases):
+            return -1
+        color, duration = self.phases[self.phase]
+        self.phase += 1
+        if color == None:
+            self.led.led_off(False)
+        else:
+            self.led.led_on(color, False)
+        return duration
+
+
+class Rainbow_Trail(Effect):
+    """
+    Same frames as LED_Strip.led_rainbow_trail. Runs until stopped when seconds is 0, and turns the LEDs off at the end.
+    With cache=True the trail starts on a dark strip, which makes its frames repeat, and they are replayed from the
+    engine's Frame_Cache once they have been drawn. The rainbow repeats only every lcm(LED_PIXELS, 508) frames, so it
+    rarely fits the budget and is drawn live instead
+    """
+
+    def __init__(self, interval:int = 20, trail_length:int = 25, seconds:int = 0, colors:tuple = ("rainbow","rainbow","rainbow"), cache:bool = False) -> None:
+        super().__init__()
+        self.interval = interval
+        self.trail_length = trail_length
+        self.seconds = seconds
+        self.colors = colors
+        self.cache = cache
+
+    def start(self, led, now_ms:int) -> None:
+        super().start(led, now_ms)
+        self.stopwatch = Stopwatch(now=now_ms)
+        self.angle = 1
+        self.pixel = 0
+        self.direction = 1
+        self.index = 0
+        if self.cache:
+            led.led_off(False)
+            # The first trail_length frames have no tail behind the start, after that the frames repeat
+            period = led.LED_PIXELS
+            if self.colors == ("rainbow","rainbow","rainbow"):
+                period = lcm(period, 2 * 254) # The angle goes 1 -> 255 -> 1
+            key = (self.trail_length, self.colors, led.LED_PIXELS, led.LED_BRIGHTNESS, led.LED_GAMMA)
+            led.animations.cache.bind(key, self.trail_length, period, led.LED_PIXELS * 3)
+            self.key = key
+
+    def frame(self, now_ms:int) -> int:
+        led = self.led
+        if self.seconds > 0 and self.stopwatch.expired(self.seconds * 1000, now_ms):
+            return -1
+        # Frames are only cached and replayed while the trail is the only effect, replaying would erase the others
+        cache = None
+        if self.cache and len(led.animations.effects) == 1 and led.animations.cache.key == self.key:
+            cache = led.animations.cache
+        if cache == None or not cache.replay(self.index, led.framebuffer):
+            self.draw()
+            if cache != None: cache.store(self.index, led.framebuffer)
+        self.index += 1
+        if self.pixel >= led.LED_PIXELS - 1: self.pixel = 0
+        else: self.pixel += 1
+        if self.angle == 255:
+            self.direction = -1
+        elif self.angle == 1:
+            self.direction = 1
+        self.angle += self.direction
+        return self.interval
+
+    def draw(self) -> None:
+        led = self.led
+        if self.colors == ("rainbow","rainbow","rainbow"):
+            led.hue_into(self.angle, led.rgb)
+            led.framebuffer.set_pixel(self.pixel, led.rgb[0], led.rgb[1], led.rgb[2])
+        else: led.led_on_single(self.pixel, self.colors, False)
+        if self.trail_length <= self.pixel:
+            led.framebuffer.set_pixel(self.pixel - self.trail_length, 0, 0, 0)
+        else:
+            led.framebuffer.set_pixel(led.LED_PIXELS - self.trail_length + self.pixel, 0, 0, 0)
+
+    def finish(self) -> None:
+        self.led.led_off(False)
+
+
+class Sequence(Effect):
+    # Runs the effects one after the other
+
+    def __init__(self, *effects) -> None:
+        super().__init__()
+        self.effects = effects
+        self.current = 0
+
+    def start(self, led, now_ms:int) -> None:
+        super().start(led, now_ms)
+        self.current = 0
+        self.effects[0].start(led, now_ms)
+
+    def frame(self, now_ms:int) -> int:
+        while self.current < len(self.effects):
+            delay = self.effects[self.current].frame(now_ms)
+            if delay >= 0:
+                return delay
+            self.effects[self.current].finish()
+            self.current += 1
+            if self.current < len(self.effects):
+                self.effects[self.current].start(self.led, now_ms)
+        return -1
+
+    def finish(self) -> None:
+        if self.current < len(self.effects):
+            self.effects[self.current].finish()
+
+
+class Frame_Cache:
+    """
+    Whole strip frames of one periodic effect, kept in a buffer of BUDGET bytes that is allocated the first time an effect
+    that fits is bound, so a program that never plays a cached effect doesn't spend the heap on it. Frames are stored the
+    first time they are drawn and replayed with a slice copy into the framebuffer after that, also the next time the
+    same effect plays. An effect that needs more than the budget is not bound and is drawn live.
+    Frame index i is stored in slot i for the first warmup frames, after that the frames repeat every period frames.
+    """
+
+    def __init__(self, budget_bytes:int = 8192) -> None:
+        self.BUDGET = budget_bytes
+        self.buffer = None
+        self.frames = None
+        self.key = None
+        self.warmup = 0
+        self.period = 0
+        self.frame_size = 0
+        self.stored = bytearray(0) # 1 for every slot that holds a frame
+        self.hits = 0
+        self.misses = 0
+
+    def bind(self, key, warmup:int, period:int, frame_size:int) -> bool:
+        # Makes room for the effect's frames, the frames of the effect bound before are dropped
+        if key == self.key:
+            return True
+        if (warmup + period) * frame_size > self.BUDGET:
+            return False
+        if self.buffer == None:
+            self.buffer = bytearray(self.BUDGET)
+            self.frames = memoryview(self.buffer)
+        self.key = key
+        self.warmup = warmup
+        self.period = period
+        self.frame_size = frame_size
+        self.stored = bytearray(warmup + period)
+        return True
+
+    def slot(self, index:int) -> int:
+        if index < self.warmup:
+            return index
+        return self.warmup + (index - self.warmup) % self.period
+
+    def replay(self, index:int, framebuffer) -> bool:
+        slot = self.slot(index)
+        if not self.stored[slot]:
+            self.misses += 1
+            return False
+        start = slot * self.frame_size
+        framebuffer.load(self.frames[start:start + self.frame_size])
+        self.hits += 1
+        return True
+
+    def store(self, index:int, framebuffer) -> None:
+        slot = self.slot(index)
+        start = slot * self.frame_size
+        self.frames[start:start + self.frame_size] = framebuffer.frame
+        self.stored[slot] = 1
+
+    def hit_rate(self) -> float:
+        if self.hits + self.misses == 0:
+            return 0.0
+        return self.hits / (self.hits + self.misses)
+
+    def bytes_used(self) -> int:
+        return sum(self.stored) * self.frame_size
+
+
+class Animation_Engine:
+    """
+    Runs any number of effects on one LED strip without blocking. Call tick() from the control loop, it draws every
+    effect that is due, writes the strip once and returns the milliseconds until the next frame is due (None when idle).
+    Effects started later draw on top of earlier ones.
+    """
+
+    def __init__(self, led, cache_bytes:int = 8192) -> None:
+        self.led = led
+        self.effects = []
+        self.cache = Frame_Cache(cache_bytes)
+        self.on_play = None # Called when an effect starts, so whoever ticks the engine can wake up
+
+    def play(self, effect:Effect, now_ms:int = None) -> Effect:
+        if now_ms == None: now_ms = ticks_ms()
+        effect.start(self.led, now_ms)
+        self.effects.append(effect)
+        if self.on_play != None: self.on_play()
+        return effect
+
+    def stop(self, effect:Effect = None) -> None:
+        # Stops one effect, or all of them
+        for running in list(self.effects):
+            if effect == None or running == effect:
+                self.effects.remove(running)
+                running.finished = True
+                running.finish()
+        self.led.framebuffer.write()
+
+    def is_running(self, effect:Effect = None) -> bool:
+        if effect == None:
+            return len(self.effects) > 0
+        return effect in self.effects
+
+    def next_due(self, now_ms:int = None):
+        if not self.effects:
+            return None
+        if now_ms == None: now_ms = ticks_ms()
+        due = None
+        for effect in self.effects:
+            wait = ticks_diff(effect.next_ms, now_ms)
+            if due == None or wait < due:
+                due = wait
+        return max(due, 0)
+
+    def tick(self, now_ms:int = None):
+        if now_ms == None: now_ms = ticks_ms()
+        for effect in list(self.effects):
+            while not effect.finished and ticks_diff(now_ms, effect.next_ms) >= 0:
+                delay = effect.frame(now_ms)
+                if delay < 0:
+                    effect.finished = True
+                    effect.finish()
+                    self.effects.remove(effect)
+                else:
+                    # Frames are due at fixed steps, but a tick that comes too late skips ahead instead of catching up
+                    effect.next_ms = ticks_add(effect.next_ms, delay)
+                    if ticks_diff(effect.next_ms, now_ms) < 0:
+                        effect.next_ms = ticks_add(now_ms, delay)
+        self.led.framebuffer.write()
+        return self.next_due(now_ms)
+
+    def wait(self, effect:Effect = None) -> None:
+        # Blocks until the effect, or every effect, is done. For code that has nothing else to do meanwhile
+        while self.is_running(effect):
+            due = self.tick()
+            if due != None and self.is_running(effect):
+                sleep_ms(due)
@@ -0,0 +1,73 @@
+class Calibration:
+    """
+    Maps raw ADC readings to moisture percent through a table with one byte per 16 ADC counts, so a reading
+    becomes a percent with one shift and one index. The table is built from two or more calibration points
+    (raw, percent), straight lines between them and flat beyond the first and last one, in integers only.
+    The points are kept in the settings as text, "17900=100 65535=0", under the key given to load() and save().
+    The settings record has one such field, moisture_calibration, for the board's one moisture sensor.
+    """
+
+    def __init__(self, points:tuple) -> None:
+        self.SHIFT = 4 # read_u16() >> 4 is the index, 4096 entries
+        self.points = self.check(points)
+        self.table = bytearray(65536 >> self.SHIFT)
+        self.build()
+
+    def check(self, points) -> tuple:
+        points = sorted((int(raw), int(percent)) for raw, percent in points)
+        if len(points) < 2:
+            raise ValueError("Calibration needs at least two points")
+        for i in range(len(points)):
+            raw, percent = points[i]
+            if not 0 <= raw <= 65535 or not 0 <= percent <= 100:
+                raise ValueError(f"Calibration point {raw}={percent} is out of range")
+            if i > 0 and raw == points[i - 1][0]:
+                raise ValueError(f"Two calibration points for the raw value {raw}")
+        return tuple(points)
+
+    def build(self) -> None:
+        table = self.table
+        points = self.points
+        half = 1 << (self.SHIFT - 1) # Every entry is worked out for the middle of its 16 raw values
+        segment = 0
+        for i in range(len(table)):
+            raw = (i << self.SHIFT) + half
+            while segment < len(points) - 2 and raw > points[segment + 1][0]:
+                segment += 1
+            raw0, percent0 = points[segment]
+            raw1, percent1 = points[segment + 1]
+            if raw <= raw0:
+                table[i] = percent0
+            elif raw >= raw1:
+                table[i] = percent1
+            else:
+                span = raw1 - raw0 # Rounded to the nearest percent with floor(x + 1/2), also when the line goes down
+                table[i] = percent0 + ((percent1 - percent0) * (raw - raw0) * 2 + span) // (2 * span)
+
+    def percent(self, raw:int) -> int:
+        return self.table[raw >> self.SHIFT]
+
+    def to_text(self) -> str:
+        return " ".join([f"{raw}={percent}" for raw, percent in self.points])
+
+    @staticmethod
+    def from_text(text:str) -> "Calibration":
+        points = []
+        for point in text.split():
+            raw, percent = point.split("=")
+            points.append((raw, percent))
+        return Calibration(points)
+
+    @staticmethod
+    def load(files, key:str, default:tuple) -> "Calibration":
+        # The calibration saved under key, or default when there is none or it can't be read
+        text = files.get_setting(key)
+        if text:
+            try:
+                return Calibration.from_text(text)
+            except ValueError as e:
+                print(f"Calibration {key} ignored: {e}") # <----------------------------------------------------------- #DEBUG
+        return Calibration(default)
+
+    def save(self, files, key:str) -> None:
+        files.write_settings({key:self.to_text()})
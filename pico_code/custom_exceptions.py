@@ -6,4 +6,9 @@ class CustomError(Exception):
 class WiFiError(Exception):
     "Raised when something is wrong with the wifi-connection"
     def __init__(self) -> None:
-        super().__init__("There was a problem with the WiFi-connection")
\ No newline at end of file
+        super().__init__("There was a problem with the WiFi-connection")
+
+class NTPError(Exception):
+    "Raised when no NTP server gave a usable time before the deadline"
+    def __init__(self) -> None:
+        super().__init__("No usable answer from the NTP servers")
\ No newline at end of file
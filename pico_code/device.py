@@ -1,20 +1,37 @@
-from socket import socket, AF_INET, SOCK_DGRAM, getaddrinfo
-from struct import unpack
+from struct import pack, unpack, calcsize
 from network import WLAN, STA_IF
 from time import gmtime, mktime, sleep_ms, localtime
-from machine import RTC, Pin, reset
+from machine import RTC, Pin, Timer, reset
 from neopixel import NeoPixel
-from os import listdir
+from os import listdir, rename, remove
 import _thread
+import uasyncio as asyncio # On the host the simulator puts its stand-in in sys.modules, see simulator/aio.py
 from custom_exceptions import *
+from animation import Animation_Engine, Flash_Double, Rainbow_Trail
+from timezone import Transition_Table, DEFAULT_RULE
+from ntp import NTP_Client
+from stopwatch import Stopwatch
 
 class Microcontroller:
+    """
+    The DIP switches are read once into switches, (wetness, turn rate), and after that only when a switch pin changes:
+    the pin IRQ (re)starts a one-shot timer, and when the pins have been quiet for DEBOUNCE_MS the timer reads them again.
+    check_setting_wetness() and check_setting_turn_rate() just look up the snapshot. When it changes, on_change() is
+    called from the timer callback, which is a soft IRQ, so it should only set flags like Scheduler.wake_from_irq().
+    """
+    switches = None # Shared by every Microcontroller object, the pins only have one IRQ handler each
+    on_change = None
+    debounce_timer = None
+
     def __init__(self) -> None:
+        self.DEBOUNCE_MS = 50
         self.input_SIGINT = Pin(0, Pin.IN, Pin.PULL_DOWN)
         self.input_2wk = Pin(27, Pin.IN, Pin.PULL_DOWN)
         self.input_6wk = Pin(28, Pin.IN, Pin.PULL_DOWN)
         self.input_dry = Pin(22, Pin.IN, Pin.PULL_DOWN)
         self.input_wet = Pin(16, Pin.IN, Pin.PULL_DOWN)
+        if Microcontroller.switches == None:
+            self.watch_switches()
 
     def check_SIGINT(self) -> bool:
         if self.input_SIGINT.value() == 1:
@@ -22,31 +39,133 @@ class Microcontroller:
         else: return False
     
     def check_setting_wetness(self) -> str:
+        return Microcontroller.switches[0]
+        
+    def check_setting_turn_rate(self) -> int:
+        return Microcontroller.switches[1]
+
+    def watch_switches(self) -> None:
+        Microcontroller.debounce_timer = Timer()
+        Microcontroller.switches = self.read_switches()
+        for pin in (self.input_2wk, self.input_6wk, self.input_dry, self.input_wet):
+            pin.irq(handler=self.switch_moved, trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING)
+
+    def switch_moved(self, pin) -> None:
+        # Every bounce starts the wait over
+        Microcontroller.debounce_timer.init(mode=Timer.ONE_SHOT, period=self.DEBOUNCE_MS, callback=self.switches_settled)
+
+    def switches_settled(self, timer) -> None:
+        switches = self.read_switches()
+        if switches != Microcontroller.switches:
+            Microcontroller.switches = switches
+            if Microcontroller.on_change != None: Microcontroller.on_change()
+
+    def read_switches(self) -> tuple:
         if self.input_wet.value() == 1:
-            return "wet"
+            wetness = "wet"
         elif self.input_wet.value() == 0 and self.input_dry.value() == 0:
-            return "normal"
+            wetness = "normal"
         elif self.input_dry.value() == 1:
-            return "dry"
-        else: return "error"
-        
-    def check_setting_turn_rate(self) -> int:
+            wetness = "dry"
+        else: wetness = "error"
         if self.input_2wk.value() == 1:
-            return 2
+            turn_rate = 2
         elif self.input_2wk.value() == 0 and self.input_6wk.value() == 0:
-            return 4
+            turn_rate = 4
         elif self.input_6wk.value() == 1:
-            return 6  
-        else: return 0
+            turn_rate = 6
+        else: turn_rate = 0
+        return (wetness, turn_rate)
+
+
+class Frame_Buffer:
+    """
+    The pixels of the LED strip as one bytearray in the strip's own byte order (GRB), with a memoryview in frame.
+    Changing a pixel marks the frame dirty, and write() only sends it to the strip when it is dirty and differs from
+    what the strip shows, so writes and skipped_writes count what actually reached the strip.
+    Colors given here are already scaled, LED_Strip does the brightness and gamma.
+    """
+
+    def __init__(self, pin:int, pixels:int) -> None:
+        self.strip = NeoPixel(Pin(pin), pixels)
+        self.pixels = pixels
+        self.buf = self.strip.buf
+        self.frame = memoryview(self.buf)
+        self.shown = bytearray(len(self.buf))
+        self.dirty = False
+        self.writes = 0
+        self.skipped_writes = 0
+        self.R = self.strip.ORDER[0]
+        self.G = self.strip.ORDER[1]
+        self.B = self.strip.ORDER[2]
+
+    def set_pixel(self, pixel:int, red:int, green:int, blue:int) -> None:
+        i = pixel * 3
+        buf = self.buf
+        if buf[i + self.R] != red or buf[i + self.G] != green or buf[i + self.B] != blue:
+            buf[i + self.R] = red
+            buf[i + self.G] = green
+            buf[i + self.B] = blue
+            self.dirty = True
+
+    def fill_range(self, start:int, stop:int, red:int, green:int, blue:int) -> None:
+        # Sets the first pixel, then doubles the filled part with slice copies until the range is full
+        if stop <= start:
+            return
+        first = start * 3
+        end = stop * 3
+        self.buf[first + self.R] = red
+        self.buf[first + self.G] = green
+        self.buf[first + self.B] = blue
+        filled = 3
+        while first + filled < end:
+            size = min(filled, end - first - filled)
+            self.frame[first + filled:first + filled + size] = self.frame[first:first + size]
+            filled += size
+        self.dirty = True
+
+    def fill(self, red:int, green:int, blue:int) -> None:
+        self.fill_range(0, self.pixels, red, green, blue)
+
+    def load(self, frame) -> None:
+        # Copies a whole frame, e.g. from animation.Frame_Cache, into the buffer
+        self.frame[:] = frame
+        self.dirty = True
+
+    def write(self, force:bool = False) -> None:
+        if not force and (not self.dirty or self.buf == self.shown):
+            self.dirty = False
+            self.skipped_writes += 1
+            return
+        self.strip.write()
+        self.shown[:] = self.buf
+        self.dirty = False
+        self.writes += 1
 
 
 class LED_Strip():
+    hue_table = None # 360 packed RGB colors from calculate_hue, shared by every LED_Strip
+    framebuffer = None # Every LED_Strip drives the same physical strip, so they share one Frame_Buffer
+    animations = None # and one Animation_Engine
 
-    def __init__(self, led_brightness:int = 25) -> None:
+    def __init__(self, led_brightness:int = 25, led_gamma:float = 1.0) -> None:
 
         self.LED_PIXELS = 47
-        self.LED_BRIGHTNESS = led_brightness # Sættes ved instantiering af objektet - Værdi mellem 1 og 100, hvor 100 er mest lys og 1 er næsten ingen lys
-        self.led_strip = NeoPixel(Pin(17), self.LED_PIXELS)
+        if LED_Strip.hue_table == None:
+            LED_Strip.hue_table = bytearray(360 * 3)
+            for angle in range(360):
+                LED_Strip.hue_table[angle * 3:angle * 3 + 3] = bytes(self.calculate_hue(angle))
+        self.rgb = bytearray(3) # Buffer for hue_into in the rainbow trail
+        self.led_brightness = led_brightness # Sættes ved instantiering af objektet - Værdi mellem 1 og 100, hvor 100 er mest lys og 1 er næsten ingen lys
+        self.led_gamma = led_gamma # 1.0 viser farverne som de er, omkring 2.2 får fades til at se jævne ud for øjet
+        self.build_gamma_table()
+        if LED_Strip.framebuffer == None:
+            LED_Strip.framebuffer = Frame_Buffer(17, self.LED_PIXELS)
+        self.framebuffer = LED_Strip.framebuffer
+        if LED_Strip.animations == None:
+            LED_Strip.animations = Animation_Engine(self)
+        self.animations = LED_Strip.animations
+        self.led_strip = self.framebuffer.strip
         self.trail_stop = False
 
         # Colors
@@ -55,6 +174,19 @@ class LED_Strip():
         self.blue = (0, 10, 255)
 
     def hue_to_rgb(self, angle:int) -> tuple:
+        i = (angle % 360) * 3
+        table = LED_Strip.hue_table
+        return (table[i], table[i + 1], table[i + 2])
+
+    def hue_into(self, angle:int, buffer, offset:int = 0) -> None:
+        # Brightness-scaled RGB of the hue written into buffer[offset:offset + 3], allocates nothing
+        i = (angle % 360) * 3
+        table = self.hue_table_scaled
+        buffer[offset] = table[i]
+        buffer[offset + 1] = table[i + 1]
+        buffer[offset + 2] = table[i + 2]
+
+    def calculate_hue(self, angle:int) -> tuple:
             # Inspiration: Ontaelio(2016?) https://www.instructables.com/How-to-Make-Proper-Rainbow-and-Random-Colors-With-/
             if angle < 60:
                 red = 255; green = round(angle*4.25-0.01); blue = 0
@@ -70,169 +202,252 @@ class LED_Strip():
                 red = 255; green = 0; blue = round((360-angle)*4.25-0.01)
             return (red, green, blue)
 
-    def led_on(self, color:tuple) -> None:
-        LED_R = int((color[0] / 100) * self.LED_BRIGHTNESS)
-        LED_G = int((color[1] / 100) * self.LED_BRIGHTNESS)
-        LED_B = int((color[2] / 100) * self.LED_BRIGHTNESS)
-
-        for i in range(self.LED_PIXELS):
-            self.led_strip[i] = (LED_R, LED_G, LED_B)
-        self.led_strip.write()
+    # Colors are scaled through color_table, a 256-entry bytearray with gamma and brightness applied, and the hues
+    # for the rainbow through hue_table_scaled. Both are rebuilt whenever LED_BRIGHTNESS or LED_GAMMA is changed
+
+    @property
+    def LED_BRIGHTNESS(self) -> int:
+        return self.led_brightness
+
+    @LED_BRIGHTNESS.setter
+    def LED_BRIGHTNESS(self, led_brightness:int) -> None:
+        self.led_brightness = led_brightness
+        self.build_color_table()
+
+    @property
+    def LED_GAMMA(self) -> float:
+        return self.led_gamma
+
+    @LED_GAMMA.setter
+    def LED_GAMMA(self, led_gamma:float) -> None:
+        self.led_gamma = led_gamma
+        self.build_gamma_table()
+
+    def build_gamma_table(self) -> None:
+        self.gamma_table = bytearray(256)
+        for value in range(256):
+            self.gamma_table[value] = round(255 * (value / 255) ** self.led_gamma)
+        self.build_color_table()
+
+    def build_color_table(self) -> None:
+        self.brightness_table = bytearray(256)
+        self.color_table = bytearray(256)
+        for value in range(256):
+            self.brightness_table[value] = int((value / 100) * self.led_brightness)
+        for value in range(256):
+            self.color_table[value] = self.brightness_table[self.gamma_table[value]]
+        self.hue_table_scaled = bytearray(360 * 3)
+        for i in range(360 * 3):
+            self.hue_table_scaled[i] = self.color_table[LED_Strip.hue_table[i]]
+
+    def led_on(self, color:tuple, write:bool = True) -> None:
+        table = self.color_table
+        self.framebuffer.fill(table[color[0]], table[color[1]], table[color[2]])
+        if write: self.framebuffer.write()
 
     def led_on_single(self, pixel:int, color:tuple, write:bool = True) -> None:
-        LED_R = int((color[0] / 100) * self.LED_BRIGHTNESS)
-        LED_G = int((color[1] / 100) * self.LED_BRIGHTNESS)
-        LED_B = int((color[2] / 100) * self.LED_BRIGHTNESS)
+        table = self.color_table
+        self.framebuffer.set_pixel(pixel, table[color[0]], table[color[1]], table[color[2]])
+        if write: self.framebuffer.write()
 
-        self.led_strip[pixel] = (LED_R, LED_G, LED_B)
-        if write: self.led_strip.write()
+    def led_off(self, write:bool = True) -> None:
+        self.framebuffer.fill(0, 0, 0)
+        if write: self.framebuffer.write()
 
-    def led_off(self) -> None:
-        for i in range(self.LED_PIXELS):
-            self.led_strip[i] = (0, 0, 0)
-        self.led_strip.write()
+    # The two effects below block until they are done. The control loop plays Flash_Double and Rainbow_Trail on
+    # self.animations instead, so the effects run from its ticks
 
     def led_flash_double(self, flashes:int = 1, on_time_ms:int = 60, delay_time_ms:int = 75, off_time_ms:int = 1500, color:tuple = (0,0,0)) -> None:
         if color == (0,0,0):
             color = self.blue
-        for i in range(flashes):
-            self.led_on(color)
-            sleep_ms(on_time_ms)
-            self.led_off()
-            sleep_ms(delay_time_ms)
-            self.led_on(color)
-            sleep_ms(on_time_ms)
-            self.led_off()
-            if not i + 1 == flashes:
-                sleep_ms(off_time_ms)
+        flash = self.animations.play(Flash_Double(color, flashes, on_time_ms, delay_time_ms, off_time_ms))
+        self.animations.wait(flash)
 
     def led_rainbow_trail(self, interval:int = 20, trail_length:int = 25, seconds:int = 0, colors:tuple = ("rainbow","rainbow","rainbow")) -> None:
-        stopwatch = Stopwatch()
+        # Runs until the time is up, or until trail_stop is set when seconds is 0
         self.trail_stop = False
-        angle = 1
-        led = 0
-        direction = 1
-        while self.trail_stop == False:
-            if colors == ("rainbow","rainbow","rainbow"):
-                color = self.hue_to_rgb(angle)
-            else: color = colors
-            self.led_on_single(led, color, False)
-            if trail_length <= led:
-                off_led = led - trail_length
-                self.led_strip[off_led] = (0, 0, 0)
+        trail = self.animations.play(Rainbow_Trail(interval, trail_length, seconds, colors))
+        while self.animations.is_running(trail):
+            if self.trail_stop:
+                self.animations.stop(trail)
             else:
-                off_led = self.LED_PIXELS - trail_length + led
-                self.led_strip[off_led] = (0, 0, 0)
-            self.led_strip.write()
-            if led >= self.LED_PIXELS - 1: led = 0
-            else: led += 1
-            if angle == 255:
-                direction = -1
-            elif angle == 1:
-                direction = 1
-            angle += 1 * direction
-            sleep_ms(interval)
-            if stopwatch.get_time() >= seconds and seconds > 0: break
+                due = self.animations.tick()
+                if due != None: sleep_ms(due)
         self.trail_stop = True
-        self.led_off()        
 
 class Time:
-
-    def __init__(self) -> None:
+    """
+    The clock is set from NTP once per boot and after that kept right locally: sync() measures how far the RTC has
+    drifted since the last sync, and local_now() and utc_now() take the drift predicted since then off the RTC.
+    A new sync is only needed when the error the drift estimate could still have reaches SYNC_TOLERANCE seconds,
+    see needs_sync(). The drift is kept in the settings in ppb, for the next boot.
+    """
+    synced_utc = None # UTC of the last NTP sync this boot, the RTC was set to it. Shared by every Time object
+    rtc_adjust = 0 # Seconds correct_rtc() has moved the RTC since then
+    rtc_tz_offset = 0 # UTC offset in seconds the RTC runs with
+    drift_span = None # Seconds of syncs the drift has been measured over this boot
+    next_sync = None # UTC when the RTC may be SYNC_TOLERANCE off
+
+    def __init__(self, tz_rule:str = None) -> None:
         self.files = Files()
         self.wifi = WiFi()
+        self.transitions = self.load_timezone_rule(tz_rule)
+        self.ntp = NTP_Client()
+
+        self.SYNC_TOLERANCE = 5 # Seconds
+        self.SYNC_MAX = 30 * 24 * 3600 # Longest time between two syncs
+        self.DRIFT_UNKNOWN_PPB = 50000 # What the crystal may be off before the drift has been measured
+        self.DRIFT_WANDER_PPB = 1000 # How much the drift may change between syncs, it follows the temperature
+        self.DRIFT_SPAN_MAX = 30 * 24 * 3600 # Older syncs than this are weighed down, so the drift can follow the seasons
+
+    def ntp_fetch_unix_time(self) -> int:
+        # Raises NTPError when no server answered in time
+        time = self.ntp.fetch()
+        print(f"NTP time from {self.ntp.server[0]}, stratum {self.ntp.stratum}, {self.ntp.round_trip_ms} ms round trip, {self.ntp.queries} queries") # <--- #DEBUG
+        return time
 
-        self.NTP_EPOCH = 2208988800 # 1970-01-01 00:00:00
-        self.NTP_QUERY = b"\x23" + (47 * b"\0") # https://stackoverflow.com/a/26938508
-
-    def ntp_fetch_unix_time(self, host:str = "pool.ntp.org", port:int = 123) -> int:
-        ### Inspiration fra
-        # https://stackoverflow.com/a/33436061
-        sockaddr = getaddrinfo(host, port)[0][-1]
-        sock = socket(AF_INET, SOCK_DGRAM)
-        sock.settimeout(2.0)
-        msg = None
-        while msg == None: # <------------------------------------------------------------------------------------------- #TODO - Noget med at den skal time ud efter et minut
-        
-            try: 
-                sock.sendto(self.NTP_QUERY, sockaddr)
-                print("NTP query sent - waiting 2s for response") # <---------------------------------------------------- #DEBUG
-                msg, address = sock.recvfrom(1024)
-            except OSError:
-                print("Timeout waiting for UDP-package!") # <------------------------------------------------------------ #DEBUG
-        sock.close()
-        value = unpack("!I", msg[40:44])[0]
-        time = int(value - self.NTP_EPOCH)
+    async def ntp_fetch_unix_time_async(self) -> int:
+        # ntp_fetch_unix_time() from a uasyncio task, the other tasks run while it waits for the servers
+        time = await self.ntp.fetch_async()
+        print(f"NTP time from {self.ntp.server[0]}, stratum {self.ntp.stratum}, {self.ntp.round_trip_ms} ms round trip, {self.ntp.queries} queries") # <--- #DEBUG
         return time
     
+    def load_timezone_rule(self, tz_rule:str = None) -> Transition_Table:
+        # The transition table for tz_rule, else for the rule in the settings, else for Danish time
+        if tz_rule == None:
+            tz_rule = self.files.get_setting("tz_rule")
+            if tz_rule:
+                try:
+                    return Transition_Table(tz_rule)
+                except ValueError as e:
+                    print(f"tz_rule ignored: {e}") # <------------------------------------------------------------------ #DEBUG
+            tz_rule = DEFAULT_RULE
+        return Transition_Table(tz_rule)
+
+    def set_timezone_rule(self, tz_rule:str) -> None:
+        # Raises ValueError for a rule that can't be read. tz_expiry 0 makes main.py set the clock again with the new rule
+        self.transitions = Transition_Table(tz_rule)
+        with self.files.transaction():
+            self.files.write_settings({"tz_rule":tz_rule})
+            self.files.write_settings({"tz_expiry":0})
+
     def read_timezone(self) -> tuple:
-        settings = self.files.read_settings()
-        try:
-            timezone = int(settings["timezone"])
-            tz_expiry = int(settings["tz_expiry"])
-            return(timezone, tz_expiry)
-        except KeyError:
-            return(None, None)
-        except TypeError:
-            return(None, None)
+        # (UTC offset in seconds, UTC time it changes), settings from before tz_offset have the offset in hours
+        tz_offset = self.files.get_setting("tz_offset")
+        if tz_offset == None and self.files.get_setting("timezone") != None:
+            tz_offset = self.files.get_setting("timezone") * 3600
+        return (tz_offset, self.files.get_setting("tz_expiry"))
 
     def check_timezone(self, current_unixtime:int) -> int:
-        timezone, tz_expiry = self.read_timezone()
-        if (timezone == None or tz_expiry == None) or current_unixtime > tz_expiry:
-            print("Fetching new timezone-data") # <---------------------------------------------------------------------- #DEBUG
-            timezone, tz_expiry = self.get_timezone()
+        # The UTC offset in seconds from the transition table, also kept in the settings with when it changes, which is only written when it does
+        tz_offset, tz_expiry = self.get_timezone(current_unixtime)
+        with self.files.transaction():
             self.files.write_settings({"tz_expiry":tz_expiry})
-            self.files.write_settings({"timezone":timezone})
-        else:
-            print(f"timezone '{timezone}' fetched from settings - Expires {self.format_time(gmtime(tz_expiry))}") # <---- #DEBUG
-        return timezone
+            self.files.write_settings({"tz_offset":tz_offset})
+        print(f"timezone UTC{tz_offset / 3600:+g} - Expires {self.format_time(gmtime(tz_expiry))}") # <------------------ #DEBUG
+        return tz_offset
     
     def apply_timezone(self, unix_time_utc:int) -> int:
-        timezone = self.check_timezone(unix_time_utc)
-        time = unix_time_utc + (timezone * 3600)
+        tz_offset = self.check_timezone(unix_time_utc)
+        time = unix_time_utc + tz_offset
         return time
 
     def time_now(self) -> tuple:
         """
         Returns time in tuple: ((Year, Month, Day, Hour, Minute, Second, Weekday, Day_in_year), unixtime)
                       Example: ((2023, 4, 10, 17, 53, 34, 0, 100), 1681149214)
+        From the RTC with the drift since the last sync taken off, no network
         """
-        unixtime_utc = self.ntp_fetch_unix_time()
-        unixtime = self.apply_timezone(unixtime_utc)
+        unixtime = self.local_now()
         time = gmtime(int(unixtime))
         return (time, unixtime)
 
-    def get_timezone(self) -> tuple:
-        # Sommertid (UTC+2) starter den sidste søndag i marts
-        # Normaltid (UTC+1) starter den sidste søndag i oktober
-        now_unix = self.ntp_fetch_unix_time()
-        time_tuple = gmtime(int(now_unix))
-        
-        def strip_time_from_unix(unix_time:int) -> int:
-            hours = gmtime(unix_time)[3] * 3600
-            minutes = gmtime(unix_time)[4] * 60
-            seconds = gmtime(unix_time)[5]
-            return unix_time - (hours + minutes + seconds)
-
-        last_sunday_march = 0
-        last_sunday_october = 0
-        now_date = strip_time_from_unix(int(now_unix))
-        day = 3600 * 24
-
-        for counter in range(365):
-            time = int(now_date + counter * day)
-            time_tuple = gmtime(time)
-            if time_tuple[1] == 3 and time_tuple[6] == 6:
-                last_sunday_march = time
-            elif time_tuple[1] == 10 and time_tuple[6] == 6:
-                last_sunday_october = time
-        next_summertime = last_sunday_march
-        next_normaltime = last_sunday_october
-
-        if next_summertime < next_normaltime:
-            return (1, next_summertime) # Format: (Tidszone nu (UTC+#), Næste skift)
+    def local_now(self) -> int:
+        # What mktime(localtime()) would be if the RTC didn't drift
+        return self.utc_now() + Time.rtc_tz_offset
+
+    def rtc_utc(self) -> int:
+        return mktime(localtime()) - Time.rtc_tz_offset
+
+    def utc_now(self) -> int:
+        # UTC from the RTC, corrected for the drift since the last sync
+        rtc_utc = self.rtc_utc()
+        drift = self.files.get_setting("rtc_drift")
+        if Time.synced_utc == None or drift == None:
+            return rtc_utc
+        counted = rtc_utc - Time.rtc_adjust - Time.synced_utc # What the RTC has counted by itself since the sync
+        return Time.synced_utc + counted - (counted * drift + 500000000) // 1000000000
+
+    def sync(self) -> None:
+        # Sets the RTC from NTP, raises NTPError when no server answered in time
+        self.set_synced(self.ntp_fetch_unix_time())
+
+    async def sync_async(self) -> None:
+        # sync() from a uasyncio task
+        self.set_synced(await self.ntp_fetch_unix_time_async())
+
+    def set_synced(self, utc:int) -> None:
+        # Sets the RTC to the time NTP gave and works out the drift since the last sync
+        with self.files.transaction():
+            if Time.synced_utc != None and utc > Time.synced_utc:
+                self.measure_drift(utc)
+            tz_offset = self.check_timezone(utc)
+        self.set_RTC(gmtime(utc + tz_offset))
+        Time.synced_utc = utc
+        Time.rtc_adjust = 0
+        Time.rtc_tz_offset = tz_offset
+        Time.next_sync = utc + self.sync_interval()
+        print(f"Clock set, next sync {self.format_time(gmtime(Time.next_sync))} UTC") # <-------------------------------- #DEBUG
+
+    def measure_drift(self, utc:int) -> None:
+        # How fast the RTC ran by itself since the last sync, in ppb, averaged with what was measured before
+        elapsed = utc - Time.synced_utc
+        counted = self.rtc_utc() - Time.rtc_adjust - Time.synced_utc
+        measured = (counted - elapsed) * 1000000000 // elapsed
+        drift = self.files.get_setting("rtc_drift")
+        if drift == None or Time.drift_span == None:
+            drift = measured
+            Time.drift_span = elapsed
+        else:
+            drift = (drift * Time.drift_span + measured * elapsed) // (Time.drift_span + elapsed)
+            Time.drift_span = min(Time.drift_span + elapsed, self.DRIFT_SPAN_MAX)
+        self.files.write_settings({"rtc_drift":drift})
+        print(f"RTC drift {measured / 1000:.1f} ppm over {elapsed} s, {drift / 1000:.1f} ppm on average") # <-------------- #DEBUG
+
+    def sync_interval(self) -> int:
+        # Seconds until the error the drift estimate could have reaches SYNC_TOLERANCE. A drift measured over s seconds
+        # to the second can be 1/s off, plus what it may have changed since
+        if self.files.get_setting("rtc_drift") == None:
+            uncertainty = self.DRIFT_UNKNOWN_PPB
         else:
-            return (2, next_normaltime) # Format: (Tidszone nu (UTC+#), Næste skift)
+            uncertainty = 1000000000 // (Time.drift_span or 24 * 3600) + self.DRIFT_WANDER_PPB
+        return min(self.SYNC_TOLERANCE * 1000000000 // uncertainty, self.SYNC_MAX)
+
+    def needs_sync(self) -> bool:
+        return Time.next_sync == None or self.utc_now() >= Time.next_sync
+
+    def correct_rtc(self) -> None:
+        # Sets the RTC to summer or normal time when it starts, with the drift since the last sync taken off, no network.
+        # It isn't set for the drift alone: setting the RTC starts a new second, so every set loses up to one
+        if Time.synced_utc == None:
+            return
+        utc = self.utc_now()
+        tz_expiry = self.read_timezone()[1]
+        if tz_expiry != None and utc < tz_expiry:
+            return
+        tz_offset = self.check_timezone(utc)
+        if tz_offset == Time.rtc_tz_offset:
+            return
+        rtc_local = mktime(localtime())
+        delta = utc + tz_offset - rtc_local
+        self.set_RTC(gmtime(rtc_local + delta))
+        Time.rtc_adjust += delta - (tz_offset - Time.rtc_tz_offset) # Only what the UTC time was moved
+        Time.rtc_tz_offset = tz_offset
+
+    def get_timezone(self, unix_time_utc:int) -> tuple:
+        # Fra TZ-reglen, som standard dansk tid: sommertid (UTC+2) fra sidste søndag i marts, normaltid (UTC+1) fra sidste søndag i oktober
+        self.transitions.update(unix_time_utc)
+        return self.transitions.lookup(unix_time_utc) # Format: (UTC-offset i sekunder, Næste skift)
 
     def set_RTC(self, time_tuple:tuple) -> None:
         RTC().datetime((time_tuple[0], time_tuple[1], time_tuple[2], time_tuple[6], time_tuple[3], time_tuple[4], time_tuple[5], 0))
@@ -242,47 +457,59 @@ class Time:
         return time
 
 
-class Stopwatch:
-    
-    def __init__(self) -> None:
-        self.start_time = mktime(localtime())
-        self.lap_times = []
-    
-    def get_time(self) -> int:
-        start = self.start_time
-        time = mktime(localtime())
-        delta = time - start
-        return delta
-
-
 class WiFi:
     
     def __init__(self) -> None:
         self.default_ssid = "INSERT_YOUR_SSID_HERE" # <------------------------------------------------------------------------------ Default Wi-Fi SSID sættes her
         self.default_pass = "12345678" # <------------------------------------------------------------------------------------------- Default Wi-Fi pass sættes her
         self.wlan = WLAN(STA_IF)
+        self.POLL_MS = 100 # How often connect() checks whether the connection is up
 
     def connect(self, ssid:str = "", password:str = "", timeout:int = 5, tries:int = 3) -> None:
+        # timeout is in seconds per try
+        stopwatch = Stopwatch()
         for i in range(tries):
-            stopwatch = Stopwatch()
-            if ssid == "" or password == "":
-                ssid = self.default_ssid
-                password = self.default_pass
-            
-            self.wlan.active(True)
-            self.wlan.connect(ssid, password)
+            self.start_try(ssid, password, stopwatch)
             while self.wlan.isconnected() == False:
-                if stopwatch.get_time() >= timeout: break # Timeout
-                print('Waiting for Wi-Fi connection...', stopwatch.get_time())
-                sleep_ms(1000)
-            if self.wlan.isconnected() == True:
-                print(self.wlan.ifconfig())
+                if stopwatch.expired(timeout * 1000): break # Timeout
+                sleep_ms(min(self.POLL_MS, stopwatch.remaining(timeout * 1000)))
+            if self.end_try(stopwatch, i, tries):
                 break
-            else:
-                print(f"Failed to connect to WiFi on try {i+1} of {tries}")
         if self.wlan.isconnected() == False:
             raise WiFiError
 
+    async def connect_async(self, ssid:str = "", password:str = "", timeout:int = 5, tries:int = 3) -> None:
+        # connect() from a uasyncio task, the other tasks run between the checks on the connection
+        stopwatch = Stopwatch()
+        for i in range(tries):
+            self.start_try(ssid, password, stopwatch)
+            while self.wlan.isconnected() == False:
+                if stopwatch.expired(timeout * 1000): break # Timeout
+                await asyncio.sleep_ms(min(self.POLL_MS, stopwatch.remaining(timeout * 1000)))
+            if self.end_try(stopwatch, i, tries):
+                break
+        if self.wlan.isconnected() == False:
+            raise WiFiError
+
+    def start_try(self, ssid:str, password:str, stopwatch:Stopwatch) -> None:
+        stopwatch.start()
+        if ssid == "" or password == "":
+            ssid = self.default_ssid
+            password = self.default_pass
+        
+        self.wlan.active(True)
+        self.wlan.connect(ssid, password)
+        print('Waiting for Wi-Fi connection...')
+
+    def end_try(self, stopwatch:Stopwatch, i:int, tries:int) -> bool:
+        # True when the try connected
+        time = stopwatch.lap()
+        if self.wlan.isconnected() == True:
+            print(self.wlan.ifconfig(), f"after {time} ms")
+            return True
+        print(f"Failed to connect to WiFi on try {i+1} of {tries} in {time} ms")
+        return False
+
     def check_connection(self):
         if self.wlan.isconnected() == True:
             return True
@@ -300,41 +527,246 @@ class WiFi:
     # Hvis der ikke er success vises en fejlmeddelse og der laves et nyt scan som vises på siden.
 
 
+class Settings_Record:
+    """
+    Fixed-layout binary settings: a header with magic, version and a bit per field that is set, followed by every field
+    struct-packed in one record. Fields are only ever appended in a new version, so a record written by an older version
+    is still decoded with its own layout and upgraded on the next write.
+    Field types are struct codes: integers and "#s" for strings of at most # bytes.
+    """
+    MAGIC = b"AP"
+    VERSION = 4
+    HEADER = "<2sBBI" # magic, version, number of fields, fields that are set
+    LAYOUTS = {
+        1: (("wifi_ssid", "32s"), ("wifi_password", "64s"), ("timezone", "b"), ("tz_expiry", "q"), ("next_rotation", "q"), ("position", "B")),
+        2: (("wifi_ssid", "32s"), ("wifi_password", "64s"), ("timezone", "b"), ("tz_expiry", "q"), ("next_rotation", "q"), ("position", "B"),
+            ("moisture_calibration", "64s")),
+        3: (("wifi_ssid", "32s"), ("wifi_password", "64s"), ("timezone", "b"), ("tz_expiry", "q"), ("next_rotation", "q"), ("position", "B"),
+            ("moisture_calibration", "64s"), ("tz_rule", "48s"), ("tz_offset", "i")),
+        4: (("wifi_ssid", "32s"), ("wifi_password", "64s"), ("timezone", "b"), ("tz_expiry", "q"), ("next_rotation", "q"), ("position", "B"),
+            ("moisture_calibration", "64s"), ("tz_rule", "48s"), ("tz_offset", "i"), ("rtc_drift", "i")),
+    }
+
+    def __init__(self, version:int = VERSION) -> None:
+        self.version = version
+        self.fields = self.LAYOUTS[version]
+        self.types = {}
+        for name, code in self.fields:
+            self.types[name] = code[-1]
+        self.format = "<" + "".join([code for name, code in self.fields])
+        self.size = calcsize(self.HEADER) + calcsize(self.format)
+
+    def convert(self, key:str, value):
+        # Typed value for a field, also from the strings in the old text format
+        field_type = self.types[key]
+        if field_type == "s":
+            return str(value)
+        return int(value)
+
+    def encode(self, settings_dict:dict) -> bytes:
+        present = 0
+        values = []
+        for i, (name, code) in enumerate(self.fields):
+            value = settings_dict.get(name)
+            if value != None:
+                present |= 1 << i
+            else:
+                value = "" if code[-1] == "s" else 0
+            if code[-1] == "s":
+                value = value.encode()
+                if len(value) > int(code[:-1]): # pack() would cut it off without a word
+                    raise ValueError(f"'{name}' is longer than {code[:-1]} bytes")
+            values.append(value)
+        return pack(self.HEADER, self.MAGIC, self.version, len(self.fields), present) + pack(self.format, *values)
+
+    def decode(self, data:bytes) -> dict:
+        header_size = calcsize(self.HEADER)
+        magic, version, count, present = unpack(self.HEADER, data[:header_size])
+        if magic != self.MAGIC or not version in self.LAYOUTS:
+            raise ValueError("Not a settings record")
+        record = self if version == self.version else Settings_Record(version)
+        if len(data) != record.size:
+            raise ValueError("Settings record has the wrong size")
+        settings_dict = {}
+        values = unpack(record.format, data[header_size:])
+        for i, (name, code) in enumerate(record.fields):
+            if present & (1 << i):
+                value = values[i]
+                if code[-1] == "s":
+                    value = value.rstrip(b"\0").decode()
+                settings_dict[name] = value
+        return settings_dict
+
+
 class Files:
+    settings_cache = None # Shared by every Files object, the settings are only read from flash once per boot
+    transaction_staged = None # Settings staged by an open Settings_Transaction
 
     def __init__(self) -> None:
+        self.BINARY_SETTINGS = True # False keeps the settings in the old comma/colon text format in settings.file
         self.SETTINGS_FILE = "settings.file"
+        self.SETTINGS_RECORD = "settings.bin"
+        self.TEMP_FILE = "settings.tmp"
+        self.BAD_FILE = "settings.bad" # A settings file that couldn't be read is moved here, not written over
+        self.record = Settings_Record()
+
+    def load_text(self) -> dict:
+        # A bad entry is skipped instead of throwing away the whole file
+        file = open(self.SETTINGS_FILE,"r")
+        contents = file.read()
+        file.close()
+        settings_dict = {}
+        for kv in contents.strip(",").split(","):
+            if kv == "None:None" or kv.count(":") != 1:
+                pass
+            else:
+                key, value = kv.split(":")
+                try:
+                    settings_dict[key] = self.convert(key, value)
+                except (ValueError, KeyError): # Not a number, or not a field in the binary record
+                    pass
+        return settings_dict
 
-    def read_settings(self) -> dict:
+    def load_settings(self) -> dict:
+        file_name = None
         try:
-            if not self.SETTINGS_FILE in listdir():
-                raise NameError("File does not exist")            
-            file = open(self.SETTINGS_FILE,"r")
-            contents = file.read()
-            settings_dict = {}
-            contents = contents.strip(",")
-            for kv in contents.split(","):
-                if kv == "None:None":
-                    pass
-                else:
-                    key, value = kv.split(":")
-                    settings_dict[key] = value
-            file.close()
-            return settings_dict
-        except Exception as e:
-            file = open(self.SETTINGS_FILE,"w")
-            file.close()
-            return {None:None}
+            files = listdir()
+            if self.TEMP_FILE in files: # Left over from a write that lost power, the settings file is still the old version
+                remove(self.TEMP_FILE)
+            if self.BINARY_SETTINGS and self.SETTINGS_RECORD in files:
+                file_name = self.SETTINGS_RECORD
+                file = open(self.SETTINGS_RECORD,"rb")
+                data = file.read()
+                file.close()
+                return self.record.decode(data)
+            if not self.SETTINGS_FILE in files:
+                return {}
+            file_name = self.SETTINGS_FILE
+            settings_dict = self.load_text()
+        except (OSError, ValueError) as e:
+            # Starting from no settings is all that is left, but the next write would lose whatever is still in the file
+            print(f"Could not read {file_name or 'the settings'}: {e}")
+            if file_name != None:
+                self.set_aside(file_name)
+            return {}
+        if self.BINARY_SETTINGS: # First boot with the binary format, migrate settings.file
+            print("Migrating settings.file to settings.bin")
+            self.save(settings_dict)
+            remove(self.SETTINGS_FILE)
+        return settings_dict
+
+    def set_aside(self, file_name:str) -> None:
+        try:
+            if self.BAD_FILE in listdir():
+                remove(self.BAD_FILE)
+            rename(file_name, self.BAD_FILE)
+            print(f"{file_name} moved to {self.BAD_FILE}")
+        except OSError as e:
+            print(f"Could not move {file_name} to {self.BAD_FILE}: {e}")
+
+    def convert(self, key:str, value):
+        if key in self.record.types:
+            return self.record.convert(key, value)
+        if self.BINARY_SETTINGS:
+            raise KeyError(f"'{key}' is not a field in the settings record")
+        return str(value)
+
+    def read_settings(self) -> dict:
+        if Files.settings_cache == None:
+            Files.settings_cache = self.load_settings()
+        settings_dict = Files.settings_cache.copy()
+        if Files.transaction_staged != None:
+            settings_dict.update(Files.transaction_staged)
+        return settings_dict
+
+    def get_setting(self, key:str, default = None):
+        # Typed value of a single setting, without copying the settings
+        if Files.transaction_staged != None and key in Files.transaction_staged:
+            return Files.transaction_staged[key]
+        if Files.settings_cache == None:
+            Files.settings_cache = self.load_settings()
+        return Files.settings_cache.get(key, default)
     
     def write_settings(self, new_settings_dict:dict) -> None:
-        settings_dict = self.read_settings()
-        settings_dict.update(new_settings_dict)
-        settings_str = ""
-        file = open(self.SETTINGS_FILE,"w")
-        for each in settings_dict:
-            settings_str += f"{each}:{settings_dict[each]},"
-        file.write(settings_str)
-        file.close()
+        if Files.transaction_staged != None:
+            for key in new_settings_dict:
+                Files.transaction_staged[key] = self.convert(key, new_settings_dict[key])
+        else:
+            self.commit_settings(new_settings_dict)
+
+    def commit_settings(self, new_settings_dict:dict) -> None:
+        # Flash is only written when something changed
+        if Files.settings_cache == None:
+            Files.settings_cache = self.load_settings()
+        settings_dict = Files.settings_cache.copy()
+        changed = False
+        for key in new_settings_dict:
+            value = self.convert(key, new_settings_dict[key])
+            if settings_dict.get(key) != value:
+                settings_dict[key] = value
+                changed = True
+        if not changed:
+            return
+        self.save(settings_dict)
+        Files.settings_cache = settings_dict
+
+    def save(self, settings_dict:dict) -> None:
+        # The new file is written next to the old one and renamed over it,
+        # so a power loss mid-write leaves either the old or the new settings, never half of them.
+        # The record is encoded before the temp file is opened, a setting that doesn't fit leaves no temp file behind
+        if self.BINARY_SETTINGS:
+            data = self.record.encode(settings_dict)
+            file = open(self.TEMP_FILE,"wb")
+            file.write(data)
+            file.close()
+            rename(self.TEMP_FILE, self.SETTINGS_RECORD)
+        else:
+            settings_str = ""
+            for each in settings_dict:
+                settings_str += f"{each}:{settings_dict[each]},"
+            file = open(self.TEMP_FILE,"w")
+            file.write(settings_str)
+            file.close()
+            rename(self.TEMP_FILE, self.SETTINGS_FILE)
+
+    def transaction(self):
+        return Settings_Transaction(self)
+
+
+class Settings_Transaction:
+    """
+    Stages every write_settings call, from any Files object, until commit() writes them to flash in one go.
+        with files.transaction():
+            files.write_settings({"tz_expiry":tz_expiry})
+            files.write_settings({"tz_offset":tz_offset})
+    The with-statement commits at the end and throws the staged settings away if an exception is raised.
+    A transaction started inside another one joins the outer one.
+    """
+
+    def __init__(self, files:Files) -> None:
+        self.files = files
+        self.owner = Files.transaction_staged == None
+        if self.owner:
+            Files.transaction_staged = {}
+
+    def commit(self) -> None:
+        if self.owner and Files.transaction_staged != None:
+            staged = Files.transaction_staged
+            Files.transaction_staged = None
+            self.files.commit_settings(staged)
+
+    def abort(self) -> None:
+        if self.owner:
+            Files.transaction_staged = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type == None:
+            self.commit()
+        else:
+            self.abort()
 
 
 class Startup:
@@ -370,6 +802,9 @@ class Startup:
             self.led.led_flash_double(4, color=self.led.red)
             # Device reset
             reset()
+        except NTPError as e:
+            self.kill_lights()
+            print(e, "- the clock is set when main.py tries again")
         except:
             print("something something")
             self.startup_done = True
@@ -383,20 +818,33 @@ class Startup:
             self.led.led_rainbow_trail()
          
     def startup_seq(self):
+        self.connect_wifi()
+        self.sync_clock()
+        self.kill_lights()
+
+    def connect_wifi(self) -> None:
+        ssid, password = self.wifi_login()
+        self.wifi.connect(ssid, password)
+
+    async def connect_wifi_async(self) -> None:
+        ssid, password = self.wifi_login()
+        await self.wifi.connect_async(ssid, password)
+
+    def wifi_login(self) -> tuple:
         settings = self.files.read_settings()
         try:
             # Hvis der er wifi-credentials: connect
-            ssid = settings["wifi_ssid"]
-            password = settings["wifi_password"]
-            self.wifi.connect(ssid, password)
+            return (settings["wifi_ssid"], settings["wifi_password"])
         except KeyError as e:
             # ellers kør metode til at vælge sside og skrive password ind
             print("no WiFi login is stored in settings! - Starting login page")
-            self.wifi.connect() # Indtil metoden med login er lavet køres denne, her bruges default credentials som defineres i WiFi.__init__()
-        
-        time = self.time.time_now()[0]
-        self.time.set_RTC(time)
-        self.kill_lights()
+            return ("", "") # Indtil metoden med login er lavet bruges default credentials som defineres i WiFi.__init__()
+
+    def sync_clock(self) -> None:
+        self.time.sync()
+
+    async def sync_clock_async(self) -> None:
+        await self.time.sync_async()
 
 if __name__ == "__main__":
     io = Microcontroller()
@@ -0,0 +1,92 @@
+from struct import pack, unpack, calcsize
+from binascii import crc32
+from os import listdir, rename, remove
+
+class Position_Journal:
+    """
+    Append-only log of the motor position, the motor phase in continuous mode and the next rotation time.
+    Every change appends one fixed-size record with a CRC instead of rewriting the settings, and when the log
+    reaches MAX_RECORDS it is compacted down to the latest record. At boot the log is scanned and the last
+    record with a valid CRC wins, so a record torn by a power loss is simply skipped.
+    """
+
+    def __init__(self, file_name:str = "position.log", max_records:int = 128) -> None:
+        self.FILE = file_name
+        self.TEMP_FILE = file_name + ".tmp"
+        self.RECORD = "<IqBBH" # sequence, next_rotation, position, which of them are set, phase (was 2 padding bytes)
+        self.RECORD_SIZE = calcsize(self.RECORD) + 4 # + CRC32
+        self.MAX_RECORDS = max_records # 128 records of 20 bytes stay inside one 4 KiB flash block
+        self.HAS_POSITION = 1
+        self.HAS_NEXT_ROTATION = 2
+        self.HAS_PHASE = 4
+
+        self.sequence = 0
+        self.records = 0
+        self.position = None
+        self.next_rotation = None
+        self.phase = None
+        self.recover()
+
+    def recover(self) -> None:
+        try:
+            files = listdir()
+            if self.TEMP_FILE in files: # Compaction lost power before the rename, the log is still complete
+                remove(self.TEMP_FILE)
+            if not self.FILE in files:
+                return
+            file = open(self.FILE,"rb")
+            data = file.read()
+            file.close()
+        except OSError:
+            return
+        count = len(data) // self.RECORD_SIZE
+        self.records = count
+        if len(data) % self.RECORD_SIZE:
+            self.records = self.MAX_RECORDS # Torn tail, the next save compacts so new records line up again
+        for offset in range(0, count * self.RECORD_SIZE, self.RECORD_SIZE):
+            record = self.decode(data[offset:offset + self.RECORD_SIZE])
+            if record != None and (self.sequence == 0 or record[0] > self.sequence):
+                self.sequence, self.next_rotation, self.position, self.phase = record
+
+    def decode(self, record:bytes):
+        body = record[:-4]
+        if unpack("<I", record[-4:])[0] != crc32(body) & 0xFFFFFFFF:
+            return None
+        sequence, next_rotation, position, flags, phase = unpack(self.RECORD, body)
+        if not flags & self.HAS_POSITION: position = None
+        if not flags & self.HAS_NEXT_ROTATION: next_rotation = None
+        if not flags & self.HAS_PHASE: phase = None
+        return (sequence, next_rotation, position, phase)
+
+    def encode(self) -> bytes:
+        flags = 0
+        if self.position != None: flags |= self.HAS_POSITION
+        if self.next_rotation != None: flags |= self.HAS_NEXT_ROTATION
+        if self.phase != None: flags |= self.HAS_PHASE
+        body = pack(self.RECORD, self.sequence, self.next_rotation or 0, self.position or 0, flags, self.phase or 0)
+        return body + pack("<I", crc32(body) & 0xFFFFFFFF)
+
+    def is_empty(self) -> bool:
+        return self.sequence == 0
+
+    def save(self, position:int = None, next_rotation:int = None, phase:int = None) -> None:
+        # Only the given values change, the others are carried over from the last record
+        if position != None: self.position = position
+        if next_rotation != None: self.next_rotation = next_rotation
+        if phase != None: self.phase = phase
+        self.sequence += 1
+        if self.records >= self.MAX_RECORDS:
+            self.compact()
+        else:
+            file = open(self.FILE,"ab")
+            file.write(self.encode())
+            file.close()
+            self.records += 1
+
+    def compact(self) -> None:
+        # The new log holds only the latest record and replaces the old one in a single rename
+        file = open(self.TEMP_FILE,"wb")
+        file.write(self.encode())
+        file.close()
+        rename(self.TEMP_FILE, self.FILE)
+        self.records = 1
@@ -1,31 +1,88 @@
 # Her sker der ikke noget endnu ):
-from time import sleep
 import device
 import moisture
 import rotation
+from custom_exceptions import WiFiError, NTPError
+from scheduler import Scheduler
 
 MINUTES = 60
-UPDATE_INTERVAL = 10 #* MINUTES # Update interval in seconds, the time that is paused at the end of the loop
+UPDATE_INTERVAL = 10 #* MINUTES # Update interval in seconds, how often the moisture is checked near the threshold
+NETWORK_INTERVAL = 15 * MINUTES # How often the Wi-Fi connection and the clock are checked
+ROTATION_CHECK = 60 * MINUTES # Longest sleep of the rotation task, so it notices when the clock has been set
+MOVE_POLL = 100 # Milliseconds between checks on a running motor move
+
+rotation_move = None # The Background_Move running now, the motor steps from timer callbacks meanwhile
+
+def check_moisture() -> int:
+    if moisture.too_dry():
+        moisture.flash()
+    return moisture.next_sample_ms # Longer the wetter the soil is
+
+def check_rotation() -> int:
+    global rotation_move
+    if rotation_move != None:
+        if not rotation_move.poll(): # Saves the position when the move is done
+            return MOVE_POLL
+        rotation_move = None
+    if device.Time.synced_utc == None:
+        # The RTC still counts from when the board booted, a rotation now would store a next_rotation from that.
+        # maintain_network() wakes this task when the clock has been set
+        return None
+    if rotation.is_time_to_rotate():
+        rotation_move = rotation.rotate_async()
+        return MOVE_POLL
+    # is_time_to_rotate is True once the time is past next_rotation, hence the extra second
+    seconds = rotation.journal.next_rotation - rotation.time.local_now() + 1
+    return max(0, min(seconds, ROTATION_CHECK)) * 1000
+
+def update_leds():
+    # Sleeps until the next frame, or until an effect is played when nothing is running
+    due = startup.led.animations.tick()
+    if not startup.led.animations.is_running():
+        startup.led.led_on_single(43, startup.led.green)
+    return due
+
+def switches_changed() -> None:
+    # Called from the DIP switch debounce timer, the tasks work out their deadlines again with the new settings
+    scheduler.wake_from_irq("moisture")
+    scheduler.wake_from_irq("rotation")
+
+async def maintain_network() -> int:
+    # Time.local_now() takes the RTC's measured drift off and correct_rtc() sets summer or normal time, both without the network.
+    # NTP is only asked when the drift estimate can't be trusted to Time.SYNC_TOLERANCE any more, or the clock was never set.
+    # Connecting and waiting for NTP sleep with uasyncio, the other tasks keep their deadlines meanwhile
+    startup.time.correct_rtc()
+    if not startup.wifi.check_connection():
+        try:
+            await startup.connect_wifi_async()
+        except WiFiError as e:
+            print(e, "- trying again in", NETWORK_INTERVAL, "seconds")
+            return NETWORK_INTERVAL * 1000
+    if startup.time.needs_sync():
+        first_sync = device.Time.synced_utc == None
+        try:
+            await startup.sync_clock_async()
+            if first_sync:
+                scheduler.wake("rotation")
+        except NTPError as e:
+            print(e, "- trying again in", NETWORK_INTERVAL, "seconds")
+    print(scheduler.report()) # <--------------------------------------------------------------------------------------- #DEBUG
+    return NETWORK_INTERVAL * 1000
 
 if __name__ == "__main__":
     
     startup = device.Startup()
     print("Startup done")
-    moisture = moisture.Moisture()
+    moisture = moisture.Moisture(sample_interval=UPDATE_INTERVAL)
     rotation = rotation.Step_Motor()
-    if not startup.startup_aborted: startup.led.led_on_single(43, startup.led.green)
-
-    while not startup.startup_aborted:
-        
-        # Moisture
-        if moisture.too_dry():
-            moisture.flash()
-        
-        startup.led.led_on_single(43, startup.led.green)
 
-        #Rotation
-        if rotation.is_time_to_rotate():
-            rotation.rotate()
-        
-        print("sleeping for", UPDATE_INTERVAL, "seconds")
-        sleep(UPDATE_INTERVAL)
\ No newline at end of file
+    if not startup.startup_aborted:
+        scheduler = Scheduler()
+        scheduler.add("moisture", check_moisture)
+        scheduler.add("rotation", check_rotation)
+        scheduler.add("leds", update_leds)
+        # Startup has just connected and set the clock, unless NTP didn't answer at boot, then it is tried again right away
+        scheduler.add("network", maintain_network, 0 if device.Time.synced_utc == None else NETWORK_INTERVAL * 1000)
+        startup.led.animations.on_play = lambda: scheduler.wake("leds")
+        device.Microcontroller.on_change = switches_changed
+        scheduler.run()
\ No newline at end of file
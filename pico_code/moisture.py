@@ -1,6 +1,9 @@
 from machine import ADC, Pin
 from time import sleep_ms
-from device import Microcontroller, LED_Strip
+from device import Microcontroller, LED_Strip, Files
+from animation import Flash_Double, Sequence, Solid
+from sampling import Burst_Reader, Rolling_Window
+from calibration import Calibration
 
 class Sensor:
     def __init__(self, power_pin:int = 27, data_pin:int = 26, debug_terminal:bool = False) -> None:
@@ -15,7 +18,7 @@ class Sensor:
 
 class Moisture(Sensor):
 
-    def __init__(self, power_pin: int = 27, data_pin: int = 26, debug_terminal: bool = False) -> None:
+    def __init__(self, power_pin: int = 27, data_pin: int = 26, sample_interval:int = 10, debug_terminal: bool = False) -> None:
         super().__init__(power_pin, data_pin, debug_terminal)
         
         self.MIN_VALUE = 17900 # 17900 er en potte der er lettere overvandet
@@ -27,23 +30,55 @@ class Moisture(Sensor):
         self.too_dry_threshold_normal = 40
         self.too_dry_threshold_wet = 99 # 50
 
+        self.flash_effect = None
+
+        self.SAMPLES = 16 # ADC samples per reading, filtered down to one value
+        self.TRIM = 0 # 0 filters with the median, otherwise the mean without the TRIM lowest and highest samples
+        self.WINDOW = 6 # Readings averaged for too_dry(), a minute's worth near the threshold
+        self.sampler = Burst_Reader(self.sensor_data, self.SAMPLES, self.TRIM)
+        self.readings = Rolling_Window(self.WINDOW)
+
+        self.files = Files()
+        self.CALIBRATION_KEY = "moisture_calibration" # Setting with the calibration points, there is only one sensor
+        self.calibration = Calibration.load(self.files, self.CALIBRATION_KEY, ((self.MIN_VALUE, 100), (self.ADC_MAX_VALUE, 0)))
+
+        # Moist soil dries slowly, so the further above the threshold it is, the longer until the next reading
+        self.SAMPLE_MIN = sample_interval * 1000 # Milliseconds between readings near the threshold and while too dry
+        self.SAMPLE_MAX = 10 * 60 * 1000
+        self.SAMPLE_BACKOFF = 30 * 1000 # Added per percent above the threshold and the hysteresis
+        self.HYSTERESIS = 3 # Percent above the threshold the soil has to get back to before it is no longer too dry
+        self.dry = False
+        self.next_sample_ms = self.SAMPLE_MIN
 
     def read_moisture(self) -> int:
     #    self.sensor_power.on()
         sleep_ms(25)
-        value = int(self.sensor_data.read_u16())
+        value = self.sampler.read()
     #    self.sensor_power.off()
+        self.readings.push(value)
         if self.debug_terminal: print(f"Moisture Value: {value}") # <----------------------------------- #DEBUG
         return value
     
     def moisture_percent(self) -> int:
-        reading = self.read_moisture()
-        reading -= self.MIN_VALUE
-        reading = - reading + self.MIN_VALUE_ADJUSTED
-        percent = int(round((reading / self.MIN_VALUE_ADJUSTED) * 100))
+        self.read_moisture()
+        reading = self.readings.mean() # The last readings together, so one odd reading doesn't flash the LEDs
+        percent = self.calibration.percent(reading)
         if self.debug_terminal: print(f"Moisture Percent: {percent}%") # <---------------------------- #DEBUG
         return percent
     
+    def calibrate(self, points:tuple) -> None:
+        # New calibration points (raw, percent) for this sensor, e.g. ((17900, 100), (65535, 0)), saved in the settings
+        calibration = Calibration(points)
+        calibration.save(self.files, self.CALIBRATION_KEY) # Raises ValueError when the points don't fit in the setting
+        self.calibration = calibration
+
+    def calibration_point(self, percent:int) -> None:
+        # Reads the sensor in soil that is known to be percent moist and adds that point to the calibration
+        self.read_moisture()
+        raw = self.readings.last()
+        points = [point for point in self.calibration.points if point[0] != raw]
+        self.calibrate(points + [(raw, percent)])
+
     def get_threshold(self) -> int:
         dryness_setting = self.io.check_setting_wetness()
         if dryness_setting == "dry":
@@ -59,18 +94,29 @@ class Moisture(Sensor):
         moisture = self.moisture_percent()
         threshold = self.get_threshold()
         if self.debug_terminal: print(f"Moisture: {moisture}%, Threshold: {threshold}%\n") # <--------------------- #DEBUG
-        if moisture < threshold:
-            return True
-        else: return False
+        if self.dry:
+            self.dry = moisture < threshold + self.HYSTERESIS
+        else:
+            self.dry = moisture < threshold
+        self.next_sample_ms = self.sample_interval(moisture, threshold)
+        return self.dry
+
+    def sample_interval(self, moisture:int, threshold:int) -> int:
+        # Milliseconds until the next reading is needed
+        above = moisture - threshold - self.HYSTERESIS
+        if self.dry or above <= 0:
+            return self.SAMPLE_MIN
+        return min(self.SAMPLE_MIN + above * self.SAMPLE_BACKOFF, self.SAMPLE_MAX)
 
     def flash(self) -> None:
-        self.led.led_off()
-        sleep_ms(20)
-        self.led.led_flash_double()
+        # Starts the flash and returns right away, the control loop runs it by ticking self.led.animations
+        if not self.led.animations.is_running(self.flash_effect):
+            self.flash_effect = self.led.animations.play(Sequence(Solid((0,0,0), 20), Flash_Double(self.led.blue)))
 
 if __name__ == "__main__":
     test = Moisture(debug_terminal=True)
     while True:
         if test.too_dry():
             test.flash()
+            test.led.animations.wait()
         sleep_ms(1000)
\ No newline at end of file
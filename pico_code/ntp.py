@@ -0,0 +1,165 @@
+from socket import socket, getaddrinfo, AF_INET, SOCK_DGRAM
+from struct import pack, unpack
+from time import ticks_ms, ticks_us, ticks_diff
+import select
+import uasyncio as asyncio # On the host the simulator puts its stand-in in sys.modules, see simulator/aio.py
+from custom_exceptions import NTPError
+from stopwatch import Stopwatch
+
+class NTP_Client:
+    """
+    Asks several NTP servers at once from one non-blocking socket and takes the first reply that is any good:
+    a server reply to one of the queries sent to it, from a server that is synchronised itself (leap indicator not 3,
+    stratum 1-15, stratum 0 is a Kiss-o'-Death). Only servers that haven't answered at all are asked again, with twice
+    the wait, up to MAX_WAIT_MS; one that sent a Kiss-o'-Death or said it isn't synchronised is not asked again in the
+    same fetch(). fetch() raises NTPError when DEADLINE_MS has passed or every server has turned us down, so a dead
+    network can't hang boot.
+    A host that can't be resolved is tried again in the next round. getaddrinfo() itself blocks, it is not
+    started once the deadline has passed.
+    fetch_async() does the same from a uasyncio task: it never waits on the socket, it checks it every POLL_MS and
+    sleeps with asyncio in between, so the other tasks keep running while the servers are slow or dead.
+    """
+
+    def __init__(self, servers:tuple = ("0.pool.ntp.org", "1.pool.ntp.org", "2.pool.ntp.org"), port:int = 123,
+                 deadline_ms:int = 15000, first_wait_ms:int = 500, max_wait_ms:int = 4000, poll_ms:int = 20) -> None:
+        self.SERVERS = servers
+        self.PORT = port
+        self.DEADLINE_MS = deadline_ms
+        self.FIRST_WAIT_MS = first_wait_ms
+        self.MAX_WAIT_MS = max_wait_ms
+        self.POLL_MS = poll_ms
+        self.NTP_EPOCH = 2208988800 # 1970-01-01 00:00:00
+        self.query = bytearray(48)
+        self.query[0] = 0x23 # Leap indicator 0, version 4, mode 3 (client)
+        self.queries = 0 # Sent by the last fetch()
+        self.rejected = 0 # Replies the last fetch() threw away
+        self.server = None # Where the last time came from
+        self.stratum = None
+        self.round_trip_ms = None
+        self.serial = 0 # Counts every query, it goes in the nonce
+
+    def fetch(self) -> int:
+        # Unix time in UTC, rounded to the second with half the round trip added
+        stopwatch = Stopwatch() # Since the start, for the deadline
+        round_watch = Stopwatch() # Since the queries of this round were sent
+        wait = self.FIRST_WAIT_MS
+        self.start_fetch()
+        try:
+            while not stopwatch.expired(self.DEADLINE_MS) and not self.all_refused():
+                self.send_round(stopwatch)
+                round_watch.start()
+                while not self.all_refused():
+                    left = min(round_watch.remaining(wait), stopwatch.remaining(self.DEADLINE_MS))
+                    if left <= 0:
+                        break
+                    if not self.poller.poll(left):
+                        continue
+                    time = self.receive()
+                    if time != None:
+                        return time
+                wait = min(wait * 2, self.MAX_WAIT_MS)
+        finally:
+            self.sock.close()
+        raise NTPError
+
+    async def fetch_async(self) -> int:
+        # fetch() without blocking the event loop
+        stopwatch = Stopwatch()
+        round_watch = Stopwatch()
+        wait = self.FIRST_WAIT_MS
+        self.start_fetch()
+        try:
+            while not stopwatch.expired(self.DEADLINE_MS) and not self.all_refused():
+                self.send_round(stopwatch)
+                round_watch.start()
+                while not self.all_refused():
+                    left = min(round_watch.remaining(wait), stopwatch.remaining(self.DEADLINE_MS))
+                    if left <= 0:
+                        break
+                    if not self.poller.poll(0):
+                        await asyncio.sleep_ms(min(left, self.POLL_MS))
+                        continue
+                    time = self.receive()
+                    if time != None:
+                        return time
+                wait = min(wait * 2, self.MAX_WAIT_MS)
+        finally:
+            self.sock.close()
+        raise NTPError
+
+    def start_fetch(self) -> None:
+        self.queries = 0
+        self.rejected = 0
+        self.addresses = {} # host -> (ip, port)
+        self.sent = {} # (ip, port) -> [(transmit timestamp, ticks_ms when it was sent), ...] for every query, a late reply to an earlier one is as good
+        self.refused = set() # (ip, port) of servers that answered with a time we can't use, they aren't asked again
+        self.sock = socket(AF_INET, SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.poller = select.poll()
+        self.poller.register(self.sock, select.POLLIN)
+
+    def all_refused(self) -> bool:
+        return len(self.refused) == len(self.SERVERS)
+
+    def send_round(self, stopwatch:Stopwatch) -> None:
+        # Sends a query to every server that hasn't turned us down, resolving the ones that haven't been yet
+        for host in self.SERVERS:
+            if not host in self.addresses and not stopwatch.expired(self.DEADLINE_MS):
+                try:
+                    self.addresses[host] = getaddrinfo(host, self.PORT)[0][-1]
+                except OSError as e:
+                    print(f"NTP: could not resolve {host}: {e}") # <------------------------------------------------ #DEBUG
+            address = self.addresses.get(host)
+            if address != None and not address in self.refused:
+                self.serial += 1
+                nonce = pack("!II", self.serial, ticks_us()) # Only has to come back unchanged in the reply's origin timestamp
+                self.query[40:48] = nonce
+                try:
+                    self.sock.sendto(self.query, address)
+                    self.sent.setdefault(address, []).append((nonce, ticks_ms()))
+                    self.queries += 1
+                except OSError as e:
+                    print(f"NTP: could not send to {host}: {e}") # <------------------------------------------------ #DEBUG
+
+    def receive(self) -> int:
+        # Reads every reply waiting on the socket, the time from the first good one or None.
+        # A server whose answer to one of our queries is no good goes in refused
+        while True:
+            try:
+                reply, address = self.sock.recvfrom(64)
+            except OSError: # EAGAIN, nothing more to read
+                return None
+            if len(reply) < 48:
+                self.rejected += 1
+                continue
+            sent_ms = None
+            for nonce, ticks in self.sent.get(address, ()):
+                if reply[24:32] == nonce:
+                    sent_ms = ticks
+            if sent_ms == None:
+                self.rejected += 1
+                continue
+            if not self.check(reply):
+                self.rejected += 1
+                self.refused.add(address)
+                continue
+            round_trip_ms = ticks_diff(ticks_ms(), sent_ms)
+            seconds, fraction = unpack("!II", reply[40:48]) # Transmit timestamp
+            if seconds < 0x80000000:
+                seconds += 0x100000000 # NTP era 1 starts in 2036
+            self.server = address
+            self.stratum = reply[1]
+            self.round_trip_ms = round_trip_ms
+            return seconds - self.NTP_EPOCH + (fraction * 1000 // 0x100000000 + round_trip_ms // 2 + 500) // 1000
+
+    def check(self, reply:bytes) -> bool:
+        # An answer to one of the queries, is it from a server that knows the time
+        leap = reply[0] >> 6
+        mode = reply[0] & 7
+        stratum = reply[1]
+        if mode != 4: # Not from a server
+            return False
+        if leap == 3 or stratum == 0 or stratum > 15: # Not synchronised, or a Kiss-o'-Death telling us to go away
+            print(f"NTP: reply with leap {leap} stratum {stratum} ignored") # <------------------------------------------- #DEBUG
+            return False
+        return reply[40:48] != bytes(8)
@@ -1,6 +1,10 @@
-from machine import Pin
-from time import mktime, localtime, gmtime, sleep
+from time import gmtime, sleep
+from math import sqrt
+from array import array
 from device import Microcontroller, LED_Strip, Time, Files
+from journal import Position_Journal
+from animation import Rainbow_Trail
+from stepper import coils, constant, Profile, Background_Move, FORWARD, BACKWARD
 
 class Motor:
 
@@ -11,6 +15,11 @@ class Motor:
         self.led = LED_Strip()
         self.time = Time()
         self.files = Files()
+        self.journal = Position_Journal()
+        if self.journal.is_empty(): # Første boot med journal, position og next_rotation kommer fra settings
+            self.journal.position = self.files.get_setting("position")
+            self.journal.next_rotation = self.files.get_setting("next_rotation")
+        self.rotation_interval = self.io.check_setting_turn_rate() # What next_rotation was worked out with
 
     def get_rotation_interval(self) -> int:
         rotation_interval = self.io.check_setting_turn_rate() # returnerer int der siger hvor ofte (i uger) den skal rotere
@@ -18,111 +27,196 @@ class Motor:
         return rotation_interval
     
     def save_next_rotation(self, time) -> None:
-        self.files.write_settings({"next_rotation":time})
+        self.journal.save(next_rotation=time)
     
     def pseudo_rotate(self):
+        # Starts 10 seconds of red trail and returns right away, the control loop runs it by ticking self.led.animations
         if self.debug_terminal: print("rotating for 10 seconds") # <------------------------------------------------------------------------ #DEBUG
-        self.led.led_rainbow_trail(interval=100, trail_length=5, seconds=10, colors=self.led.red)
-        if self.debug_terminal: print("rotation done") # <---------------------------------------------------------------------------------- #DEBUG
+        return self.led.animations.play(Rainbow_Trail(interval=100, trail_length=5, seconds=10, colors=self.led.red, cache=True))
     
-    def is_time_to_rotate(self) -> bool:
-        current_unixtime = mktime(localtime())
-        settings_dict = self.files.read_settings()
+    def follow_turn_rate(self) -> None:
+        # Moves next_rotation when the turn rate switch has been changed since it was worked out
+        rotation_interval = self.get_rotation_interval()
+        if rotation_interval != self.rotation_interval and self.journal.next_rotation != None:
+            week = 60*60*24*7
+            self.save_next_rotation(self.journal.next_rotation + (rotation_interval - self.rotation_interval) * week)
+        self.rotation_interval = rotation_interval
 
-        try: # Der er gemt en next_rotation
-            next_rotation = int(settings_dict["next_rotation"])
-        except KeyError: # Der er IKKE gemt en next_rotation
-            next_rotation = None
-        except ValueError:
-            next_rotation = None
+    def is_time_to_rotate(self) -> bool:
+        self.follow_turn_rate()
+        current_unixtime = self.time.local_now()
+        next_rotation = self.journal.next_rotation # None hvis der IKKE er gemt en next_rotation
 
         if next_rotation == None or current_unixtime > next_rotation:
             if self.debug_terminal: print("Der er ingen setting, roter nu, gem næste tid") # <---------------------------------------------- #DEBUG
-            # week = 60*60*24*7 # Antal sekunder på en uge
-            week = 10 # <------------------------------------------------------------------------------------------------------------------- #DEBUG
-            rotation_interval = self.get_rotation_interval()
-            next_rotation = current_unixtime + week * rotation_interval
-            self.files.write_settings({"next_rotation":next_rotation})
+            week = 60*60*24*7 # Antal sekunder på en uge
+            next_rotation = current_unixtime + week * self.rotation_interval
+            self.save_next_rotation(next_rotation)
             if self.debug_terminal: print("It's time to rotate -> Current time:", self.time.format_time(gmtime(current_unixtime)), "next rotation time is:", self.time.format_time(gmtime(next_rotation))) # <----------------------- #DEBUG
             return True
         else:
             if self.debug_terminal: print("Not time to rotate -> Current time:", self.time.format_time(gmtime(current_unixtime)), "Not time to rotate: next rotation time is:", self.time.format_time(gmtime(next_rotation))) # <--- #DEBUG
             return False  
 
+class Motion_Planner:
+    """
+    Trapezoidal speed profiles for the stepper, with speeds in phases (half steps) per second.
+    A move starts at start_speed, which the motor manages from standstill, speeds up by acceleration phases/s²
+    until it reaches max_speed, cruises, and slows down the same way. A move too short to reach max_speed
+    turns around halfway. The ramp is worked out once, every plan() uses the part of it that it needs.
+    """
+
+    def __init__(self, max_speed:int = 900, acceleration:int = 2000, start_speed:int = 500) -> None:
+        self.max_speed = max_speed
+        self.acceleration = acceleration
+        self.start_speed = start_speed
+        # v² = v0² + 2·a·i is the speed after i phases, a phase at that speed lasts 1/v
+        length = 0
+        if max_speed > start_speed:
+            length = int((max_speed * max_speed - start_speed * start_speed) / (2 * acceleration) + 0.999999)
+        self.ramp = array("I", (round(1000000 / sqrt(start_speed * start_speed + 2 * acceleration * i)) for i in range(length)))
+
+    def plan(self, phases:int) -> Profile:
+        ramp_phases = min(len(self.ramp), phases // 2)
+        if ramp_phases == len(self.ramp):
+            cruise_us = round(1000000 / self.max_speed)
+        elif ramp_phases > 0:
+            cruise_us = self.ramp[ramp_phases - 1] # The odd phase in the middle of a short move
+        else:
+            cruise_us = round(1000000 / self.start_speed)
+        return Profile(self.ramp, ramp_phases, phases - 2 * ramp_phases, cruise_us)
+
+
 class Step_Motor(Motor):
 
-    def __init__(self, esc_data1: int = 2, esc_data2: int = 3, rotation_time:int = 5, debug_terminal:bool = False) -> None:
+    def __init__(self, esc_data1: int = 2, esc_data2: int = 3, rotation_time:int = 5, continuous:bool = False, debug_terminal:bool = False) -> None:
         super().__init__(esc_data1, esc_data2, debug_terminal)
         self.debug_terminal = debug_terminal
         self.rotation_time = rotation_time
 
-        self.stepper_in1 = Pin(21, Pin.OUT)
-        self.stepper_in2 = Pin(20, Pin.OUT)
-        self.stepper_in3 = Pin(19, Pin.OUT)
-        self.stepper_in4 = Pin(18, Pin.OUT)
+        self.CONTINUOUS = continuous # Always turn forward and wrap around, only for setups with no cable to unwind
+        self.POSITIONS = 7 # Stops in a full cycle, in the normal mode the pot sweeps out to the last one and back
+        self.POSITION_STEPS = 250 # Full 8-phase sequences between two stops in the normal mode
+        self.REVOLUTION = 4096 # Phases per revolution of the output shaft, the phase in continuous mode wraps here.
+                               # Continuous mode spreads the positions evenly over one revolution, see position_phase()
+
+        self.coils = coils((21, 20, 19, 18)) # IN1-IN4
+        self.last_move = None # Move_Stats of the last move
+
+        self.MAX_SPEED = 900 # Phases per second, the 28BYJ-48 has 4096 phases per revolution
+        self.START_SPEED = 500 # What the motor has always run at from standstill
+        self.ACCELERATION = 2000 # Phases per second²
+        self.planner = Motion_Planner(self.MAX_SPEED, self.ACCELERATION, self.START_SPEED)
 
         self.position = self.read_position()
+        self.phase = self.journal.phase or 0 # Only kept in continuous mode, 0 is where position 0 is
 
     def rotate(self) -> None:
-        if self.position < 6:
-            self.stepper_rotate(250, 0.5)
-            self.position += 1
-            self.save_position(self.position)
-        else: 
-            self.rotate_return()
-            self.position = 0
-            self.save_position(self.position)
+        sequence, profile, first, position, phases = self.next_move()
+        self.finish_rotate(position, phases, self.coils.move(sequence, profile, first))
+
+    def rotate_async(self) -> Background_Move:
+        # Starts the next rotation on a timer and returns right away, poll() or await wait() on the returned move.
+        # The position is saved when the move is seen to be done
+        sequence, profile, first, position, phases = self.next_move()
+        move = Background_Move(self.coils, sequence, profile, first)
+        move.on_done = lambda stats: self.finish_rotate(position, phases, stats)
+        return move.start()
+
+    def next_move(self) -> tuple:
+        # (sequence, profile, first phase of the sequence, position after the move, phases forward) for the next rotation
+        if self.CONTINUOUS:
+            position = (self.position + 1) % self.POSITIONS
+            phases = (self.position_phase(position) - self.phase) % self.REVOLUTION
+            return (FORWARD, self.planner.plan(phases), self.phase % 8, position, phases)
+        phases = self.POSITION_STEPS * len(FORWARD)
+        if self.position < self.POSITIONS - 1:
+            return (FORWARD, self.planner.plan(phases), 0, self.position + 1, 0)
+        else: # Sweep back to the first position
+            return (BACKWARD, self.planner.plan(phases * (self.POSITIONS - 1)), 0, 0, 0)
+
+    def position_phase(self, position:int) -> int:
+        # The phase of the revolution a position is at in continuous mode. REVOLUTION doesn't divide by POSITIONS,
+        # the remainder is spread over the positions so a full cycle ends exactly where it started
+        return position * self.REVOLUTION // self.POSITIONS
+
+    def finish_rotate(self, position:int, phases:int, stats) -> None:
+        self.last_move = stats
+        print(f"Motor turning: {self.last_move}\n") # <--------------------------------------------------------------------------------- #DEBUG
+        self.phase = (self.phase + phases) % self.REVOLUTION
+        self.position = position
+        self.save_position(self.position)
 
     def rotate_return(self) -> None:
-        steps = 250 * 6
-        self.stepper_rotate(steps, 3, direction = -1)
+        steps = self.POSITION_STEPS * (self.POSITIONS - 1)
+        self.stepper_move(steps, direction = -1)
+
+    def move_to(self, phase:int, shortest:bool = True) -> None:
+        # Turns to a phase of the revolution, the shorter way round or always forward
+        self.check_continuous()
+        delta = (phase - self.phase) % self.REVOLUTION
+        if shortest and delta > self.REVOLUTION // 2:
+            delta -= self.REVOLUTION
+        if delta == 0:
+            return
+        self.move_by(delta)
+        self.journal.save(phase=self.phase)
+
+    def move_by(self, phases:int) -> None:
+        # Moves any number of phases, backwards when negative, and carries on from the coil pattern the last move ended on.
+        # At phase p the coils hold FORWARD[(p - 1) % 8], so phase 0 is where a move of whole sequences ends
+        self.check_continuous()
+        if phases == 0:
+            return
+        if phases > 0:
+            self.last_move = self.coils.move(FORWARD, self.planner.plan(phases), self.phase % 8)
+        else:
+            self.last_move = self.coils.move(BACKWARD, self.planner.plan(-phases), (1 - self.phase) % 8)
+        self.phase = (self.phase + phases) % self.REVOLUTION
+        print(f"Motor turning: {self.last_move}\n") # <--------------------------------------------------------------------------------- #DEBUG
+
+    def check_continuous(self) -> None:
+        # The phase is only kept in continuous mode, in the normal mode a move from it would start from a stale phase
+        if not self.CONTINUOUS:
+            raise RuntimeError("move_to() and move_by() need continuous mode, the phase isn't kept otherwise")
 
     def save_position(self, position) -> None:
-        if position > 6:
+        if position >= self.POSITIONS:
             position = 0
-        self.files.write_settings({"position":position})
+        if self.CONTINUOUS:
+            self.journal.save(position=position, phase=self.phase)
+        else:
+            self.journal.save(position=position)
+
+    def cycle_cost(self) -> tuple:
+        # (phases, motor-on milliseconds) for all the moves in one full cycle through the positions
+        if self.CONTINUOUS:
+            phases = duration_us = 0
+            for position in range(self.POSITIONS):
+                move = self.planner.plan((self.position_phase(position + 1) - self.position_phase(position)) % self.REVOLUTION)
+                phases += move.phases
+                duration_us += move.duration_us
+            return (phases, duration_us // 1000)
+        move = self.planner.plan(self.POSITION_STEPS * len(FORWARD))
+        sweep = self.planner.plan(self.POSITION_STEPS * len(FORWARD) * (self.POSITIONS - 1))
+        return ((self.POSITIONS - 1) * move.phases + sweep.phases, ((self.POSITIONS - 1) * move.duration_us + sweep.duration_us) // 1000)
     
     def read_position(self) -> int:
-        try:
-            settings = self.files.read_settings()
-            position = int(settings["position"])
-        except:
-            position = 0
-        return position
+        if self.journal.position == None:
+            return 0
+        return self.journal.position
 
     def stepper_rotate(self, steps:int, time:float, direction:int = 1) -> None:
-        delay = time / steps
-        if direction == 1:
-            SEQUENCE = [[1, 0, 0, 1],
-                        [1, 0, 0, 0],
-                        [1, 1, 0, 0],
-                        [0, 1, 0, 0],
-                        [0, 1, 1, 0],
-                        [0, 0, 1, 0],
-                        [0, 0, 1, 1],
-                        [0, 0, 0, 1]]
-        else: 
-            SEQUENCE = [[0, 0, 0, 1],
-                        [0, 0, 1, 1],
-                        [0, 0, 1, 0],
-                        [0, 1, 1, 0],
-                        [0, 1, 0, 0],
-                        [1, 1, 0, 0],
-                        [1, 0, 0, 0],
-                        [1, 0, 0, 1]]
-        
-        for _ in range(steps):
-            for step in range(8):
-                self.stepper_in1.value(SEQUENCE[step][0])
-                self.stepper_in2.value(SEQUENCE[step][1])
-                self.stepper_in3.value(SEQUENCE[step][2])
-                self.stepper_in4.value(SEQUENCE[step][3])
-                sleep(delay)
-        print(f"Motor turning\n") # <------------------------------------------------------------------------------------------------------- #DEBUG
-        self.stepper_in1.value(0)
-        self.stepper_in2.value(0)
-        self.stepper_in3.value(0)
-        self.stepper_in4.value(0)
+        # Runs steps full 8-phase sequences in time seconds at a constant speed
+        sequence = FORWARD if direction == 1 else BACKWARD
+        self.last_move = self.coils.move(sequence, constant(steps * len(sequence), int(time * 1000000)))
+        print(f"Motor turning: {self.last_move}\n") # <--------------------------------------------------------------------------------- #DEBUG
+
+    def stepper_move(self, steps:int, direction:int = 1) -> None:
+        # Runs steps full 8-phase sequences as fast as the planner allows
+        sequence = FORWARD if direction == 1 else BACKWARD
+        self.last_move = self.coils.move(sequence, self.planner.plan(steps * len(sequence)))
+        print(f"Motor turning: {self.last_move}\n") # <--------------------------------------------------------------------------------- #DEBUG
 
 
 if __name__ == "__main__":
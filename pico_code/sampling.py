@@ -0,0 +1,78 @@
+from array import array
+
+class Burst_Reader:
+    """
+    Reads an ADC samples times in a row and filters the burst down to one value, so a single noisy sample can't
+    decide anything. The samples are sorted into an array('H') allocated once as they are read, then the filter is
+    the median, or with trim > 0 the mean of what is left when the trim lowest and trim highest are dropped.
+    """
+
+    def __init__(self, adc, samples:int = 16, trim:int = 0) -> None:
+        if samples < 1 or 2 * trim >= samples:
+            raise ValueError("A burst needs at least one sample left after trimming")
+        self.adc = adc
+        self.SAMPLES = samples
+        self.TRIM = trim
+        self.burst = array("H", [0] * samples) # The last burst, sorted
+
+    def read(self) -> int:
+        read_u16 = self.adc.read_u16
+        burst = self.burst
+        for i in range(self.SAMPLES):
+            # Insertion sort while reading, a burst is only a few samples
+            value = read_u16()
+            j = i
+            while j > 0 and burst[j - 1] > value:
+                burst[j] = burst[j - 1]
+                j -= 1
+            burst[j] = value
+        if self.TRIM == 0:
+            return self.median()
+        return self.trimmed_mean()
+
+    def median(self) -> int:
+        burst = self.burst
+        middle = self.SAMPLES // 2
+        if self.SAMPLES % 2:
+            return burst[middle]
+        return (burst[middle - 1] + burst[middle] + 1) // 2
+
+    def trimmed_mean(self) -> int:
+        burst = self.burst
+        total = 0
+        for i in range(self.TRIM, self.SAMPLES - self.TRIM):
+            total += burst[i]
+        count = self.SAMPLES - 2 * self.TRIM
+        return (total + count // 2) // count
+
+
+class Rolling_Window:
+    # The last size values in a ring buffer allocated once, with a running sum so mean() doesn't loop
+
+    def __init__(self, size:int = 6) -> None:
+        self.SIZE = size
+        self.values = array("H", [0] * size)
+        self.index = 0 # Where the next value goes
+        self.count = 0
+        self.total = 0
+
+    def push(self, value:int) -> None:
+        if self.count == self.SIZE:
+            self.total -= self.values[self.index]
+        else:
+            self.count += 1
+        self.values[self.index] = value
+        self.total += value
+        self.index += 1
+        if self.index == self.SIZE:
+            self.index = 0
+
+    def mean(self) -> int:
+        if self.count == 0:
+            return None
+        return (self.total + self.count // 2) // self.count
+
+    def last(self) -> int:
+        if self.count == 0:
+            return None
+        return self.values[self.index - 1] # index - 1 is -1 right after wrapping, which is the last slot
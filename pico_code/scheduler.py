@@ -0,0 +1,111 @@
+import uasyncio as asyncio # On the host the simulator puts its stand-in in sys.modules, see simulator/aio.py
+from time import ticks_ms, ticks_add, ticks_diff
+
+class Jitter:
+    # How late a task woke up compared to its deadline, in milliseconds
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0
+        self.worst = 0
+        self.last = 0
+
+    def record(self, late_ms:int) -> None:
+        self.count += 1
+        self.total += late_ms
+        self.last = late_ms
+        if late_ms > self.worst:
+            self.worst = late_ms
+
+    def mean(self) -> float:
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+
+class Scheduler:
+    """
+    Cooperative scheduler on uasyncio. Every task is a plain function that does its work and returns the milliseconds
+    until it wants to run again, counted from the deadline it was woken for, or None to sleep until wake() is called.
+    A task that has to wait for something, like the network, can be an async function instead, it is awaited.
+    Each task sleeps until its own deadline and records in jitter[name] how late it actually woke up.
+    A plain function that takes long, like a blocking motor move, delays every other task, which shows up as jitter.
+    wake() runs a task right away, also before its deadline, and wake_from_irq() does the same from interrupt handlers.
+    """
+    running = None # The scheduler of the running program, for reports from outside
+
+    def __init__(self) -> None:
+        self.tasks = []
+        self.jitter = {}
+        self.events = {}
+        self.woken = [] # Tasks woken from interrupt handlers, the flag makes irq_wakes() wake them
+        self.flag = None
+
+    def add(self, name:str, step, delay_ms:int = 0) -> None:
+        self.tasks.append((name, step, delay_ms))
+        self.jitter[name] = Jitter()
+        self.events[name] = None # The events are made in run(), uasyncio wants them made inside the event loop
+
+    def wake(self, name:str) -> None:
+        # Runs the task now, it counts its next deadline from here
+        if self.events[name] != None:
+            self.events[name].set()
+
+    def wake_from_irq(self, name:str) -> None:
+        # Events aren't safe to set from an interrupt, a ThreadSafeFlag is
+        if not name in self.woken:
+            self.woken.append(name)
+        if self.flag != None:
+            self.flag.set()
+
+    async def irq_wakes(self) -> None:
+        while True:
+            await self.flag.wait()
+            while self.woken:
+                self.wake(self.woken.pop(0))
+
+    async def loop(self, name:str, step, delay_ms:int) -> None:
+        jitter = self.jitter[name]
+        event = self.events[name]
+        deadline = ticks_add(ticks_ms(), delay_ms)
+        while True:
+            if deadline == None:
+                await event.wait()
+            else:
+                wait = ticks_diff(deadline, ticks_ms())
+                try:
+                    await asyncio.wait_for(event.wait(), wait / 1000 if wait > 0 else 0)
+                    deadline = None # Woken before the deadline
+                except asyncio.TimeoutError:
+                    jitter.record(ticks_diff(ticks_ms(), deadline))
+            event.clear()
+            delay = step()
+            if hasattr(delay, "send"): # An async task returned its coroutine, the delay comes from awaiting it
+                delay = await delay
+            now = ticks_ms()
+            if delay == None:
+                deadline = None
+            elif deadline == None or ticks_diff(ticks_add(deadline, delay), now) < 0:
+                deadline = ticks_add(now, delay) # Woken by an event, or so late that the next deadline has passed too
+            else:
+                deadline = ticks_add(deadline, delay)
+
+    async def main(self) -> None:
+        tasks = []
+        for name, step, delay_ms in self.tasks:
+            self.events[name] = asyncio.Event()
+            tasks.append(asyncio.create_task(self.loop(name, step, delay_ms)))
+        self.flag = asyncio.ThreadSafeFlag()
+        tasks.append(asyncio.create_task(self.irq_wakes()))
+        await asyncio.gather(*tasks)
+
+    def run(self) -> None:
+        Scheduler.running = self
+        asyncio.run(self.main())
+
+    def report(self) -> str:
+        lines = []
+        for name, step, delay_ms in self.tasks:
+            jitter = self.jitter[name]
+            lines.append(f"{name}: {jitter.count} runs, jitter mean {jitter.mean():.1f} ms, worst {jitter.worst} ms")
+        return "\n".join(lines)
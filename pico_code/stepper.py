@@ -0,0 +1,242 @@
+from machine import Pin, Timer
+from time import ticks_us, ticks_add, ticks_diff, sleep_us, sleep_ms
+import machine
+
+# Half-step sequence for the 28BYJ-48 through the ULN2003 board, one 4-bit coil mask per phase.
+# Bit 3 is IN1 (GPIO 21) down to bit 0 for IN4 (GPIO 18), so a mask shifted up by 18 lines up with the GPIO pins
+FORWARD = bytearray((0b1001, 0b1000, 0b1100, 0b0100, 0b0110, 0b0010, 0b0011, 0b0001))
+BACKWARD = bytearray(reversed(FORWARD))
+
+
+class Coils:
+    # A way of setting the four coils from a mask, bit 3 is the first pin in pins
+
+    def __init__(self, pins:tuple = (21, 20, 19, 18)) -> None:
+        self.pins = [Pin(pin, Pin.OUT, value=0) for pin in pins]
+        self.writes = 0
+
+    def write(self, mask:int) -> None:
+        pass
+
+    def off(self) -> None:
+        self.write(0)
+
+    def move(self, sequence:bytearray, profile:"Profile", first:int = 0) -> "Move_Stats":
+        """
+        Runs through the sequence from index first for profile.phases phases and turns the coils off when the last one is over.
+        Every phase has an absolute deadline counted from the start, so a late phase doesn't push the ones after it.
+        """
+        write = self.write
+        count = len(sequence)
+        ramp = profile.ramp
+        up = profile.ramp_phases
+        down = up + profile.cruise_phases # First phase of the ramp down
+        phases = profile.phases
+        cruise_us = profile.cruise_us
+        cruise_phases = profile.cruise_phases
+        remainder = profile.cruise_remainder
+        carry = 0
+        late_total = 0
+        late_worst = 0
+        start = ticks_us()
+        deadline = start
+        for i in range(phases):
+            wait = ticks_diff(deadline, ticks_us())
+            if wait > 0:
+                sleep_us(wait)
+            else:
+                late_total -= wait
+                if -wait > late_worst: late_worst = -wait
+            write(sequence[(first + i) % count])
+            if i < up:
+                delay = ramp[i]
+            elif i < down:
+                delay = cruise_us
+                carry += remainder # Spreads the remainder over the cruise like in Bresenham's line algorithm
+                if carry >= cruise_phases:
+                    carry -= cruise_phases
+                    delay += 1
+            else:
+                delay = ramp[phases - 1 - i]
+            deadline = ticks_add(deadline, delay)
+        wait = ticks_diff(deadline, ticks_us())
+        if wait > 0: sleep_us(wait)
+        self.off()
+        return Move_Stats(phases // count, phases, profile.duration_us, ticks_diff(ticks_us(), start), late_total, late_worst)
+
+
+class Pin_Coils(Coils):
+    # One Pin.value() per coil, works on any pins
+
+    def write(self, mask:int) -> None:
+        pins = self.pins
+        pins[0].value(mask & 8)
+        pins[1].value(mask & 4)
+        pins[2].value(mask & 2)
+        pins[3].value(mask & 1)
+        self.writes += 4
+
+
+class Port_Coils(Coils):
+    """
+    All four coils in one write to the RP2040's SIO GPIO_OUT_XOR register, which only flips the bits that are set,
+    so the other GPIO pins are never touched. The pins must be contiguous and given from the highest GPIO down.
+    """
+
+    def __init__(self, pins:tuple = (21, 20, 19, 18)) -> None:
+        super().__init__(pins) # Pin() sets the pins up as SIO outputs, all low
+        self.GPIO_OUT_XOR = 0xd0000000 + 0x01c # SIO base + GPIO_OUT_XOR
+        self.SHIFT = pins[-1]
+        self.state = 0 # The mask on the pins now, so the XOR can be worked out without reading the register
+
+    def write(self, mask:int) -> None:
+        machine.mem32[self.GPIO_OUT_XOR] = (self.state ^ mask) << self.SHIFT
+        self.state = mask
+        self.writes += 1
+
+
+class Background_Move:
+    """
+    A move like Coils.move() that runs from machine.Timer callbacks, so start() returns right away.
+    Every callback writes one phase and sets the timer again for the deadline of the next one, the coils turn off
+    after the last phase. poll() says whether the move is done and the first time it is, calls on_done(stats)
+    from the caller instead of from the timer. wait() is the same for uasyncio tasks and join() blocks.
+    """
+
+    def __init__(self, coils:Coils, sequence:bytearray, profile:"Profile", first:int = 0) -> None:
+        self.coils = coils
+        self.sequence = sequence
+        self.profile = profile
+        self.first = first
+        self.on_done = None
+        self.done = False
+        self.stats = None
+        self.timer = Timer()
+        self.callback = self.step # Bound once, not on every phase
+
+    def start(self) -> "Background_Move":
+        self.index = 0
+        self.carry = 0
+        self.late_total = 0
+        self.late_worst = 0
+        self.started = ticks_us()
+        self.deadline = self.started
+        if self.profile.phases == 0:
+            self.finish()
+        else:
+            self.step(None)
+        return self
+
+    def delay(self, i:int) -> int:
+        # Same phase times as Coils.move()
+        profile = self.profile
+        if i < profile.ramp_phases:
+            return profile.ramp[i]
+        if i < profile.ramp_phases + profile.cruise_phases:
+            self.carry += profile.cruise_remainder
+            if self.carry >= profile.cruise_phases:
+                self.carry -= profile.cruise_phases
+                return profile.cruise_us + 1
+            return profile.cruise_us
+        return profile.ramp[profile.phases - 1 - i]
+
+    def step(self, timer) -> None:
+        late = ticks_diff(ticks_us(), self.deadline)
+        if late > 0:
+            self.late_total += late
+            if late > self.late_worst: self.late_worst = late
+        i = self.index
+        if i == self.profile.phases:
+            self.finish()
+            return
+        self.coils.write(self.sequence[(self.first + i) % len(self.sequence)])
+        self.index = i + 1
+        self.deadline = ticks_add(self.deadline, self.delay(i))
+        wait = ticks_diff(self.deadline, ticks_us())
+        self.timer.init(mode=Timer.ONE_SHOT, period=wait if wait > 0 else 1, tick_hz=1000000, callback=self.callback)
+
+    def finish(self) -> None:
+        self.timer.deinit()
+        self.coils.off()
+        phases = self.profile.phases
+        self.stats = Move_Stats(phases // len(self.sequence), phases, self.profile.duration_us, ticks_diff(ticks_us(), self.started), self.late_total, self.late_worst)
+        self.done = True
+
+    def poll(self) -> bool:
+        if self.done and self.on_done != None:
+            on_done = self.on_done
+            self.on_done = None
+            on_done(self.stats)
+        return self.done
+
+    async def wait(self, poll_ms:int = 50) -> "Move_Stats":
+        import uasyncio as asyncio # Only imported when a task waits, see simulator/aio.py for the host
+        while not self.poll():
+            await asyncio.sleep(poll_ms / 1000)
+        return self.stats
+
+    def join(self, poll_ms:int = 50) -> "Move_Stats":
+        while not self.poll():
+            sleep_ms(poll_ms)
+        return self.stats
+
+
+class Profile:
+    """
+    How long every phase of a move lasts, in microseconds: the first ramp_phases entries of ramp to speed up,
+    cruise_phases at cruise_us, of which cruise_remainder get 1 us more, and the ramp backwards to slow down.
+    """
+
+    def __init__(self, ramp, ramp_phases:int, cruise_phases:int, cruise_us:int, cruise_remainder:int = 0) -> None:
+        self.ramp = ramp
+        self.ramp_phases = ramp_phases
+        self.cruise_phases = cruise_phases
+        self.cruise_us = cruise_us
+        self.cruise_remainder = cruise_remainder
+        self.phases = 2 * ramp_phases + cruise_phases
+        ramp_us = 0
+        for i in range(ramp_phases):
+            ramp_us += ramp[i]
+        self.duration_us = 2 * ramp_us + cruise_phases * cruise_us + cruise_remainder
+
+
+def constant(phases:int, duration_us:int) -> Profile:
+    # The same speed all the way, duration_us spread evenly over the phases
+    if phases == 0:
+        return Profile(None, 0, 0, 0)
+    return Profile(None, 0, phases, duration_us // phases, duration_us % phases)
+
+
+class Move_Stats:
+    # How one Coils.move() went, times in microseconds. A phase is late when it was written after its deadline
+
+    def __init__(self, steps:int, phases:int, requested_us:int, elapsed_us:int, late_total_us:int, late_worst_us:int) -> None:
+        self.steps = steps
+        self.phases = phases
+        self.requested_us = requested_us
+        self.elapsed_us = elapsed_us
+        self.late_total_us = late_total_us
+        self.late_worst_us = late_worst_us
+
+    def step_rate(self) -> float:
+        # Achieved steps per second
+        if self.elapsed_us <= 0:
+            return 0.0
+        return self.steps * 1000000 / self.elapsed_us
+
+    def late_mean_us(self) -> float:
+        if self.phases == 0:
+            return 0.0
+        return self.late_total_us / self.phases
+
+    def __str__(self) -> str:
+        return (f"{self.steps} steps in {self.elapsed_us / 1000:.1f} ms of {self.requested_us / 1000:.1f} ms, {self.step_rate():.1f} steps/s, "
+                f"phases late by {self.late_mean_us():.1f} us on average, {self.late_worst_us} us at worst")
+
+
+def coils(pins:tuple = (21, 20, 19, 18)) -> Coils:
+    # Port_Coils where the pins allow it, otherwise Pin_Coils
+    contiguous = list(pins) == list(range(pins[0], pins[0] - len(pins), -1))
+    if contiguous and len(pins) == 4 and hasattr(machine, "mem32"):
+        return Port_Coils(pins)
+    return Pin_Coils(pins)
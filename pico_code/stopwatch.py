@@ -0,0 +1,73 @@
+from time import ticks_ms, ticks_us, ticks_diff
+from array import array
+
+class Stopwatch:
+    """
+    Elapsed time in milliseconds from ticks_ms, or in microseconds from ticks_us with us=True. ticks_diff keeps it right
+    when the ticks wrap around and it doesn't care when the RTC is set, but one interval has to be shorter than half the
+    ticks period: about 6 days in ms, 9 minutes in us. elapsed(), expired() and remaining() allocate nothing, so they
+    can be polled in tight loops, and all of them take the ticks to use as now, for code that reads the ticks once.
+    lap() ends a lap and keeps the last LAPS lap times in lap_times, lap_min/lap_mean/lap_max cover every lap.
+    """
+
+    def __init__(self, us:bool = False, laps:int = 8, now:int = None) -> None:
+        self.ticks = ticks_us if us else ticks_ms
+        self.LAPS = laps
+        self.lap_times = array("i", [0] * laps) # A ring, lap_index is where the next lap goes
+        self.reset(now)
+
+    def reset(self, now:int = None) -> None:
+        # Starts again and forgets the laps
+        self.lap_index = 0
+        self.lap_count = 0
+        self.lap_total = 0
+        self.lap_shortest = 0
+        self.lap_longest = 0
+        self.start(now)
+
+    def start(self, now:int = None) -> None:
+        # Starts again from now, the laps are kept
+        if now == None: now = self.ticks()
+        self.started = now
+        self.lap_started = now
+
+    def elapsed(self, now:int = None) -> int:
+        if now == None: now = self.ticks()
+        return ticks_diff(now, self.started)
+
+    def expired(self, timeout:int, now:int = None) -> bool:
+        return self.elapsed(now) >= timeout
+
+    def remaining(self, timeout:int, now:int = None) -> int:
+        left = timeout - self.elapsed(now)
+        return left if left > 0 else 0
+
+    def lap(self, now:int = None) -> int:
+        # The time since the last lap, or since the start for the first one
+        if now == None: now = self.ticks()
+        time = ticks_diff(now, self.lap_started)
+        self.lap_started = now
+        self.lap_times[self.lap_index] = time
+        self.lap_index += 1
+        if self.lap_index == self.LAPS:
+            self.lap_index = 0
+        if self.lap_count == 0 or time < self.lap_shortest: self.lap_shortest = time
+        if self.lap_count == 0 or time > self.lap_longest: self.lap_longest = time
+        self.lap_count += 1
+        self.lap_total += time
+        return time
+
+    def lap_min(self) -> int:
+        return self.lap_shortest
+
+    def lap_max(self) -> int:
+        return self.lap_longest
+
+    def lap_mean(self) -> float:
+        if self.lap_count == 0:
+            return 0.0
+        return self.lap_total / self.lap_count
+
+    def get_time(self) -> int:
+        # Whole seconds, what Stopwatch used to count in
+        return self.elapsed() // (1000000 if self.ticks == ticks_us else 1000)
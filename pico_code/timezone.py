@@ -0,0 +1,242 @@
+from array import array
+from struct import pack, unpack, calcsize
+from os import listdir, rename
+from time import gmtime
+
+DAY = 24 * 3600
+DEFAULT_RULE = "CET-1CEST,M3.5.0,M10.5.0/3" # Danmark: UTC+1, sommertid UTC+2 fra sidste søndag i marts til sidste søndag i oktober
+
+def days_from_civil(year:int, month:int, day:int) -> int:
+    # Days since 1970-01-01, Howard Hinnant's days_from_civil, valid for any date in the Gregorian calendar
+    if month <= 2:
+        year -= 1
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+class Posix_Rule:
+    """
+    A POSIX TZ rule like "CET-1CEST,M3.5.0,M10.5.0/3": the standard time name and offset, and optionally a summer time
+    name, its offset (an hour more than standard when left out) and the dates and local times it starts and ends.
+    POSIX offsets count west of UTC, so CET-1 is UTC+1; the offsets kept here are seconds east of UTC.
+    Dates are Mm.w.d (weekday d, 0 is Sunday, of week w of month m, week 5 is the last one), Jn (day 1-365, February 29th
+    is never counted) or n (day 0-365). Times default to 02:00 and may be negative or past 24:00.
+    Raises ValueError when the rule can't be read.
+    """
+
+    def __init__(self, rule:str) -> None:
+        self.rule = rule
+        self.pos = 0
+        self.standard_name = self.name()
+        self.standard = -self.time()
+        self.summer_name = None
+        self.summer = self.standard
+        self.start = None
+        self.end = None
+        if self.pos < len(rule):
+            self.summer_name = self.name()
+            self.summer = self.standard + 3600
+            if self.pos < len(rule) and rule[self.pos] != ",":
+                self.summer = -self.time()
+            if self.pos >= len(rule):
+                raise ValueError(f"TZ rule '{rule}' has summer time but no dates for it")
+            self.expect(",")
+            self.start = self.date()
+            self.expect(",")
+            self.end = self.date()
+        if self.pos != len(rule):
+            raise ValueError(f"TZ rule '{rule}' has '{rule[self.pos:]}' left over")
+
+    def expect(self, char:str) -> None:
+        if self.rule[self.pos:self.pos + 1] != char:
+            raise ValueError(f"TZ rule '{self.rule}' needs '{char}' at {self.pos}")
+        self.pos += 1
+
+    def name(self) -> str:
+        rule = self.rule
+        start = self.pos
+        if rule[start:start + 1] == "<": # Names in <> may have digits and signs, like <+0530>
+            end = rule.find(">", start)
+            if end < 0:
+                raise ValueError(f"TZ rule '{rule}' has no '>'")
+            self.pos = end + 1
+            return rule[start + 1:end]
+        while self.pos < len(rule) and rule[self.pos].isalpha():
+            self.pos += 1
+        if self.pos - start < 3:
+            raise ValueError(f"TZ rule '{rule}' needs a name of 3 letters or more at {start}")
+        return rule[start:self.pos]
+
+    def number(self) -> int:
+        rule = self.rule
+        start = self.pos
+        while self.pos < len(rule) and rule[self.pos].isdigit():
+            self.pos += 1
+        if self.pos == start:
+            raise ValueError(f"TZ rule '{rule}' needs a number at {start}")
+        return int(rule[start:self.pos])
+
+    def time(self) -> int:
+        # [+-]hh[:mm[:ss]] in seconds
+        sign = 1
+        if self.rule[self.pos:self.pos + 1] in ("+", "-"):
+            if self.rule[self.pos] == "-": sign = -1
+            self.pos += 1
+        seconds = self.number() * 3600
+        for unit in (60, 1):
+            if self.rule[self.pos:self.pos + 1] != ":":
+                break
+            self.pos += 1
+            seconds += self.number() * unit
+        return sign * seconds
+
+    def date(self) -> tuple:
+        # (kind, month or day, week, weekday, local time in seconds), kind is "M", "J" or "" for the zero-based day
+        kind = self.rule[self.pos:self.pos + 1]
+        if kind in ("M", "J"):
+            self.pos += 1
+        else:
+            kind = ""
+        first = self.number()
+        week = weekday = 0
+        if kind == "M":
+            self.expect(".")
+            week = self.number()
+            self.expect(".")
+            weekday = self.number()
+            if not (1 <= first <= 12 and 1 <= week <= 5 and 0 <= weekday <= 6):
+                raise ValueError(f"TZ rule '{self.rule}' has a date out of range")
+        elif not (1 if kind == "J" else 0) <= first <= 365:
+            raise ValueError(f"TZ rule '{self.rule}' has a day out of range")
+        time = 7200
+        if self.rule[self.pos:self.pos + 1] == "/":
+            self.pos += 1
+            time = self.time()
+        return (kind, first, week, weekday, time)
+
+    def day(self, year:int, date:tuple) -> int:
+        # Days since 1970-01-01 of the date in the year
+        kind, first, week, weekday = date[:4]
+        january = days_from_civil(year, 1, 1)
+        if kind == "J":
+            leap = year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+            return january + first - 1 + (1 if leap and first >= 60 else 0)
+        if kind == "":
+            return january + first
+        month_start = days_from_civil(year, first, 1)
+        month_days = days_from_civil(year + first // 12, first % 12 + 1, 1) - month_start
+        day = month_start + (weekday - (month_start + 4) % 7) % 7 + (week - 1) * 7
+        while day - month_start >= month_days: # Week 5 means the last one, which may be the 4th
+            day -= 7
+        return day
+
+    def transitions(self, year:int) -> list:
+        # [(UTC time, offset from then on), ...] for the year in time order. The start is in standard time, the end in summer time
+        if self.start == None:
+            return []
+        changes = [(self.day(year, self.start) * DAY + self.start[4] - self.standard, self.summer),
+                   (self.day(year, self.end) * DAY + self.end[4] - self.summer, self.standard)]
+        changes.sort()
+        return changes
+
+
+class Transition_Table:
+    """
+    A TZ rule compiled into the UTC times at which the UTC offset changes, from January 1st of first_year and YEARS
+    years on, in one sorted array, with the offset in seconds from each time on in another. lookup() tries where the
+    last lookup was and does a binary search otherwise. The table is kept in FILE together with the rule it was
+    compiled from, so it is only compiled again when the rule changes or the time has passed the end of it.
+    """
+
+    def __init__(self, rule:str = DEFAULT_RULE, file_name:str = "timezone.bin", years:int = 10) -> None:
+        self.FILE = file_name
+        self.TEMP_FILE = file_name + ".tmp"
+        self.YEARS = years
+        self.HEADER = "<2sHB" # magic, number of transitions, length of the rule
+        self.MAGIC = b"TZ"
+        self.rule = Posix_Rule(rule)
+        self.times = array("q")
+        self.offsets = array("i")
+        self.index = 0 # Where the last lookup was, the next one is usually in the same place
+
+    def build(self, first_year:int) -> None:
+        rule = self.rule
+        times = [days_from_civil(first_year, 1, 1) * DAY]
+        offsets = [rule.standard]
+        for year in range(first_year, first_year + self.YEARS):
+            for time, offset in rule.transitions(year):
+                times.append(time)
+                offsets.append(offset)
+        if len(times) == 1: # No summer time, the table just ends after YEARS years
+            times.append(days_from_civil(first_year + self.YEARS, 1, 1) * DAY)
+            offsets.append(rule.standard)
+        elif offsets[1] == rule.standard:
+            offsets[0] = rule.summer # The year starts in summer time south of the equator
+        self.times = array("q", times)
+        self.offsets = array("i", offsets)
+        self.index = 0
+
+    def covers(self, unix_time_utc:int) -> bool:
+        # The last time is only there to say when the offset before it ends
+        return len(self.times) > 1 and self.times[0] <= unix_time_utc < self.times[-1]
+
+    def lookup(self, unix_time_utc:int) -> tuple:
+        # (offset in seconds, UTC time of the next change), covers() has to be True
+        times = self.times
+        i = self.index
+        if not times[i] <= unix_time_utc < times[i + 1]:
+            low = 0
+            high = len(times) - 1 # times[low] <= unix_time_utc < times[high] all the way
+            while high - low > 1:
+                middle = (low + high) >> 1
+                if times[middle] <= unix_time_utc:
+                    low = middle
+                else:
+                    high = middle
+            i = low
+            self.index = i
+        return (self.offsets[i], times[i + 1])
+
+    def update(self, unix_time_utc:int) -> None:
+        # Makes sure the table covers the time, from the file or compiled again and saved
+        if self.covers(unix_time_utc):
+            return
+        self.load()
+        if not self.covers(unix_time_utc):
+            self.build(gmtime(unix_time_utc)[0])
+            self.save()
+
+    def load(self) -> None:
+        try:
+            if not self.FILE in listdir():
+                return
+            file = open(self.FILE,"rb")
+            data = file.read()
+            file.close()
+            header_size = calcsize(self.HEADER)
+            if len(data) < header_size:
+                return
+            magic, count, rule_length = unpack(self.HEADER, data[:header_size])
+            start = header_size + rule_length
+            if magic != self.MAGIC or len(data) != start + count * 12 or data[header_size:start] != self.rule.rule.encode():
+                return # Not a table, or a table for another rule
+            self.times = array("q", unpack(f"<{count}q", data[start:start + count * 8]))
+            self.offsets = array("i", unpack(f"<{count}i", data[start + count * 8:]))
+            self.index = 0
+        except (OSError, ValueError):
+            pass
+
+    def save(self) -> None:
+        # Written next to the old file and renamed over it, like the settings
+        try:
+            file = open(self.TEMP_FILE,"wb")
+            count = len(self.times)
+            rule = self.rule.rule.encode()
+            file.write(pack(self.HEADER, self.MAGIC, count, len(rule)) + rule + pack(f"<{count}q", *self.times) + pack(f"<{count}i", *self.offsets))
+            file.close()
+            rename(self.TEMP_FILE, self.FILE)
+        except OSError as e:
+            print("Could not save the timezone table:", e) # <------------------------------------------------------------ #DEBUG
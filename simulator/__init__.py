@@ -0,0 +1,225 @@
+"""
+Host-side simulator for the AutoPlant firmware.
+
+Installs stand-ins for the MicroPython modules the code in pico_code imports (machine, neopixel,
+network, _thread, socket, select, os, uasyncio and the MicroPython flavour of time) on top of a virtual clock, so the
+firmware runs unmodified under CPython and weeks of operation take seconds. Files go to a counted
+stand-in for the flash filesystem in a temporary directory.
+
+    with Simulator() as sim:
+        report = sim.run_main(weeks=6)
+"""
+import builtins
+import os
+import runpy
+import sys
+import tempfile
+from time import thread_time, perf_counter
+from types import ModuleType
+from simulator.clock import Virtual_Clock, Simulation_Stop
+from simulator.board import Board, Device_Reset
+from simulator.flash import Flash
+from simulator import board as hardware
+from simulator import aio
+
+PICO_CODE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pico_code")
+FAKE_MODULES = ("machine", "neopixel", "network", "_thread", "socket", "select", "time", "os", "uasyncio")
+WEEK = 60 * 60 * 24 * 7
+
+
+class Null_Output:
+    def write(self, text:str) -> int:
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+
+class Loop_Report:
+
+    def __init__(self, virtual_seconds:float, wall_seconds:float, iteration_cpu_us:list, board:Board, flash:Flash, jitter:dict = None) -> None:
+        self.virtual_seconds = virtual_seconds
+        self.wall_seconds = wall_seconds
+        self.iteration_cpu_us = iteration_cpu_us
+        self.iterations = len(iteration_cpu_us)
+        self.motor_moves = board.motor_moves
+        self.motor_on_seconds = board.motor_on_us / 1000000
+        self.strip_writes = board.strip_writes
+        self.ntp_queries = board.ntp_queries
+        self.flash = flash.counters()
+        self.jitter = jitter or {} # Scheduler task name -> Jitter
+
+    def per_iteration(self, counter:str) -> float:
+        return self.flash[counter] / max(self.iterations, 1)
+
+    def cpu_stats(self) -> tuple:
+        if not self.iteration_cpu_us: return (0, 0, 0, 0)
+        ordered = sorted(self.iteration_cpu_us)
+        mean = sum(ordered) / len(ordered)
+        return (ordered[0], mean, ordered[len(ordered) // 2], ordered[-1])
+
+    def __str__(self) -> str:
+        low, mean, median, high = self.cpu_stats()
+        jitter = [f"{name} mean {task.mean():.1f} worst {task.worst}" for name, task in self.jitter.items()]
+        return "\n".join((
+            f"Simulated {self.virtual_seconds / WEEK:.2f} weeks in {self.wall_seconds:.2f} s wall time ({self.virtual_seconds / max(self.wall_seconds, 1e-9):.0f}x)",
+            f"Loop iterations: {self.iterations}, motor moves: {self.motor_moves} ({self.motor_on_seconds:.1f} s on), strip writes: {self.strip_writes}, NTP queries: {self.ntp_queries}",
+            f"CPU per iteration (us): min {low:.1f}, mean {mean:.1f}, median {median:.1f}, max {high:.1f}",
+            f"Flash per iteration: {self.per_iteration('opens'):.3f} opens, {self.per_iteration('listdirs'):.3f} listdirs, {self.per_iteration('bytes_written'):.1f} bytes written",
+        ) + ((f"Scheduler jitter (ms): {', '.join(jitter)}",) if jitter else ()))
+
+
+class Simulator:
+
+    def __init__(self, utc_start:int = 1681149214, workdir:str = None) -> None:
+        self.clock = Virtual_Clock(utc_start)
+        self.board = Board(self.clock)
+        self.workdir = workdir
+        self.tempdir = None
+        self.flash = None
+        self.saved_modules = {}
+        self.saved_cwd = None
+        self.installed = False
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.uninstall()
+
+    def build_modules(self) -> dict:
+        clock = self.clock
+        board = self.board
+
+        def reset():
+            board.resets += 1
+            raise Device_Reset
+
+        machine = ModuleType("machine")
+        machine.Pin = hardware.Pin
+        machine.ADC = hardware.ADC
+        machine.mem32 = hardware.Memory32()
+        machine.Timer = hardware.Timer
+        machine.RTC = hardware.RTC
+        machine.reset = reset
+        machine.freq = lambda hz = None: 125000000
+        machine.idle = lambda: None
+        machine.lightsleep = lambda ms = 0: clock.sleep_ms(ms)
+        machine.unique_id = lambda: b"\xe6\x61\x41\x04\x03\x5a\x2b\x2c"
+
+        neopixel = ModuleType("neopixel")
+        neopixel.NeoPixel = hardware.NeoPixel
+
+        network = ModuleType("network")
+        network.WLAN = hardware.WLAN
+        network.STA_IF = 0
+        network.AP_IF = 1
+
+        thread = ModuleType("_thread")
+        thread.start_new_thread = hardware.start_new_thread
+        thread.allocate_lock = self.saved_modules["_thread"].allocate_lock
+        thread.get_ident = self.saved_modules["_thread"].get_ident
+
+        socket = ModuleType("socket")
+        socket.socket = hardware.socket
+        socket.getaddrinfo = hardware.getaddrinfo
+        socket.AF_INET = hardware.AF_INET
+        socket.SOCK_DGRAM = hardware.SOCK_DGRAM
+
+        select = ModuleType("select")
+        select.poll = hardware.poll
+        select.POLLIN = hardware.POLLIN
+        select.POLLOUT = hardware.POLLOUT
+
+        time = ModuleType("time")
+        for name in ("sleep", "sleep_ms", "sleep_us", "ticks_ms", "ticks_us", "ticks_add", "ticks_diff",
+                     "time", "time_ns", "gmtime", "localtime", "mktime"):
+            setattr(time, name, getattr(clock, name))
+        time.ticks_cpu = clock.ticks_us
+
+        return {"machine": machine, "neopixel": neopixel, "network": network, "_thread": thread, "socket": socket, "select": select, "time": time,
+                "os": self.flash.module(), "uasyncio": aio.module(clock)}
+
+    def pico_modules(self) -> list:
+        return [name[:-3] for name in os.listdir(PICO_CODE) if name.endswith(".py")]
+
+    def purge_pico_modules(self) -> None:
+        for name in self.pico_modules() + ["simulator.legacy"]:
+            sys.modules.pop(name, None)
+        globals().pop("legacy", None) # Or "from simulator import legacy" finds the old one on the package
+
+    def install(self) -> None:
+        # Firmware modules bind the fakes at import time, so they are imported fresh for every simulator
+        for name in FAKE_MODULES:
+            self.saved_modules[name] = sys.modules.get(name)
+        if self.saved_modules["_thread"] is None:
+            import _thread
+            self.saved_modules["_thread"] = _thread
+        if self.workdir is None:
+            self.tempdir = tempfile.TemporaryDirectory(prefix="autoplant-")
+            self.workdir = self.tempdir.name
+        self.flash = Flash(self.workdir)
+        sys.modules.update(self.build_modules())
+        self.purge_pico_modules()
+        if PICO_CODE not in sys.path: sys.path.insert(0, PICO_CODE)
+        self.saved_cwd = os.getcwd()
+        os.chdir(self.workdir)
+        builtins.open = self.flash.open
+        Board.active = self.board
+        self.installed = True
+
+    def uninstall(self) -> None:
+        if not self.installed: return
+        self.clock.stop()
+        self.purge_pico_modules()
+        for name, module in self.saved_modules.items():
+            if module is None: sys.modules.pop(name, None)
+            else: sys.modules[name] = module
+        if PICO_CODE in sys.path: sys.path.remove(PICO_CODE)
+        builtins.open = self.flash.real_open
+        os.chdir(self.saved_cwd)
+        if self.tempdir is not None:
+            self.tempdir.cleanup()
+            self.tempdir = None
+            self.workdir = None
+        Board.active = None
+        self.installed = False
+
+    def run_main(self, weeks:float = 0, seconds:float = 0, quiet:bool = True, script:str = None) -> Loop_Report:
+        """
+        Runs the __main__ loop of main.py, or of another script like simulator/legacy_main.py, until the virtual clock has moved the given time.
+        An iteration ends with the sleep that completes main.UPDATE_INTERVAL of virtual time since the last one ended,
+        CPU time is measured on the calling thread.
+        """
+        import main
+        interval_us = int(main.UPDATE_INTERVAL * 1000000)
+        iteration_cpu_us = []
+        last = [None, None] # CPU time and virtual time at the end of the last iteration
+
+        def on_sleep(us:int) -> None:
+            end_us = self.clock.now_us + us
+            if last[1] is not None and end_us - last[1] < interval_us: return
+            now = thread_time()
+            if last[0] is not None: iteration_cpu_us.append((now - last[0]) * 1000000)
+            last[0] = now
+            last[1] = end_us
+
+        self.clock.sleep_hooks.append(on_sleep)
+        start_us = self.clock.now_us
+        self.clock.run_for(weeks * WEEK + seconds)
+        stdout = sys.stdout
+        if quiet: sys.stdout = Null_Output()
+        start = perf_counter()
+        try:
+            runpy.run_path(script or os.path.join(PICO_CODE, "main.py"), run_name="__main__")
+        except Simulation_Stop:
+            pass
+        finally:
+            wall = perf_counter() - start
+            sys.stdout = stdout
+            self.clock.sleep_hooks.remove(on_sleep)
+            self.clock.stop()
+        scheduler = sys.modules.get("scheduler")
+        jitter = scheduler.Scheduler.running.jitter if scheduler and scheduler.Scheduler.running else None
+        return Loop_Report((self.clock.now_us - start_us) / 1000000, wall, iteration_cpu_us, self.board, self.flash, jitter)
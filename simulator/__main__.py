@@ -0,0 +1,18 @@
+import argparse
+from simulator import Simulator
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m simulator", description="Runs pico_code/main.py on the host against a virtual clock")
+    parser.add_argument("--weeks", type=float, default=6, help="virtual time to simulate (default 6 weeks)")
+    parser.add_argument("--moisture", type=int, default=30000, help="raw ADC value of the moisture sensor (default 30000)")
+    parser.add_argument("--turn-rate", choices=("2", "4", "6"), default="4", help="DIP switch setting in weeks (default 4)")
+    parser.add_argument("--rtc-drift", type=float, default=0, help="how fast the RTC runs against real time in ppm (default 0)")
+    parser.add_argument("--verbose", action="store_true", help="show the firmware's prints")
+    args = parser.parse_args()
+
+    with Simulator() as sim:
+        sim.board.adc[sim.board.MOISTURE_PIN] = args.moisture
+        sim.clock.rtc_drift_ppm = args.rtc_drift
+        if args.turn_rate == "2": sim.board.set_pin(27, 1)
+        if args.turn_rate == "6": sim.board.set_pin(28, 1)
+        print(sim.run_main(weeks=args.weeks, quiet=not args.verbose))
@@ -0,0 +1,87 @@
+"""
+uasyncio stand-in: CPython's asyncio on an event loop that runs on the virtual clock. The loop's time is the
+virtual clock and waiting for the next timer advances it, so the firmware's tasks run unmodified and weeks of
+scheduling take seconds. Sockets are not polled, the simulated network answers straight away.
+"""
+import asyncio
+import math
+import selectors
+from types import ModuleType
+
+
+class Virtual_Selector(selectors.BaseSelector):
+
+    def __init__(self, clock) -> None:
+        self.clock = clock
+        self.keys = {}
+
+    def register(self, fileobj, events, data = None):
+        key = selectors.SelectorKey(fileobj, fileobj if isinstance(fileobj, int) else fileobj.fileno(), events, data)
+        self.keys[fileobj] = key
+        return key
+
+    def unregister(self, fileobj):
+        return self.keys.pop(fileobj)
+
+    def select(self, timeout:float = None) -> list:
+        if timeout is None:
+            raise RuntimeError("Every task is waiting for an event that nothing will set")
+        if timeout > 0:
+            self.clock.advance_us(math.ceil(timeout * 1000000), interruptible=True)
+        return []
+
+    def get_map(self) -> dict:
+        return self.keys
+
+
+class Virtual_Event_Loop(asyncio.SelectorEventLoop):
+
+    def __init__(self, clock) -> None:
+        self.clock = clock
+        super().__init__(Virtual_Selector(clock))
+        # The clock counts microseconds. With the host clock's 1 ns, a timer due now is never run once the time in
+        # seconds is past 2^24 (194 days), because adding 1 ns doesn't change the float any more
+        self._clock_resolution = 1e-6
+
+    def time(self) -> float:
+        return self.clock.now_us / 1000000
+
+
+class ThreadSafeFlag:
+    """
+    uasyncio.ThreadSafeFlag. The timer and pin callbacks run on the event loop's thread here so an Event will do,
+    but like on the Pico, setting the flag also ends the sleep the event loop is in.
+    """
+
+    def __init__(self, clock) -> None:
+        self.clock = clock
+        self.event = asyncio.Event()
+
+    def set(self) -> None:
+        self.event.set()
+        self.clock.interrupt()
+
+    def clear(self) -> None:
+        self.event.clear()
+
+    async def wait(self) -> None:
+        await self.event.wait()
+        self.event.clear()
+
+
+def module(clock) -> ModuleType:
+    uasyncio = ModuleType("uasyncio")
+    for name in asyncio.__all__:
+        setattr(uasyncio, name, getattr(asyncio, name))
+
+    def run(coroutine):
+        with asyncio.Runner(loop_factory=lambda: Virtual_Event_Loop(clock)) as runner:
+            return runner.run(coroutine)
+
+    async def sleep_ms(ms:int) -> None:
+        await asyncio.sleep(ms / 1000)
+
+    uasyncio.run = run
+    uasyncio.sleep_ms = sleep_ms
+    uasyncio.ThreadSafeFlag = lambda: ThreadSafeFlag(clock)
+    return uasyncio
@@ -0,0 +1,847 @@
+"""
+Benchmarks of the firmware running in the simulator, each compares the original code (simulator.legacy) with the current code.
+
+    python -m simulator.bench [name ...]
+"""
+import os
+import random
+import sys
+from contextlib import redirect_stdout
+from time import perf_counter
+from simulator import Simulator, Null_Output
+from simulator.flash import Power_Loss
+
+DAY = 60 * 60 * 24
+LEGACY_MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "legacy_main.py") # The loop before the scheduler
+
+
+def per_call_us(function, calls:int) -> float:
+    start = perf_counter()
+    for i in range(calls):
+        function(i)
+    return (perf_counter() - start) / calls * 1000000
+
+
+def jitter_summary(jitter:dict) -> str:
+    return ", ".join(f"{name} mean {value.mean():.1f} worst {value.worst}" for name, value in jitter.items())
+
+
+def rainbow_frame(led, led_on_single, hue_to_rgb, i:int, trail_length:int = 25) -> None:
+    # One frame of LED_Strip.led_rainbow_trail without the sleep
+    pixel = i % led.LED_PIXELS
+    led_on_single(pixel, hue_to_rgb(i % 255 + 1), False)
+    led.led_strip[(pixel - trail_length) % led.LED_PIXELS] = (0, 0, 0)
+    led.led_strip.write()
+
+
+def bench_settings() -> None:
+    "Flash traffic of the settings file per iteration of the original main loop"
+    for label in ("before", "after"):
+        with Simulator() as sim:
+            if label == "before":
+                import device, rotation
+                from simulator import legacy
+                device.Files = rotation.Files = legacy.Files
+            report = sim.run_main(seconds=DAY, script=LEGACY_MAIN)
+        print(f"{label:>6}: {report.per_iteration('opens'):.3f} opens, {report.per_iteration('listdirs'):.3f} listdirs, "
+              f"{report.per_iteration('bytes_read'):.1f} bytes read per iteration ({report.iterations} iterations), "
+              f"CPU {report.cpu_stats()[1]:.1f} us per iteration")
+
+
+def bench_transaction() -> None:
+    "Flash writes when the timezone expires, and what is left of the settings after a power loss during that write"
+    for label in ("before", "after"):
+        for power_loss in (False, True):
+            with Simulator() as sim:
+                import device
+                from simulator import legacy
+                files = legacy.Files() if label == "before" else device.Files()
+                files.write_settings({"wifi_ssid":"plants", "wifi_password":"hunter22", "position":3, "next_rotation":1681753014})
+                time = device.Time()
+                time.files = files
+                time.transitions.update(0) # The transition table has its own file
+                sim.flash.reset_counters()
+                if power_loss: sim.flash.power_loss_at_write = 2 if label == "before" else 1
+                try:
+                    with redirect_stdout(Null_Output()):
+                        if label == "before": legacy.check_timezone(time, 0)
+                        else: time.check_timezone(0)
+                except Power_Loss:
+                    pass
+                counters = sim.flash.counters()
+                device.Files.settings_cache = None # Reboot
+                kept = len([key for key in files.read_settings() if key != None])
+            if power_loss:
+                print(f"{label:>6}: power loss during the write keeps {kept} of 6 settings")
+            else:
+                print(f"{label:>6}: {counters['opens_for_write']} writes, {counters['opens'] - counters['opens_for_write']} reads, "
+                      f"{counters['bytes_written']} bytes written")
+
+
+def bench_journal() -> None:
+    "Flash bytes written per rotation for next_rotation and position, averaged over 1000 rotations including compactions"
+    rotations = 1000
+    base_settings = {"wifi_ssid":"plants", "wifi_password":"hunter22", "timezone":2, "tz_expiry":1698537600}
+    for label in ("text settings", "binary settings", "journal"):
+        with Simulator() as sim:
+            import device, journal
+            from simulator import legacy
+            files = legacy.Files() if label == "text settings" else device.Files()
+            files.write_settings(base_settings)
+            log = journal.Position_Journal()
+            sim.flash.reset_counters()
+            for i in range(rotations):
+                next_rotation, position = 1681149214 + i * 2419200, i % 7
+                if label == "text settings": # The original Motor.is_time_to_rotate and Step_Motor.save_position
+                    files.write_settings({"next_rotation":next_rotation})
+                    files.write_settings({"position":position})
+                elif label == "binary settings":
+                    files.write_settings({"next_rotation":next_rotation, "position":position})
+                else:
+                    log.save(next_rotation=next_rotation)
+                    log.save(position=position)
+            counters = sim.flash.counters()
+        print(f"{label:>15}: {counters['bytes_written'] / rotations:.1f} bytes, {counters['opens_for_write'] / rotations:.2f} file writes, "
+              f"{counters['renames'] / rotations:.3f} renames, {counters['bytes_read'] / rotations:.1f} bytes read per rotation")
+
+
+def bench_led_scaling() -> None:
+    "Host CPU time per LED_Strip color scaling and per rainbow trail frame, float math against the lookup table"
+    calls = 50000
+    with Simulator() as sim:
+        import device
+        from simulator import legacy
+        led = device.LED_Strip(25)
+        color = (255, 5, 0)
+        for label in ("before", "after"):
+            if label == "before":
+                scale = lambda i: legacy.led_on_single(led, i % 47, color, False)
+                frame = lambda i: rainbow_frame(led, lambda p, c, w: legacy.led_on_single(led, p, c, w), led.hue_to_rgb, i)
+            else:
+                scale = lambda i: led.led_on_single(i % 47, color, False)
+                frame = lambda i: rainbow_frame(led, led.led_on_single, led.hue_to_rgb, i)
+            print(f"{label:>6}: led_on_single {per_call_us(scale, calls):.2f} us, rainbow frame {per_call_us(frame, calls):.2f} us")
+
+
+def bench_hue() -> None:
+    "Host CPU time per rainbow color, the six-branch float calculation against the hue table"
+    calls = 100000
+    with Simulator() as sim:
+        import device
+        from simulator import legacy
+        led = device.LED_Strip(25)
+        mismatches = [angle for angle in range(361) if led.hue_to_rgb(angle) != legacy.hue_to_rgb(led, angle)]
+        print(f"hue_to_rgb matches the original for {361 - len(mismatches)} of 361 angles")
+        scaled = lambda i: legacy.led_on_single(led, 0, legacy.hue_to_rgb(led, i % 360), False)
+        print(f"before: hue_to_rgb {per_call_us(lambda i: legacy.hue_to_rgb(led, i % 360), calls):.2f} us, "
+              f"scaled into the strip {per_call_us(scaled, calls):.2f} us")
+        buffer = led.rgb
+        def scaled(i:int) -> None:
+            led.hue_into(i, buffer)
+            led.led_strip[0] = buffer
+        print(f" after: hue_to_rgb {per_call_us(lambda i: led.hue_to_rgb(i % 360), calls):.2f} us, "
+              f"scaled into the strip {per_call_us(scaled, calls):.2f} us")
+
+
+def bench_framebuffer() -> None:
+    "LED strip writes per iteration of the original main loop, writing every frame against skipping unchanged frames"
+    for label in ("before", "after"):
+        with Simulator() as sim:
+            if label == "before":
+                import device
+                from simulator import legacy
+                device.LED_Strip.led_on = legacy.led_on
+                device.LED_Strip.led_on_single = legacy.led_on_single
+                device.LED_Strip.led_off = legacy.led_off
+            report = sim.run_main(seconds=DAY, script=LEGACY_MAIN)
+        print(f"{label:>6}: {report.strip_writes / report.iterations:.3f} strip writes per iteration "
+              f"({report.strip_writes} in {report.iterations} iterations), CPU {report.cpu_stats()[1]:.1f} us per iteration")
+
+
+def bench_animation() -> None:
+    """
+    Virtual time the control loop is blocked when the soil is too dry and when the motor rotates, sleeping inside the LED code against
+    ticking the animation engine
+    """
+    for label in ("before", "after"):
+        with Simulator() as sim:
+            import moisture, rotation
+            with redirect_stdout(Null_Output()):
+                sensor = moisture.Moisture()
+                motor = rotation.Step_Motor()
+            if label == "before": # What Moisture.flash and Motor.pseudo_rotate used to call
+                def flash(): sensor.led.led_off(); sim.clock.sleep_ms(20); sensor.led.led_flash_double()
+                def rotate(): sensor.led.led_rainbow_trail(interval=100, trail_length=5, seconds=10, colors=sensor.led.red)
+            else:
+                flash, rotate = sensor.flash, motor.pseudo_rotate
+            blocked = []
+            for call in (flash, rotate):
+                start = sim.clock.now_us
+                call()
+                blocked.append((sim.clock.now_us - start) / 1000)
+                sensor.led.animations.wait()
+        print(f"{label:>6}: flash blocks {blocked[0]:.1f} ms, pseudo_rotate blocks {blocked[1]:.1f} ms")
+
+
+def bench_frame_cache() -> None:
+    "Host CPU time per rotation trail frame drawn live against replayed from the frame cache, and the cache's hit rate and size"
+    with Simulator():
+        import device, animation
+        with redirect_stdout(Null_Output()):
+            led = device.LED_Strip()
+        engine = led.animations
+
+        def play(effect) -> list:
+            # All frames of one play, ticked on a clock of its own
+            frames = []
+            now = 0
+            engine.play(effect, now)
+            start = perf_counter()
+            while engine.is_running(effect):
+                engine.tick(now)
+                frames.append(bytes(led.framebuffer.buf))
+                now += effect.interval
+            return frames, (perf_counter() - start) / len(frames) * 1000000
+
+        trail = dict(interval=100, trail_length=5, seconds=10, colors=led.red)
+        led.led_off()
+        live, live_us = play(animation.Rainbow_Trail(**trail))
+        print(f"cache buffer allocated after a live play: {engine.cache.buffer != None}")
+        first, first_us = play(animation.Rainbow_Trail(**trail, cache=True))
+        hit_rate = engine.cache.hit_rate()
+        engine.cache.hits = engine.cache.misses = 0
+        cached, cached_us = play(animation.Rainbow_Trail(**trail, cache=True))
+        print(f"  live: {live_us:.2f} us per frame")
+        print(f" first: {first_us:.2f} us per frame, hit rate {hit_rate:.2f}, frames match live: {first == live}")
+        print(f" again: {cached_us:.2f} us per frame, hit rate {engine.cache.hit_rate():.2f}, frames match live: {cached == live}")
+        print(f"cache: {engine.cache.bytes_used()} of {engine.cache.BUDGET} bytes used")
+        rainbow = animation.Rainbow_Trail(seconds=1, cache=True)
+        play(rainbow)
+        print(f"rainbow trail needs {(rainbow.trail_length + animation.lcm(led.LED_PIXELS, 508)) * led.LED_PIXELS * 3} bytes, "
+              f"drawn live: {engine.cache.key != rainbow.key}")
+
+
+def bench_scheduler() -> None:
+    "Wake-ups and host CPU time per simulated day, the fixed-interval loop against the task scheduler"
+    for label in ("before", "after"):
+        with Simulator() as sim:
+            wakeups = [0]
+            sim.clock.sleep_hooks.append(lambda us: wakeups.__setitem__(0, wakeups[0] + 1))
+            report = sim.run_main(seconds=DAY, script=LEGACY_MAIN if label == "before" else None)
+        print(f"{label:>6}: {wakeups[0]} wake-ups, CPU {sum(report.iteration_cpu_us) / 1000:.1f} ms, "
+              f"{report.flash['opens']} flash opens, {report.strip_writes} strip writes")
+        if report.jitter:
+            print("        jitter (ms): " + ", ".join(f"{name} mean {jitter.mean():.2f} worst {jitter.worst}"
+                                                      for name, jitter in report.jitter.items()))
+
+
+def bench_stepper() -> None:
+    "Host CPU time per motor step (8 phases) without the sleeps, four Pin.value() calls from a nested list against one mask per phase"
+    steps = 1500 # rotate_return
+    for label in ("before", "pin masks", "port masks"):
+        with Simulator() as sim:
+            import rotation, stepper
+            from simulator import legacy
+            with redirect_stdout(Null_Output()):
+                motor = rotation.Step_Motor()
+            if label == "before":
+                from machine import Pin
+                motor.stepper_in1, motor.stepper_in2, motor.stepper_in3, motor.stepper_in4 = [Pin(pin, Pin.OUT) for pin in (21, 20, 19, 18)]
+                rotate = lambda: legacy.stepper_rotate(motor, steps, 3, -1)
+            else:
+                motor.coils = stepper.Pin_Coils() if label == "pin masks" else stepper.Port_Coils()
+                rotate = lambda: motor.stepper_rotate(steps, 24, -1)
+            # The coils as they are during every sleep, once with the virtual clock running
+            phases = []
+            sim.clock.sleep_hooks.append(lambda us: phases.append(tuple(sim.board.levels.get(pin, 0) for pin in sim.board.COIL_PINS)))
+            with redirect_stdout(Null_Output()):
+                rotate()
+            sim.clock.sleep_hooks.clear()
+            if label == "before": reference = phases
+            legacy.sleep = lambda seconds: None
+            stepper.sleep_us = lambda us: None
+            sim.board.pin_writes.clear()
+            sim.board.port_writes = 0
+            with redirect_stdout(Null_Output()):
+                start = perf_counter()
+                rotate()
+                elapsed = perf_counter() - start
+                # Again without the simulated pins behind the calls, what is left is the Python side of the loop
+                sim.board.write_pin = lambda pin, level: None
+                start = perf_counter()
+                rotate()
+                python_only = perf_counter() - start
+            pin_writes = sum(sim.board.pin_writes.values())
+        print(f"{label:>10}: {elapsed / steps * 1000000:.1f} us per step, "
+              f"{python_only / steps * 1000000:.1f} us without the simulated pins, "
+              f"{pin_writes / steps:.1f} pin writes and {sim.board.port_writes / steps / 2:.1f} register writes per step, "
+              f"same phases: {phases == reference}")
+
+
+def bench_step_timing() -> None:
+    "Virtual duration of stepper moves against the requested time, with I/O taking 10 us per Pin.value() and 5 us per register write"
+    for label in ("before", "after"):
+        for steps, seconds, direction in ((250, 4, 1), (1500, 24, -1)):
+            with Simulator() as sim:
+                import rotation
+                from simulator import legacy
+                with redirect_stdout(Null_Output()):
+                    motor = rotation.Step_Motor()
+                sim.board.pin_write_us = 10
+                sim.board.register_write_us = 5
+                start = sim.clock.now_us
+                with redirect_stdout(Null_Output()):
+                    if label == "before":
+                        from machine import Pin
+                        pins = [Pin(pin, Pin.OUT) for pin in (21, 20, 19, 18)]
+                        motor.stepper_in1, motor.stepper_in2, motor.stepper_in3, motor.stepper_in4 = pins
+                        legacy.stepper_rotate(motor, steps, seconds / 8, direction) # The duration it was called with for the same speed
+                    else:
+                        motor.stepper_rotate(steps, seconds, direction)
+                elapsed = (sim.clock.now_us - start) / 1000000
+            requested = seconds / 8 if label == "before" else seconds
+            print(f"{label:>6}: {steps} steps requested in {requested:g} s took {elapsed:.3f} s ({elapsed / requested:.2f}x)")
+            if label == "after": print(f"        {motor.last_move}")
+
+
+def profile_delays(profile) -> list:
+    # Every phase time of a stepper.Profile, in the order Coils.move uses them
+    delays = [profile.ramp[i] for i in range(profile.ramp_phases)]
+    carry = 0
+    for i in range(profile.cruise_phases):
+        carry += profile.cruise_remainder
+        extra = carry >= profile.cruise_phases
+        if extra: carry -= profile.cruise_phases
+        delays.append(profile.cruise_us + extra)
+    return delays + delays[profile.ramp_phases - 1::-1][:profile.ramp_phases] if profile.ramp_phases else delays
+
+
+def bench_motion() -> None:
+    "Trapezoidal motion planner: exact phase counts and limits for every move length, and move times against the constant 2 ms per phase"
+    with Simulator() as sim:
+        import rotation, stepper
+        planner = rotation.Motion_Planner()
+        wrong = 0
+        worst_speed = 0
+        worst_acceleration = 0
+        for phases in list(range(0, 4097)) + [12000, 16384]:
+            profile = planner.plan(phases)
+            delays = profile_delays(profile)
+            if profile.phases != phases or len(delays) != phases or sum(delays) != profile.duration_us: wrong += 1
+            for i in range(len(delays)):
+                worst_speed = max(worst_speed, 1000000 / delays[i])
+                if i >= 8: # Over a whole sequence, single phases are off by the rounding to whole microseconds
+                    change = abs(1000000 / delays[i] - 1000000 / delays[i - 8])
+                    worst_acceleration = max(worst_acceleration, change / (sum(delays[i - 8:i]) / 1000000))
+        print(f"planner: {wrong} wrong phase counts or durations for 0-4096, 12000 and 16384 phases, fastest {worst_speed:.0f} phases/s "
+              f"of {planner.max_speed}, hardest acceleration {worst_acceleration:.0f} phases/s² of {planner.acceleration}")
+        assert wrong == 0, f"planner: {wrong} moves don't add up to the phases asked for"
+        with redirect_stdout(Null_Output()):
+            motor = rotation.Step_Motor()
+        for name, steps, direction in (("rotate", 250, 1), ("rotate_return", 1500, -1)):
+            times = []
+            exact = True
+            for move in (lambda: motor.stepper_rotate(steps, steps * 8 * 0.002, direction), lambda: motor.stepper_move(steps, direction)):
+                writes = motor.coils.writes
+                start = sim.clock.now_us
+                with redirect_stdout(Null_Output()):
+                    move()
+                times.append((sim.clock.now_us - start) / 1000000)
+                exact = exact and motor.coils.writes - writes == steps * 8 + 1 # Every phase and the coils off
+            print(f"{name:>13}: {steps * 8} phases in {times[0]:.2f} s constant, {times[1]:.2f} s with the profile, "
+                  f"every phase written: {exact}")
+            assert exact, f"{name}: the coils didn't get exactly {steps * 8} phases"
+
+
+def bench_rotation_modes() -> None:
+    "Phases and motor-on time per full cycle of 7 positions, sweeping out and back against turning forward and wrapping around"
+    for label, continuous in (("sweep", False), ("continuous", True)):
+        with Simulator() as sim:
+            import rotation
+            with redirect_stdout(Null_Output()):
+                motor = rotation.Step_Motor(continuous=continuous)
+                writes = motor.coils.writes
+                for i in range(motor.POSITIONS):
+                    motor.rotate()
+            phases, planned_ms = motor.cycle_cost()
+            moves = sim.board.motor_moves
+            written = motor.coils.writes - writes - moves # The coils off after every move isn't a phase
+            print(f"{label:>10}: {written} phases in {moves} moves, motor on {sim.board.motor_on_us / 1000000:.2f} s "
+                  f"(cycle_cost: {phases} phases, {planned_ms / 1000:.2f} s), back at position {motor.position}, phase {motor.phase}")
+            assert motor.position == 0 and written == phases, f"{label}: a full cycle didn't end where it started"
+            if continuous: assert motor.phase == 0, f"{label}: a full cycle ended at phase {motor.phase}"
+    with Simulator() as sim:
+        import rotation
+        with redirect_stdout(Null_Output()):
+            motor = rotation.Step_Motor(continuous=True)
+            for target in (1000, 3900, 100, 0):
+                start = motor.coils.writes
+                motor.move_to(target)
+                print(f"shortest path to {target:>4}: {motor.coils.writes - start - 1:>4} phases, now at phase {motor.phase}",
+                      file=sys.__stdout__)
+            start = motor.coils.writes
+            motor.move_to(motor.phase)
+            motor.move_by(0)
+            assert motor.coils.writes == start, "a move of no phases turned the coils"
+
+
+def bench_background_move() -> None:
+    """
+    Virtual time the control loop is blocked per rotation and the scheduler's jitter over three weeks of turning every two weeks, blocking
+    moves against timer-driven moves
+    """
+    for label in ("blocking", "timer"):
+        with Simulator() as sim:
+            import rotation
+            with redirect_stdout(Null_Output()):
+                motor = rotation.Step_Motor()
+                blocked = 0
+                writes = motor.coils.writes
+                for i in range(motor.POSITIONS):
+                    start = sim.clock.now_us
+                    if label == "blocking":
+                        motor.rotate()
+                        blocked += sim.clock.now_us - start
+                    else:
+                        move = motor.rotate_async()
+                        blocked += sim.clock.now_us - start
+                        move.join(poll_ms=10)
+            written = motor.coils.writes - writes - sim.board.motor_moves
+            coils_on = any(sim.board.levels.get(pin, 0) for pin in sim.board.COIL_PINS)
+            print(f"{label:>9}: {written} phases in {sim.board.motor_moves} moves, "
+                  f"control loop blocked {blocked / 7000:.1f} ms per rotation, motor on {sim.board.motor_on_us / 1000000:.2f} s, "
+                  f"coils {'on' if coils_on else 'off'} after the cycle, back at position {motor.position}")
+            print(f"{'':>9}  last move: {motor.last_move}")
+    # The whole program, with rotate_async() swapped for the blocking rotate()
+    for label in ("blocking", "timer"):
+        with Simulator() as sim:
+            sim.board.set_pin(27, 1) # Turn every 2 weeks
+            if label == "blocking":
+                import rotation, stepper
+                def rotate_async(motor): # rotate(), and a move that is already done for main.py to poll
+                    motor.rotate()
+                    return stepper.Background_Move(motor.coils, stepper.FORWARD, stepper.constant(0, 0)).start()
+                rotation.Step_Motor.rotate_async = rotate_async
+            report = sim.run_main(weeks=3)
+        print(f"{label:>9}: {sim.board.motor_moves} moves, jitter (ms): " + jitter_summary(report.jitter))
+
+
+def bench_network_task() -> None:
+    """
+    Scheduler jitter over 3 hours with no NTP server answering, the network task connecting and fetching the time with blocking waits
+    against awaiting between polls
+    """
+    for label in ("blocking", "awaiting"):
+        with Simulator() as sim:
+            sim.board.ntp_online = False
+            if label == "blocking":
+                import device
+                async def sync_async(time): # The blocking sync(), from inside the task
+                    time.sync()
+                device.Time.sync_async = sync_async
+            report = sim.run_main(seconds=3 * 3600)
+        print(f"{label:>9}: {sim.board.ntp_queries} NTP queries, jitter (ms): " + jitter_summary(report.jitter))
+        if label == "awaiting":
+            assert max(jitter.worst for jitter in report.jitter.values()) <= 100, "the network task held up the other tasks"
+
+
+def noisy_adc(mean:int, noise:int, glitches:float, seed:int = 1):
+    # ADC value for board.adc: gaussian noise, and now and then a sample stuck at either end of the range
+    rng = random.Random(seed)
+    def value(t:float) -> int:
+        if rng.random() < glitches:
+            return rng.choice((0, 65535))
+        return rng.gauss(mean, noise)
+    return value
+
+
+def bench_moisture_filter() -> None:
+    """
+    too_dry() decisions with the soil 1.5 % above the threshold and a noisy ADC, one sample against filtered bursts, and the host CPU time
+    per reading
+    """
+    decisions = 2000
+    for label, samples, trim, window in (("before", 1, 0, 1), ("median", 16, 0, 1), ("median", 16, 0, 6), ("trimmed", 16, 4, 6)):
+        with Simulator() as sim:
+            import moisture, sampling
+            from simulator import legacy
+            sensor = moisture.Moisture()
+            threshold = sensor.get_threshold()
+            raw = sensor.ADC_MAX_VALUE - (threshold + 1.5) / 100 * sensor.MIN_VALUE_ADJUSTED
+            sim.board.adc[sim.board.MOISTURE_PIN] = noisy_adc(raw, 1500, 0.02)
+            if label == "before":
+                too_dry = lambda: legacy.moisture_percent(sensor) < threshold
+                reading = lambda i: legacy.read_moisture(sensor)
+            else:
+                sensor.sampler = sampling.Burst_Reader(sensor.sensor_data, samples, trim)
+                sensor.readings = sampling.Rolling_Window(window)
+                too_dry = sensor.too_dry
+                reading = lambda i: sensor.read_moisture()
+            results = [too_dry() for i in range(decisions)]
+            flips = sum(1 for i in range(1, decisions) if results[i] != results[i - 1])
+            moisture.sleep_ms = legacy.sleep_ms = lambda ms: None # Only the filtering, not the 25 ms settling time
+            cpu = per_call_us(reading, decisions)
+        print(f"{label:>7}: {sum(results)} of {decisions} decisions too dry, {flips} flips, "
+              f"{cpu:.1f} us per reading ({samples} samples, window of {window})")
+
+
+def bench_calibration() -> None:
+    "ADC reading to moisture percent for every raw value, the float formula against the calibration table, and host CPU time per conversion"
+    with Simulator() as sim:
+        import moisture, calibration
+        from simulator import legacy
+        sensor = moisture.Moisture()
+        table = sensor.calibration
+        differences = {}
+        for raw in range(65536):
+            difference = table.percent(raw) - max(0, min(100, legacy.moisture_percent(sensor, raw)))
+            differences[difference] = differences.get(difference, 0) + 1
+        before = per_call_us(lambda i: legacy.moisture_percent(sensor, i), 65536)
+        after = per_call_us(table.percent, 65536)
+        start = perf_counter()
+        calibration.Calibration(((20000, 100), (31000, 60), (45000, 25), (60000, 0)))
+        build_ms = (perf_counter() - start) * 1000
+    print(f"before: {before:.3f} us per conversion")
+    print(f" after: {after:.3f} us per conversion, table of {len(table.table)} bytes, built in {build_ms:.1f} ms for 4 points")
+    print(f"        percent against the formula (clamped to 0-100): "
+          + ", ".join(f"{difference:+d}: {count}" for difference, count in sorted(differences.items())))
+
+
+def bench_adaptive_sampling() -> None:
+    """
+    Moisture readings in a week of well watered soil (74 %), and too-dry decisions while the soil dries through the threshold over two days,
+    fixed 10 s readings against adaptive readings with hysteresis
+    """
+    for label in ("before", "after"):
+        with Simulator() as sim:
+            import moisture
+            if label == "before":
+                moisture.Moisture.sample_interval = lambda self, percent, threshold: self.SAMPLE_MIN
+            wakeups = [0]
+            sim.clock.sleep_hooks.append(lambda us: wakeups.__setitem__(0, wakeups[0] + 1))
+            report = sim.run_main(weeks=1)
+        print(f"{label:>6}: well watered week: {report.jitter['moisture'].count} readings, {sim.board.adc_reads} ADC samples, "
+              f"{wakeups[0]} wake-ups, CPU {sum(report.iteration_cpu_us) / 1000:.0f} ms")
+    for label in ("before", "after"):
+        with Simulator() as sim:
+            import moisture
+            sensor = moisture.Moisture()
+            if label == "before":
+                sensor.HYSTERESIS = 0
+                sensor.sample_interval = lambda percent, threshold: sensor.SAMPLE_MIN
+            threshold = sensor.get_threshold()
+            wet = sensor.ADC_MAX_VALUE - (threshold + 10) / 100 * sensor.MIN_VALUE_ADJUSTED
+            dry = sensor.ADC_MAX_VALUE - (threshold - 10) / 100 * sensor.MIN_VALUE_ADJUSTED
+            start = sim.clock.now_us / 1000000
+            noise = noisy_adc(0, 1500, 0)
+            sim.board.adc[sim.board.MOISTURE_PIN] = lambda t: wet + (dry - wet) * (t - start) / (2 * DAY) + noise(t)
+            readings = 0
+            turned_dry = 0
+            was_dry = False
+            while sim.clock.now_us / 1000000 - start < 2 * DAY:
+                is_dry = sensor.too_dry()
+                readings += 1
+                if is_dry and not was_dry: turned_dry += 1
+                was_dry = is_dry
+                sim.clock.sleep_ms(sensor.next_sample_ms)
+        print(f"{label:>6}: drying through the threshold: {readings} readings, turned too dry {turned_dry} times")
+
+
+def bench_switches() -> None:
+    """
+    Host CPU time per DIP switch check, reading the pins against the IRQ snapshot, what a bouncing switch does to the snapshot, and how long
+    main.py takes to follow a new turn rate
+    """
+    calls = 100000
+    with Simulator() as sim:
+        import device
+        from simulator import legacy
+        io = device.Microcontroller()
+        before = per_call_us(lambda i: (legacy.check_setting_wetness(io), legacy.check_setting_turn_rate(io)), calls)
+        after = per_call_us(lambda i: (io.check_setting_wetness(), io.check_setting_turn_rate()), calls)
+        print(f"before: {before:.2f} us per check of both settings")
+        print(f" after: {after:.2f} us per check of both settings")
+        changes = []
+        device.Microcontroller.on_change = lambda: changes.append((sim.clock.now_us, device.Microcontroller.switches))
+        flipped = sim.clock.now_us
+        for level in (1, 0, 1, 0, 1, 0, 1): # The 2 week switch bounces for 3 ms before it stays on
+            sim.board.set_pin(27, level)
+            sim.clock.sleep_us(500)
+        sim.clock.sleep_ms(100)
+        print(f"        switch bouncing 7 times: {len(changes)} change(s), "
+              f"to {changes[-1][1]} after {(changes[-1][0] - flipped) / 1000:.1f} ms")
+    for label in ("before", "after"):
+        with Simulator() as sim:
+            import scheduler
+            if label == "before": # Nothing wakes the tasks, the rotation task sees the switch the next time it checks the time
+                scheduler.Scheduler.wake_from_irq = lambda self, name: None
+            flipped = DAY + 1234
+            sim.clock.add_alarm(flipped * 1000000, lambda: sim.board.set_pin(27, 1))
+            moved = []
+            import journal
+            save = journal.Position_Journal.save
+            def saved(self, **fields):
+                if sim.clock.now_us > flipped * 1000000 and "next_rotation" in fields and not moved: moved.append(sim.clock.now_us)
+                save(self, **fields)
+            journal.Position_Journal.save = saved
+            report = sim.run_main(weeks=1)
+        later = (moved[0] / 1000000 - flipped) if moved else float('nan')
+        print(f"{label:>6}: turn rate 4 -> 2 weeks on day 1, next rotation moved {later:.2f} s later")
+
+
+def bench_dst() -> None:
+    """
+    Timezone for every day of 2000-2029 at 12:00 UTC, the original year-long loop against the transition table, both checked against the tz
+    database (Europe/Copenhagen), and host CPU time per lookup
+    """
+    from datetime import datetime, timezone
+    from zoneinfo import ZoneInfo
+    copenhagen = ZoneInfo("Europe/Copenhagen")
+    def utc_offset(t:int) -> int: # Seconds
+        return int(datetime.fromtimestamp(t, timezone.utc).astimezone(copenhagen).utcoffset().total_seconds())
+    with Simulator() as sim:
+        import device
+        from simulator import legacy
+        time = device.Time()
+        ntp = type("NTP", (), {})() # Answers the original get_timezone's NTP query with the day being tested
+        days = range(10957, 10957 + 10958) # 2000-01-01 to 2029-12-31
+        wrong = {"before": 0, "after": 0}
+        changes = {"before": 0, "after": 0}
+        cpu = {"before": 0.0, "after": 0.0}
+        same = 0
+        with redirect_stdout(Null_Output()):
+            for day in days:
+                t = day * DAY + 12 * 3600
+                truth = utc_offset(t)
+                ntp.ntp_fetch_unix_time = lambda: t
+                start = perf_counter()
+                before = legacy.get_timezone(ntp)
+                before = (before[0] * 3600, before[1]) # The original answers in hours
+                middle = perf_counter()
+                after = time.get_timezone(t)
+                cpu["before"] += middle - start
+                cpu["after"] += perf_counter() - middle
+                for label, (offset, change) in (("before", before), ("after", after)):
+                    if offset != truth: wrong[label] += 1
+                    # The next change has to be the second the offset actually changes
+                    if not (utc_offset(change - 1) == offset and utc_offset(change) != offset): changes[label] += 1
+                if before[0] == after[0]: same += 1
+    for label in ("before", "after"):
+        print(f"{label:>6}: wrong timezone on {wrong[label]} of {len(days)} days, "
+              f"next change not an actual change on {changes[label]} days, "
+              f"{cpu[label] / len(days) * 1000000:.1f} us per lookup")
+    print(f"        same timezone as the original on {same} days")
+    assert wrong["after"] == 0 and changes["after"] == 0, "the transition table disagrees with the tz database"
+
+
+def bench_posix_tz() -> None:
+    """
+    POSIX TZ rules compiled into transition tables, checked against the tz database every 6 hours of 2020-2029, host CPU time per lookup
+    with a linear walk and with the binary search, and what a second boot reads instead of compiling
+    """
+    from datetime import datetime, timezone
+    from zoneinfo import ZoneInfo
+    rules = (("Europe/Copenhagen", "CET-1CEST,M3.5.0,M10.5.0/3"), ("America/New_York", "EST5EDT,M3.2.0,M11.1.0"),
+             ("Australia/Sydney", "AEST-10AEDT,M10.1.0,M4.1.0/3"), ("America/St_Johns", "NST3:30NDT,M3.2.0,M11.1.0"),
+             ("Asia/Kolkata", "IST-5:30"), ("America/Sao_Paulo", "<-03>3"), ("Pacific/Auckland", "NZST-12NZDT,M9.5.0,M4.1.0/3"))
+    times = range(1577836800, 1893456000, 6 * 3600) # 2020-01-01 to 2029-12-31
+    with Simulator() as sim:
+        import timezone as tz
+        for zone, rule in rules:
+            info = ZoneInfo(zone)
+            table = tz.Transition_Table(rule, file_name=f"{zone.replace('/', '_')}.bin")
+            table.update(times[0])
+            wrong = 0
+            for t in times:
+                table.update(t)
+                if table.lookup(t)[0] != int(datetime.fromtimestamp(t, timezone.utc).astimezone(info).utcoffset().total_seconds()):
+                    wrong += 1
+            print(f"{rule:>30}: {len(table.times)} transitions, wrong offset at {wrong} of {len(times)} times ({zone})")
+        table = tz.Transition_Table(rules[0][1], years=30)
+        table.update(times[0])
+        def linear(t:int) -> tuple: # The walk from the last index that lookup() did before
+            times = table.times
+            i = table.index
+            while i > 0 and t < times[i]:
+                i -= 1
+            while t >= times[i + 1]:
+                i += 1
+            table.index = i
+            return (table.offsets[i], times[i + 1])
+        jumps = [times[(i * 7919) % len(times)] for i in range(len(times))] # Every lookup somewhere else in the table
+        for label, lookup in (("before", linear), ("after", table.lookup)):
+            in_order = per_call_us(lambda i: lookup(times[i]), len(times))
+            scattered = per_call_us(lambda i: lookup(jumps[i]), len(jumps))
+            ends = per_call_us(lambda i: lookup(table.times[-2 * (i & 1)]), len(times)) # First and last transition by turns
+            print(f"{label:>6}: {in_order:.2f} us per lookup in time order, {scattered:.2f} us anywhere in 30 years, "
+                  f"{ends:.2f} us from one end to the other")
+        sim.flash.reset_counters()
+        booted = tz.Transition_Table(rules[0][1], years=30)
+        built = []
+        booted.build = lambda first_year: built.append(first_year)
+        booted.update(times[0])
+        counters = sim.flash.counters()
+        print(f"        second boot: {counters['bytes_read']} bytes read, {counters['opens_for_write']} writes, "
+              f"compiled {len(built)} times")
+        other = tz.Transition_Table(rules[1][1], years=30)
+        other.update(times[0])
+        print(f"        another rule: table compiled again for {other.rule.rule}, offset now {other.lookup(times[0])[0] // 3600} h")
+
+
+def bench_ntp() -> None:
+    """
+    Fetching the time when NTP servers are slow, dead, unsynchronised or unreachable: virtual time taken, queries sent and how wrong the
+    answer is, the original stops waiting after 10 minutes
+    """
+    from simulator.board import NTP_Server, NTP_EPOCH
+    from simulator.clock import Simulation_Stop
+    fastest = ("pool.ntp.org", "0.pool.ntp.org") # The server the original asks, and the first one of the new client
+    scenarios = (
+        ("every server answers", lambda board: None),
+        ("slow network, 1.5 s", lambda board: setattr(board, "ntp_latency_ms", 1500)),
+        ("fastest server dead", lambda board: board.ntp_servers.update({host: NTP_Server(online=False) for host in fastest})),
+        ("fastest unsynchronised", lambda board: board.ntp_servers.update(
+            {host: NTP_Server(5, leap=3, stratum=16, error_s=-365 * DAY) for host in fastest})),
+        ("fastest Kiss-o'-Death", lambda board: board.ntp_servers.update(
+            {host: NTP_Server(5, stratum=0, error_s=-board.clock.utc_start - NTP_EPOCH) for host in fastest})),
+        ("Kiss-o'-Death, the rest dead", lambda board: (board.ntp_servers.update(
+            {host: NTP_Server(5, stratum=0, error_s=-board.clock.utc_start - NTP_EPOCH) for host in fastest}),
+            setattr(board, "ntp_online", False))),
+        ("no server answers", lambda board: setattr(board, "ntp_online", False)),
+        ("DNS down", lambda board: setattr(board, "dns_online", False)),
+    )
+    for name, setup in scenarios:
+        print(f"  {name}")
+        for label in ("before", "after"):
+            with Simulator() as sim:
+                import device
+                from simulator import legacy
+                time = device.Time()
+                setup(sim.board)
+                sim.clock.run_for(600)
+                start = sim.clock.now_us
+                with redirect_stdout(Null_Output()):
+                    try:
+                        if label == "before": result = legacy.ntp_fetch_unix_time(time)
+                        else: result = time.ntp_fetch_unix_time()
+                        outcome = f"{result - sim.clock.utc_start - sim.clock.now_us / 1000000:+.2f} s off"
+                    except Simulation_Stop:
+                        outcome = "still waiting"
+                    except Exception as e:
+                        outcome = f"{type(e).__name__}"
+                taken = (sim.clock.now_us - start) / 1000000
+            refused = [server.queries for host, server in sim.board.ntp_servers.items() if server.stratum == 0 or server.leap == 3]
+            print(f"{label:>10}: {outcome} after {taken:.2f} s, {sim.board.ntp_queries} queries"
+                  + (f", {max(refused)} to the server that refused" if refused else ""))
+            if label == "after" and refused: assert max(refused) == 1, f"{name}: a server that refused was asked again"
+
+
+def bench_time_sync() -> None:
+    """
+    A year of keeping the clock from 2023-04-10 with an RTC that runs fast or slow: NTP queries, and how far the RTC is from the actual
+    Danish time at worst and at the end, checked every NETWORK_INTERVAL
+    """
+    from datetime import datetime, timezone
+    from zoneinfo import ZoneInfo
+    copenhagen = ZoneInfo("Europe/Copenhagen")
+    interval = 15 * 60
+    steps = 52 * 7 * DAY // interval
+    for drift_ppm in (0, 30, -15):
+        print(f"  RTC {drift_ppm:+d} ppm")
+        for label in ("before", "after"):
+            with Simulator() as sim:
+                import device
+                from simulator import legacy
+                sim.clock.rtc_drift_ppm = drift_ppm
+                time = device.Time()
+                worst = 0
+                with redirect_stdout(Null_Output()):
+                    if label == "before": legacy.sync_clock(time)
+                    else: time.sync()
+                    for step in range(steps):
+                        sim.clock.sleep(interval)
+                        if label == "before":
+                            legacy.maintain_clock(time)
+                        else:
+                            time.correct_rtc()
+                            if time.needs_sync(): time.sync()
+                        utc = sim.clock.utc_start + sim.clock.now_us / 1000000
+                        local = utc + datetime.fromtimestamp(utc, timezone.utc).astimezone(copenhagen).utcoffset().total_seconds()
+                        error = time.local_now() - local # What the firmware goes by, mktime(localtime()) before
+                        if abs(error) > abs(worst): worst = error
+                drift = time.files.get_setting("rtc_drift")
+            estimate = f", drift estimated at {drift / 1000:+.1f} ppm" if drift != None else ""
+            print(f"{label:>10}: {sim.board.ntp_queries} NTP queries, RTC {worst:+.1f} s off at worst, {error:+.1f} s at the end{estimate}")
+
+
+def bench_stopwatch() -> None:
+    """
+    The RTC-based Stopwatch against the ticks-based one: host CPU time per reading, virtual time of a Wi-Fi connect and of 3 tries timing
+    out, a stopwatch running while the RTC is set and one running across the ticks wraparound with laps
+    """
+    from simulator.clock import TICKS_PERIOD
+    with Simulator() as sim:
+        import device
+        from simulator import legacy
+        clock = sim.clock
+        for label in ("before", "after"):
+            stopwatch = legacy.Stopwatch() if label == "before" else device.Stopwatch()
+            read = stopwatch.get_time if label == "before" else stopwatch.elapsed
+            print(f"{label:>6}: {per_call_us(lambda i: read(), 100000):.2f} us per reading")
+        wifi = device.WiFi()
+        for network, name in ((None, "connect taking 1.5 s"), ({}, "3 tries timing out after 5 s")):
+            sim.board.wifi_networks = network
+            for label in ("before", "after"):
+                wifi.wlan.active(False)
+                start = clock.now_us
+                with redirect_stdout(Null_Output()):
+                    if label == "before":
+                        legacy.wifi_connect(wifi)
+                    else:
+                        try:
+                            wifi.connect()
+                        except Exception: # WiFiError
+                            pass
+                print(f"{label:>6}: {name}: {(clock.now_us - start) / 1000000:.2f} s")
+        sim.board.wifi_networks = None
+        for label in ("before", "after"):
+            stopwatch = legacy.Stopwatch() if label == "before" else device.Stopwatch()
+            clock.sleep(2)
+            clock.set_rtc(clock.utc()) # What sync_clock does after boot, the RTC starts at 2021-01-01
+            clock.sleep(1)
+            elapsed = stopwatch.get_time() if label == "before" else stopwatch.elapsed() / 1000
+            print(f"{label:>6}: 3 s with the RTC set in between: {elapsed:.3f} s")
+        clock.sleep_ms(TICKS_PERIOD - (clock.now_us // 1000) % TICKS_PERIOD - 400) # 400 ms before ticks_ms wraps around
+        stopwatch = device.Stopwatch()
+        for lap in (100, 200, 300, 400):
+            clock.sleep_ms(lap)
+            stopwatch.lap()
+        print(f" after: 1000 ms across the ticks wraparound: {stopwatch.elapsed()} ms, "
+              f"laps {list(stopwatch.lap_times[:stopwatch.lap_count])} ms, "
+              f"min {stopwatch.lap_min()} mean {stopwatch.lap_mean():.0f} max {stopwatch.lap_max()}")
+
+
+BENCHMARKS = {
+    "settings": bench_settings, "transaction": bench_transaction, "journal": bench_journal,
+    "led_scaling": bench_led_scaling, "hue": bench_hue, "framebuffer": bench_framebuffer, "animation": bench_animation,
+    "frame_cache": bench_frame_cache, "scheduler": bench_scheduler, "stepper": bench_stepper, "step_timing": bench_step_timing,
+    "motion": bench_motion, "rotation_modes": bench_rotation_modes, "background_move": bench_background_move,
+    "network_task": bench_network_task, "moisture_filter": bench_moisture_filter, "calibration": bench_calibration,
+    "adaptive_sampling": bench_adaptive_sampling, "switches": bench_switches, "dst": bench_dst, "posix_tz": bench_posix_tz,
+    "ntp": bench_ntp, "time_sync": bench_time_sync, "stopwatch": bench_stopwatch,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    asked_for_help = names in (["--help"], ["-h"])
+    unknown = [name for name in names if not name in BENCHMARKS]
+    if unknown:
+        if not asked_for_help:
+            print(f"Unknown benchmark: {', '.join(unknown)}")
+        print("python -m simulator.bench [name ...], runs every benchmark without names. The benchmarks:")
+        for name, bench in BENCHMARKS.items():
+            print(f"  {name}: {' '.join(bench.__doc__.split())}")
+        sys.exit(0 if asked_for_help else 2)
+    for name in names:
+        print(f"{name}: {' '.join(BENCHMARKS[name].__doc__.split())}")
+        BENCHMARKS[name]()
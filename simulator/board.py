@@ -0,0 +1,446 @@
+import threading
+from struct import pack, unpack
+from simulator.clock import Simulation_Stop
+
+
+class Device_Reset(BaseException):
+    "Raised by machine.reset() so the simulation can see the device rebooting"
+
+
+class Board:
+    """
+    State of the simulated AutoPlant board. Every fake peripheral looks up the active board,
+    so the simulator can read and drive pins, ADC values, the LED strip and the network from the outside.
+    """
+    active = None
+
+    # Wiring, see cable-colors.png
+    SIGINT_PIN = 0
+    LED_PIN = 17
+    MOISTURE_PIN = 26
+    COIL_PINS = (21, 20, 19, 18)
+
+    def __init__(self, clock) -> None:
+        self.clock = clock
+        self.levels = {}
+        self.irqs = {}
+        self.pin_writes = {}
+        self.port_writes = 0
+        self.timer_inits = 0
+        self.pin_write_us = 0 # CPU time a Pin.value() write takes, 0 makes I/O free
+        self.register_write_us = 0 # and a machine.mem32 write
+        self.adc = {self.MOISTURE_PIN: 30000}
+        self.adc_reads = 0
+        self.strips = []
+        self.strip_writes = 0
+        self.motor_moves = 0
+        self.motor_on_us = 0 # Virtual time with at least one coil on
+        self.coils_on_since = None
+        self.wifi_networks = None # None accepts any SSID/password
+        self.wifi_connect_ms = 1500
+        self.ntp_online = True # For every NTP server not in ntp_servers
+        self.ntp_latency_ms = 25
+        self.ntp_servers = {} # Host name -> NTP_Server, to make single servers slow, dead or unsynchronised
+        self.dns_online = True
+        self.hosts = {} # Address getaddrinfo gave out -> host name
+        self.ntp_queries = 0
+        self.resets = 0
+
+    def set_pin(self, pin:int, level:int) -> None:
+        old = self.levels.get(pin, 0)
+        self.levels[pin] = level
+        handler, trigger, pin_obj = self.irqs.get(pin, (None, 0, None))
+        if handler is None or old == level: return
+        if (level and trigger & Pin.IRQ_RISING) or (not level and trigger & Pin.IRQ_FALLING):
+            handler(pin_obj)
+
+    def read_adc(self, pin:int) -> int:
+        self.adc_reads += 1
+        value = self.adc.get(pin, 0)
+        if callable(value):
+            value = value(self.clock.now_us / 1000000)
+        return max(0, min(65535, int(value)))
+
+    def write_pin(self, pin:int, level:int) -> None:
+        self.pin_writes[pin] = self.pin_writes.get(pin, 0) + 1
+        if not pin in self.COIL_PINS:
+            self.set_pin(pin, level)
+            return
+        was_on = any(self.levels.get(coil, 0) for coil in self.COIL_PINS)
+        if level and not was_on:
+            self.motor_moves += 1
+        self.set_pin(pin, level)
+        is_on = any(self.levels.get(coil, 0) for coil in self.COIL_PINS)
+        if is_on and not was_on:
+            self.coils_on_since = self.clock.now_us
+        elif was_on and not is_on:
+            self.motor_on_us += self.clock.now_us - self.coils_on_since
+
+    def frame(self) -> bytes:
+        # The strip shows whatever the last written NeoPixel object sent
+        return self.strips[-1].shown if self.strips else b""
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id:int, mode:int = -1, pull:int = -1, value:int = None) -> None:
+        self.board = Board.active # Bound at construction, threads left over from an earlier simulation can't reach a newer board
+        self.id = id
+        self.mode = mode
+        self.pull = pull
+        if value is not None: self.value(value)
+
+    def value(self, level:int = None):
+        if level is None:
+            return self.board.levels.get(self.id, 1 if self.pull == Pin.PULL_UP else 0)
+        if self.board.pin_write_us: self.board.clock.advance_us(self.board.pin_write_us)
+        self.board.write_pin(self.id, 1 if level else 0)
+
+    def on(self) -> None:
+        self.value(1)
+
+    def off(self) -> None:
+        self.value(0)
+
+    def high(self) -> None:
+        self.value(1)
+
+    def low(self) -> None:
+        self.value(0)
+
+    def toggle(self) -> None:
+        self.value(0 if self.value() else 1)
+
+    def irq(self, handler = None, trigger:int = IRQ_FALLING | IRQ_RISING) -> None:
+        self.board.irqs[self.id] = (handler, trigger, self)
+
+    def __call__(self, level:int = None):
+        return self.value(level)
+
+
+class Memory32:
+    """
+    machine.mem32, with the RP2040's SIO GPIO registers wired to the simulated pins. Other addresses are plain memory.
+    A write to GPIO_OUT, GPIO_OUT_SET, GPIO_OUT_CLR or GPIO_OUT_XOR counts as one port write.
+    """
+    SIO_BASE = 0xd0000000
+    GPIO_IN = SIO_BASE + 0x004
+    GPIO_OUT = SIO_BASE + 0x010
+    GPIO_OUT_SET = SIO_BASE + 0x014
+    GPIO_OUT_CLR = SIO_BASE + 0x018
+    GPIO_OUT_XOR = SIO_BASE + 0x01c
+
+    def __init__(self) -> None:
+        self.memory = {}
+
+    def levels(self, board:Board) -> int:
+        value = 0
+        for pin, level in board.levels.items():
+            if level: value |= 1 << pin
+        return value
+
+    def __getitem__(self, address:int) -> int:
+        if address in (self.GPIO_IN, self.GPIO_OUT):
+            return self.levels(Board.active)
+        return self.memory.get(address, 0)
+
+    def __setitem__(self, address:int, value:int) -> None:
+        board = Board.active
+        if address == self.GPIO_OUT_XOR: changed = value
+        elif address == self.GPIO_OUT_SET: changed = value & ~self.levels(board)
+        elif address == self.GPIO_OUT_CLR: changed = value & self.levels(board)
+        elif address == self.GPIO_OUT: changed = value ^ self.levels(board)
+        else:
+            self.memory[address] = value & 0xFFFFFFFF
+            return
+        board.port_writes += 1
+        if board.register_write_us: board.clock.advance_us(board.register_write_us)
+        changed &= 0x3FFFFFFF # GPIO 0-29
+        while changed:
+            pin = changed.bit_length() - 1
+            changed ^= 1 << pin
+            board.write_pin(pin, 0 if board.levels.get(pin, 0) else 1)
+
+
+class Timer:
+    """
+    machine.Timer on the virtual clock. The callback runs from the thread that moves the clock, in the middle of
+    whatever sleep passes the timer's deadline, like the soft interrupt callbacks on the Pico.
+    """
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id:int = -1, mode:int = PERIODIC, period:int = -1, freq:float = -1, callback = None, tick_hz:int = 1000) -> None:
+        self.board = Board.active
+        self.alarm = None
+        if callback is not None or period > 0 or freq > 0:
+            self.init(mode=mode, period=period, freq=freq, callback=callback, tick_hz=tick_hz)
+
+    def init(self, mode:int = PERIODIC, period:int = -1, freq:float = -1, callback = None, tick_hz:int = 1000) -> None:
+        self.deinit()
+        self.mode = mode
+        self.callback = callback
+        if freq > 0: self.period_us = max(1, int(1000000 / freq))
+        else: self.period_us = max(1, int(period * 1000000 / tick_hz))
+        self.board.timer_inits += 1
+        self.alarm = self.board.clock.add_alarm(self.board.clock.now_us + self.period_us, self.fire)
+
+    def fire(self) -> None:
+        if self.mode == Timer.PERIODIC:
+            self.alarm = self.board.clock.add_alarm(self.board.clock.now_us + self.period_us, self.fire)
+        else:
+            self.alarm = None
+        if self.callback is not None: self.callback(self)
+
+    def deinit(self) -> None:
+        if self.alarm is not None:
+            self.board.clock.cancel_alarm(self.alarm)
+            self.alarm = None
+
+
+class ADC:
+
+    def __init__(self, pin) -> None:
+        self.board = Board.active
+        self.pin = pin.id if isinstance(pin, Pin) else pin
+
+    def read_u16(self) -> int:
+        return self.board.read_adc(self.pin)
+
+
+class RTC:
+
+    def __init__(self) -> None:
+        self.board = Board.active
+
+    def datetime(self, datetime:tuple = None):
+        clock = self.board.clock
+        if datetime is None:
+            t = clock.gmtime()
+            return (t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0)
+        year, month, day, weekday, hours, minutes, seconds = datetime[:7]
+        clock.set_rtc(clock.mktime((year, month, day, hours, minutes, seconds)))
+
+
+class NeoPixel:
+    ORDER = (1, 0, 2, 3)
+
+    def __init__(self, pin:Pin, n:int, bpp:int = 3, timing:int = 1) -> None:
+        self.pin = pin
+        self.n = n
+        self.bpp = bpp
+        self.buf = bytearray(n * bpp)
+        self.shown = bytes(n * bpp)
+        self.writes = 0
+        self.board = Board.active
+        self.board.strips.append(self)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __setitem__(self, index:int, value:tuple) -> None:
+        offset = index * self.bpp
+        for i in range(self.bpp):
+            self.buf[offset + self.ORDER[i]] = value[i]
+
+    def __getitem__(self, index:int) -> tuple:
+        offset = index * self.bpp
+        return tuple(self.buf[offset + self.ORDER[i]] for i in range(self.bpp))
+
+    def fill(self, value:tuple) -> None:
+        for i in range(self.n):
+            self[i] = value
+
+    def write(self) -> None:
+        board = self.board
+        self.shown = bytes(self.buf)
+        self.writes += 1
+        board.strip_writes += 1
+        if board.strips[-1] is not self:
+            board.strips.remove(self)
+            board.strips.append(self)
+        board.clock.advance_us(self.n * self.bpp * 10 + 50) # 800 kHz, 10 us per byte plus latch
+
+
+class WLAN:
+
+    def __init__(self, interface:int = 0) -> None:
+        self.board = Board.active
+        self.interface = interface
+        self.is_active = False
+        self.connected_at = None
+
+    def active(self, is_active:bool = None):
+        if is_active is None: return self.is_active
+        self.is_active = bool(is_active)
+        if not self.is_active: self.connected_at = None
+
+    def connect(self, ssid:str = None, key:str = None) -> None:
+        board = self.board
+        networks = board.wifi_networks
+        if networks is None or networks.get(ssid) == key:
+            self.connected_at = board.clock.now_us + board.wifi_connect_ms * 1000
+        else:
+            self.connected_at = None
+
+    def disconnect(self) -> None:
+        self.connected_at = None
+
+    def isconnected(self) -> bool:
+        return self.is_active and self.connected_at is not None and self.board.clock.now_us >= self.connected_at
+
+    def status(self, param:str = None) -> int:
+        return 3 if self.isconnected() else 0
+
+    def ifconfig(self, config:tuple = None) -> tuple:
+        return ("192.168.1.42", "255.255.255.0", "192.168.1.1", "192.168.1.1")
+
+    def scan(self) -> list:
+        return [(ssid.encode(), b"\x00" * 6, 1, -50, 3, False) for ssid in (self.board.wifi_networks or {})]
+
+
+# Network stand-ins, a UDP network on the virtual clock where every host is an NTP server answering from the real UTC time
+
+AF_INET = 2
+SOCK_DGRAM = 2
+NTP_EPOCH = 2208988800
+POLLIN = 1
+POLLOUT = 4
+
+
+class NTP_Server:
+    # How one simulated NTP server answers. stratum 0 answers with a Kiss-o'-Death, leap 3 says it isn't synchronised, error_s is how wrong its time is
+
+    def __init__(self, latency_ms:int = 25, online:bool = True, stratum:int = 2, leap:int = 0, error_s:int = 0) -> None:
+        self.latency_ms = latency_ms
+        self.online = online
+        self.stratum = stratum
+        self.leap = leap
+        self.error_s = error_s
+        self.queries = 0
+
+
+def getaddrinfo(host:str, port:int, *args) -> list:
+    board = Board.active
+    if not board.dns_online:
+        raise OSError(-2) # What MicroPython raises when the name can't be resolved
+    for address, name in board.hosts.items():
+        if name == host: break
+    else:
+        address = f"10.0.0.{len(board.hosts) + 123}"
+        board.hosts[address] = host
+    return [(AF_INET, SOCK_DGRAM, 0, "", (address, port))]
+
+
+class socket:
+    # Replies arrive latency_ms after sendto() and are read with recvfrom(), blocking with a timeout or non-blocking
+
+    def __init__(self, family:int = AF_INET, type:int = SOCK_DGRAM, proto:int = 0) -> None:
+        self.board = Board.active
+        self.timeout = None
+        self.replies = [] # [arrival time in us, packet, address] in arrival order
+
+    def settimeout(self, timeout:float) -> None:
+        self.timeout = timeout
+
+    def setblocking(self, flag:bool) -> None:
+        self.timeout = None if flag else 0
+
+    def server(self, address:tuple) -> NTP_Server:
+        board = self.board
+        host = board.hosts.get(address[0])
+        return board.ntp_servers.get(host) or NTP_Server(board.ntp_latency_ms, board.ntp_online)
+
+    def sendto(self, data:bytes, address:tuple) -> int:
+        board = self.board
+        board.ntp_queries += 1
+        server = self.server(address)
+        server.queries += 1
+        if server.online:
+            arrival = board.clock.now_us + server.latency_ms * 1000
+            stamped = board.clock.now_us + server.latency_ms * 500 # Halfway, when the server answers
+            seconds = board.clock.utc_start + stamped // 1000000 + server.error_s + NTP_EPOCH
+            fraction = (stamped % 1000000 << 32) // 1000000
+            origin = unpack("!II", data[40:48]) if len(data) >= 48 else (0, 0)
+            first = server.leap << 6 | 4 << 3 | 4 # Version 4, mode 4 (server)
+            self.replies.append([arrival, pack("!BBBb11I", first, server.stratum, 6, -20, 0, 0, 0x47505300, seconds, fraction, *origin, seconds, fraction, seconds, fraction), address])
+            self.replies.sort(key=lambda reply: reply[0])
+        return len(data)
+
+    def ready(self) -> bool:
+        return bool(self.replies) and self.replies[0][0] <= self.board.clock.now_us
+
+    def next_arrival(self) -> int:
+        return self.replies[0][0] if self.replies else None
+
+    def recvfrom(self, size:int) -> tuple:
+        clock = self.board.clock
+        if not self.ready():
+            if self.timeout == 0:
+                raise OSError(11) # EAGAIN
+            arrival = self.next_arrival()
+            limit = None if self.timeout is None else clock.now_us + int(self.timeout * 1000000)
+            if arrival is None or (limit is not None and arrival > limit):
+                if limit is not None: clock.advance_us(limit - clock.now_us)
+                raise OSError(110) # ETIMEDOUT
+            clock.advance_us(arrival - clock.now_us)
+        arrival, reply, address = self.replies.pop(0)
+        return (reply[:size], address)
+
+    def recv(self, size:int) -> bytes:
+        return self.recvfrom(size)[0]
+
+    def close(self) -> None:
+        self.replies = []
+
+
+class poll:
+    # select.poll() for the sockets above, poll() sleeps on the virtual clock until a reply has arrived or the timeout
+
+    def __init__(self) -> None:
+        self.sockets = []
+
+    def register(self, sock, eventmask:int = POLLIN | POLLOUT) -> None:
+        if sock not in self.sockets: self.sockets.append(sock)
+
+    def unregister(self, sock) -> None:
+        if sock in self.sockets: self.sockets.remove(sock)
+
+    def poll(self, timeout:int = -1) -> list:
+        clock = Board.active.clock
+        ready = [(sock, POLLIN) for sock in self.sockets if sock.ready()]
+        if ready or timeout == 0:
+            return ready
+        arrivals = [sock.next_arrival() for sock in self.sockets if sock.next_arrival() is not None]
+        limit = None if timeout < 0 else clock.now_us + timeout * 1000
+        wake = min(arrivals) if arrivals else None
+        if wake is None or (limit is not None and wake > limit):
+            if limit is None: raise OSError(110) # Nothing will ever arrive
+            clock.advance_us(limit - clock.now_us)
+            return []
+        clock.advance_us(wake - clock.now_us)
+        return [(sock, POLLIN) for sock in self.sockets if sock.ready()]
+
+    def ipoll(self, timeout:int = -1, flags:int = 0) -> list:
+        return self.poll(timeout)
+
+
+# _thread stand-in, threads run for real but sleep on the virtual clock
+
+def start_new_thread(function, args:tuple, kwargs:dict = None) -> int:
+    def run():
+        try:
+            function(*args, **(kwargs or {}))
+        except BaseException as e:
+            if not isinstance(e, (SystemExit, Device_Reset, Simulation_Stop)):
+                raise
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread.ident
@@ -0,0 +1,149 @@
+import heapq
+import threading
+from calendar import timegm
+from time import gmtime as _gmtime
+
+TICKS_PERIOD = 1 << 30 # MicroPython's ticks_ms/ticks_us wrap at 2^30
+TICKS_MASK = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD >> 1
+
+
+class Simulation_Stop(BaseException):
+    "Raised from a sleep when the virtual clock reaches the end of the simulation"
+
+
+class Virtual_Clock:
+
+    def __init__(self, utc_start:int = 1681149214, rtc_start:int = 1609459200) -> None:
+        """
+        Monotonic microsecond counter that only moves when the board sleeps.
+        utc_start is the real UTC time at power-on (what NTP answers), rtc_start is what the RTC
+        holds at power-on (the RP2040 comes up at 2021-01-01 00:00:00 until set_RTC is called).
+        rtc_drift_ppm makes the RTC run that much fast (or slow when negative) against real time, like a crystal that is a bit off.
+        """
+        self.now_us = 0
+        self.utc_start = utc_start
+        self.rtc_offset = rtc_start # What the RTC was set to
+        self.rtc_set_us = 0 # and when
+        self.rtc_drift_ppm = 0
+        self.stop_us = None
+        self.stopped = False
+        self.sleep_hooks = []
+        self.alarms = [] # Heap of [time_us, order, function], fired by the driving thread as time passes them
+        self.alarm_order = 0
+        self.interrupted = False
+        self.driver = threading.get_ident() # Only the driving thread moves time, other threads wait for it
+        self.condition = threading.Condition()
+
+    # Clock control
+
+    def advance_us(self, us:int, interruptible:bool = False) -> None:
+        # An interruptible sleep ends early when an alarm calls interrupt(), like an event loop woken by an interrupt
+        deadline = self.now_us + int(us)
+        if threading.get_ident() != self.driver:
+            with self.condition:
+                while self.now_us < deadline and not self.stopped:
+                    self.condition.wait(0.05)
+            if self.stopped: raise Simulation_Stop
+            return
+        for hook in self.sleep_hooks:
+            hook(int(us))
+        self.interrupted = False
+        self.fire_alarms(deadline, interruptible)
+        if self.interrupted and interruptible: deadline = self.now_us
+        stop = self.stop_us is not None and deadline >= self.stop_us
+        with self.condition:
+            self.now_us = self.stop_us if stop else max(self.now_us, deadline) # An alarm may have slept past the deadline
+            self.stopped = stop
+            self.condition.notify_all()
+        if stop: raise Simulation_Stop
+
+    def add_alarm(self, time_us:int, function) -> list:
+        # Calls function() from the driving thread when the clock passes time_us, cancel_alarm() takes it back
+        with self.condition:
+            self.alarm_order += 1
+            alarm = [int(time_us), self.alarm_order, function]
+            heapq.heappush(self.alarms, alarm)
+        return alarm
+
+    def interrupt(self) -> None:
+        # Ends the interruptible sleep that is firing alarms now
+        self.interrupted = True
+
+    def cancel_alarm(self, alarm:list) -> None:
+        alarm[2] = None
+
+    def fire_alarms(self, deadline:int, interruptible:bool = False) -> None:
+        # Stops the clock at every alarm before the deadline, like a timer interrupt in the middle of a sleep
+        while True:
+            if interruptible and self.interrupted: return
+            with self.condition:
+                if not self.alarms or self.alarms[0][0] > deadline: return
+                if self.stop_us is not None and self.alarms[0][0] >= self.stop_us: return
+                time_us, order, function = heapq.heappop(self.alarms)
+                if function is None: continue
+                self.now_us = max(self.now_us, time_us)
+                self.condition.notify_all()
+            function()
+
+    def run_for(self, seconds:float) -> None:
+        self.stop_us = self.now_us + int(seconds * 1000000)
+        self.stopped = False
+
+    def stop(self) -> None:
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def utc(self) -> int:
+        return self.utc_start + self.now_us // 1000000
+
+    def set_rtc(self, seconds:int) -> None:
+        # Setting the RTC starts a new second, like on the RP2040
+        self.rtc_offset = seconds
+        self.rtc_set_us = self.now_us
+
+    def rtc_us(self) -> int:
+        # Microseconds the RTC has counted since it was set
+        elapsed = self.now_us - self.rtc_set_us
+        return elapsed + int(elapsed * self.rtc_drift_ppm) // 1000000
+
+    # MicroPython time module
+
+    def sleep(self, seconds:float) -> None:
+        self.advance_us(seconds * 1000000)
+
+    def sleep_ms(self, ms:int) -> None:
+        self.advance_us(ms * 1000)
+
+    def sleep_us(self, us:int) -> None:
+        self.advance_us(us)
+
+    def ticks_ms(self) -> int:
+        return (self.now_us // 1000) & TICKS_MASK
+
+    def ticks_us(self) -> int:
+        return self.now_us & TICKS_MASK
+
+    def ticks_add(self, ticks:int, delta:int) -> int:
+        return (ticks + delta) & TICKS_MASK
+
+    def ticks_diff(self, ticks1:int, ticks2:int) -> int:
+        return ((ticks1 - ticks2 + TICKS_HALFPERIOD) & TICKS_MASK) - TICKS_HALFPERIOD
+
+    def time(self) -> int:
+        return self.rtc_offset + self.rtc_us() // 1000000
+
+    def time_ns(self) -> int:
+        return self.rtc_offset * 1000000000 + self.rtc_us() * 1000
+
+    def gmtime(self, seconds:int = None) -> tuple:
+        if seconds is None: seconds = self.time()
+        t = _gmtime(seconds)
+        return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, t.tm_wday, t.tm_yday)
+
+    def localtime(self, seconds:int = None) -> tuple:
+        return self.gmtime(seconds) # MicroPython has no timezone database, localtime is the RTC time
+
+    def mktime(self, time_tuple:tuple) -> int:
+        return timegm(tuple(time_tuple[:6]) + (0, 0, 0))
@@ -0,0 +1,117 @@
+import builtins
+import os
+from types import ModuleType
+
+
+class Power_Loss(BaseException):
+    "Raised in the middle of a flash write when Flash.power_loss_at_write is reached"
+
+
+class Flash_File:
+    "File object handed to the firmware, counts the bytes that go to and from flash"
+
+    def __init__(self, flash, file) -> None:
+        self.flash = flash
+        self.file = file
+
+    def read(self, *args):
+        data = self.file.read(*args)
+        self.flash.bytes_read += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        size = self.file.readinto(buffer)
+        self.flash.bytes_read += size or 0
+        return size
+
+    def readline(self, *args):
+        data = self.file.readline(*args)
+        self.flash.bytes_read += len(data)
+        return data
+
+    def write(self, data) -> int:
+        if self.flash.power_loss_at_write is not None:
+            self.flash.power_loss_at_write -= 1
+            if self.flash.power_loss_at_write <= 0:
+                self.flash.power_loss_at_write = None
+                self.file.write(data[:len(data) // 2]) # Half of the data reached flash
+                self.file.close()
+                raise Power_Loss
+        size = self.file.write(data)
+        self.flash.bytes_written += len(data)
+        self.flash.writes += 1
+        return size
+
+    def __getattr__(self, name:str):
+        return getattr(self.file, name)
+
+    def __iter__(self):
+        return iter(self.readline, self.file.read(0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.file.close()
+
+
+class Flash:
+    """
+    The simulated flash filesystem is a directory on the host. The firmware gets an os module and
+    an open() that work on that directory and count every open, listdir, write and rename.
+    """
+
+    def __init__(self, root:str) -> None:
+        self.root = root
+        self.real_open = builtins.open
+        self.power_loss_at_write = None # Counts down on every write, the write that reaches 0 loses power halfway
+        self.reset_counters()
+
+    def reset_counters(self) -> None:
+        self.opens = 0
+        self.opens_for_write = 0
+        self.listdirs = 0
+        self.writes = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.renames = 0
+        self.removes = 0
+
+    def counters(self) -> dict:
+        return {"opens": self.opens, "opens_for_write": self.opens_for_write, "listdirs": self.listdirs, "writes": self.writes,
+                "bytes_read": self.bytes_read, "bytes_written": self.bytes_written, "renames": self.renames, "removes": self.removes}
+
+    def path(self, name:str) -> str:
+        return os.path.join(self.root, name)
+
+    def open(self, name:str, mode:str = "r", *args, **kwargs):
+        self.opens += 1
+        if any(flag in mode for flag in "wax+"): self.opens_for_write += 1
+        return Flash_File(self, self.real_open(self.path(name), mode, *args, **kwargs))
+
+    def listdir(self, directory:str = "") -> list:
+        self.listdirs += 1
+        return sorted(os.listdir(self.path(directory)))
+
+    def remove(self, name:str) -> None:
+        self.removes += 1
+        os.remove(self.path(name))
+
+    def rename(self, old:str, new:str) -> None:
+        self.renames += 1
+        os.replace(self.path(old), self.path(new)) # LittleFS on the Pico replaces the target like os.replace
+
+    def stat(self, name:str):
+        return os.stat(self.path(name)) # Indexes like the MicroPython tuple, [6] is the size
+
+    def module(self) -> ModuleType:
+        # The host's os stays underneath, host libraries imported while the simulator is installed still work
+        module = ModuleType("os")
+        module.__dict__.update(os.__dict__)
+        module.listdir = self.listdir
+        module.remove = self.remove
+        module.rename = self.rename
+        module.stat = self.stat
+        module.uname = lambda: ("rp2", "rp2", "1.19.1", "v1.19.1", "Raspberry Pi Pico W with RP2040")
+        module.statvfs = lambda path = "/": (4096, 4096, 212, 200, 200, 0, 0, 0, 0, 255)
+        return module
@@ -0,0 +1,310 @@
+"""
+The original implementations of code that has since been optimised, kept as the "before" side of the benchmarks in simulator.bench.
+Import these only while a Simulator is installed, they use the simulated flash filesystem like the firmware does.
+"""
+from os import listdir
+from time import sleep, sleep_ms, gmtime, mktime, localtime
+from socket import socket, getaddrinfo, AF_INET, SOCK_DGRAM
+from struct import unpack
+
+
+class Files:
+
+    def __init__(self) -> None:
+        self.SETTINGS_FILE = "settings.file"
+
+    def read_settings(self) -> dict:
+        try:
+            if not self.SETTINGS_FILE in listdir():
+                raise NameError("File does not exist")
+            file = open(self.SETTINGS_FILE,"r")
+            contents = file.read()
+            settings_dict = {}
+            contents = contents.strip(",")
+            for kv in contents.split(","):
+                if kv == "None:None":
+                    pass
+                else:
+                    key, value = kv.split(":")
+                    settings_dict[key] = value
+            file.close()
+            return settings_dict
+        except Exception as e:
+            file = open(self.SETTINGS_FILE,"w")
+            file.close()
+            return {None:None}
+
+    def write_settings(self, new_settings_dict:dict) -> None:
+        settings_dict = self.read_settings()
+        settings_dict.update(new_settings_dict)
+        settings_str = ""
+        file = open(self.SETTINGS_FILE,"w")
+        for each in settings_dict:
+            settings_str += f"{each}:{settings_dict[each]},"
+        file.write(settings_str)
+        file.close()
+
+    # Lets the current callers run, these do what the callers used to do themselves
+
+    def transaction(self):
+        return No_Transaction() # Every change went straight to flash
+
+    def get_setting(self, key:str, default = None):
+        settings = self.read_settings()
+        try:
+            return int(settings[key])
+        except (KeyError, ValueError):
+            return default
+
+
+class No_Transaction:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+
+def read_timezone(time) -> tuple:
+    settings = time.files.read_settings()
+    try:
+        timezone = int(settings["timezone"])
+        tz_expiry = int(settings["tz_expiry"])
+        return(timezone, tz_expiry)
+    except KeyError:
+        return(None, None)
+    except TypeError:
+        return(None, None)
+
+
+def check_timezone(time, current_unixtime:int) -> int:
+    # Time.check_timezone, one write_settings per key
+    timezone, tz_expiry = read_timezone(time)
+    if (timezone == None or tz_expiry == None) or current_unixtime > tz_expiry:
+        timezone, tz_expiry = get_timezone(time)
+        time.files.write_settings({"tz_expiry":tz_expiry})
+        time.files.write_settings({"timezone":timezone})
+    return timezone
+
+
+def get_timezone(self) -> tuple:
+    # Time.get_timezone, a year of days looked at one by one after an NTP query
+    # Sommertid (UTC+2) starter den sidste søndag i marts
+    # Normaltid (UTC+1) starter den sidste søndag i oktober
+    now_unix = self.ntp_fetch_unix_time()
+    time_tuple = gmtime(int(now_unix))
+    
+    def strip_time_from_unix(unix_time:int) -> int:
+        hours = gmtime(unix_time)[3] * 3600
+        minutes = gmtime(unix_time)[4] * 60
+        seconds = gmtime(unix_time)[5]
+        return unix_time - (hours + minutes + seconds)
+
+    last_sunday_march = 0
+    last_sunday_october = 0
+    now_date = strip_time_from_unix(int(now_unix))
+    day = 3600 * 24
+
+    for counter in range(365):
+        time = int(now_date + counter * day)
+        time_tuple = gmtime(time)
+        if time_tuple[1] == 3 and time_tuple[6] == 6:
+            last_sunday_march = time
+        elif time_tuple[1] == 10 and time_tuple[6] == 6:
+            last_sunday_october = time
+    next_summertime = last_sunday_march
+    next_normaltime = last_sunday_october
+
+    if next_summertime < next_normaltime:
+        return (1, next_summertime) # Format: (Tidszone nu (UTC+#), Næste skift)
+    else:
+        return (2, next_normaltime) # Format: (Tidszone nu (UTC+#), Næste skift)
+
+
+# LED_Strip methods, called with the LED_Strip as self. write was added to led_on and led_off for the animation effects
+
+def ntp_fetch_unix_time(self, host:str = "pool.ntp.org", port:int = 123) -> int:
+    # Time.ntp_fetch_unix_time, one server asked every 2 seconds until it answers, whatever it answers
+    NTP_EPOCH = 2208988800 # 1970-01-01 00:00:00
+    NTP_QUERY = b"\x23" + (47 * b"\0")
+    sockaddr = getaddrinfo(host, port)[0][-1]
+    sock = socket(AF_INET, SOCK_DGRAM)
+    sock.settimeout(2.0)
+    msg = None
+    while msg == None:
+        try:
+            sock.sendto(NTP_QUERY, sockaddr)
+            print("NTP query sent - waiting 2s for response")
+            msg, address = sock.recvfrom(1024)
+        except OSError:
+            print("Timeout waiting for UDP-package!")
+    sock.close()
+    value = unpack("!I", msg[40:44])[0]
+    time = int(value - NTP_EPOCH)
+    return time
+
+
+def sync_clock(time) -> None:
+    # Startup.sync_clock and Time.time_now, the RTC set from NTP and nothing kept about how it runs
+    utc = time.ntp_fetch_unix_time()
+    time.set_RTC(gmtime(time.apply_timezone(utc)))
+
+
+def maintain_clock(time) -> None:
+    # The clock part of main.maintain_network, NTP again every time summer or normal time starts
+    tz_offset, tz_expiry = time.read_timezone()
+    if tz_expiry == None or tz_offset == None or mktime(localtime()) - tz_offset >= tz_expiry:
+        sync_clock(time)
+
+
+class Stopwatch:
+    # device.Stopwatch, whole seconds from the RTC
+
+    def __init__(self) -> None:
+        self.start_time = mktime(localtime())
+        self.lap_times = []
+
+    def get_time(self) -> int:
+        start = self.start_time
+        time = mktime(localtime())
+        delta = time - start
+        return delta
+
+
+def wifi_connect(self, ssid:str = "", password:str = "", timeout:int = 5, tries:int = 3) -> bool:
+    # WiFi.connect, checking every second on the Stopwatch above. True when connected instead of raising WiFiError
+    for i in range(tries):
+        stopwatch = Stopwatch()
+        if ssid == "" or password == "":
+            ssid = self.default_ssid
+            password = self.default_pass
+        self.wlan.active(True)
+        self.wlan.connect(ssid, password)
+        while self.wlan.isconnected() == False:
+            if stopwatch.get_time() >= timeout: break # Timeout
+            print('Waiting for Wi-Fi connection...', stopwatch.get_time())
+            sleep_ms(1000)
+        if self.wlan.isconnected() == True:
+            print(self.wlan.ifconfig())
+            break
+        else:
+            print(f"Failed to connect to WiFi on try {i+1} of {tries}")
+    return self.wlan.isconnected()
+
+
+def led_on(self, color:tuple, write:bool = True) -> None:
+    LED_R = int((color[0] / 100) * self.LED_BRIGHTNESS)
+    LED_G = int((color[1] / 100) * self.LED_BRIGHTNESS)
+    LED_B = int((color[2] / 100) * self.LED_BRIGHTNESS)
+
+    for i in range(self.LED_PIXELS):
+        self.led_strip[i] = (LED_R, LED_G, LED_B)
+    if write: self.led_strip.write()
+
+
+def led_on_single(self, pixel:int, color:tuple, write:bool = True) -> None:
+    LED_R = int((color[0] / 100) * self.LED_BRIGHTNESS)
+    LED_G = int((color[1] / 100) * self.LED_BRIGHTNESS)
+    LED_B = int((color[2] / 100) * self.LED_BRIGHTNESS)
+
+    self.led_strip[pixel] = (LED_R, LED_G, LED_B)
+    if write: self.led_strip.write()
+
+
+def led_off(self, write:bool = True) -> None:
+    for i in range(self.LED_PIXELS):
+        self.led_strip[i] = (0, 0, 0)
+    if write: self.led_strip.write()
+
+
+def hue_to_rgb(self, angle:int) -> tuple:
+        # Inspiration: Ontaelio(2016?) https://www.instructables.com/How-to-Make-Proper-Rainbow-and-Random-Colors-With-/
+        if angle < 60:
+            red = 255; green = round(angle*4.25-0.01); blue = 0
+        elif angle < 120:
+            red = round((120-angle)*4.25-0.01); green = 255; blue = 0
+        elif angle < 180:
+            red = 0; green = 255; blue = round((angle-120)*4.25-0.01)
+        elif angle < 240:
+            red = 0; green = round((240-angle)*4.25-0.01); blue = 255
+        elif angle < 300:
+            red = round((angle-240)*4.25-0.01); green = 0; blue = 255
+        else:
+            red = 255; green = 0; blue = round((360-angle)*4.25-0.01)
+        return (red, green, blue)
+
+
+# Step_Motor method, called with a Step_Motor that has stepper_in1-4 set to the coil pins
+
+def stepper_rotate(self, steps:int, time:float, direction:int = 1) -> None:
+    delay = time / steps
+    if direction == 1:
+        SEQUENCE = [[1, 0, 0, 1],
+                    [1, 0, 0, 0],
+                    [1, 1, 0, 0],
+                    [0, 1, 0, 0],
+                    [0, 1, 1, 0],
+                    [0, 0, 1, 0],
+                    [0, 0, 1, 1],
+                    [0, 0, 0, 1]]
+    else: 
+        SEQUENCE = [[0, 0, 0, 1],
+                    [0, 0, 1, 1],
+                    [0, 0, 1, 0],
+                    [0, 1, 1, 0],
+                    [0, 1, 0, 0],
+                    [1, 1, 0, 0],
+                    [1, 0, 0, 0],
+                    [1, 0, 0, 1]]
+    
+    for _ in range(steps):
+        for step in range(8):
+            self.stepper_in1.value(SEQUENCE[step][0])
+            self.stepper_in2.value(SEQUENCE[step][1])
+            self.stepper_in3.value(SEQUENCE[step][2])
+            self.stepper_in4.value(SEQUENCE[step][3])
+            sleep(delay)
+    print(f"Motor turning\n") # <------------------------------------------------------------------------------------------------------- #DEBUG
+    self.stepper_in1.value(0)
+    self.stepper_in2.value(0)
+    self.stepper_in3.value(0)
+    self.stepper_in4.value(0)
+
+
+# Moisture methods, one read_u16() per reading
+
+def read_moisture(self) -> int:
+    sleep_ms(25)
+    value = int(self.sensor_data.read_u16())
+    if self.debug_terminal: print(f"Moisture Value: {value}") # <----------------------------------- #DEBUG
+    return value
+
+def moisture_percent(self, reading:int = None) -> int:
+    if reading == None: reading = read_moisture(self) # A reading can be passed in to time only the conversion
+    reading -= self.MIN_VALUE
+    reading = - reading + self.MIN_VALUE_ADJUSTED
+    percent = int(round((reading / self.MIN_VALUE_ADJUSTED) * 100))
+    if self.debug_terminal: print(f"Moisture Percent: {percent}%") # <---------------------------- #DEBUG
+    return percent
+
+
+# Microcontroller methods, reading the DIP switch pins on every call
+
+def check_setting_wetness(self) -> str:
+    if self.input_wet.value() == 1:
+        return "wet"
+    elif self.input_wet.value() == 0 and self.input_dry.value() == 0:
+        return "normal"
+    elif self.input_dry.value() == 1:
+        return "dry"
+    else: return "error"
+
+def check_setting_turn_rate(self) -> int:
+    if self.input_2wk.value() == 1:
+        return 2
+    elif self.input_2wk.value() == 0 and self.input_6wk.value() == 0:
+        return 4
+    elif self.input_6wk.value() == 1:
+        return 6  
+    else: return 0